@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of convert_hf_to_gguf.py on synthetic checkpoints
+Generates HF checkpoints of the given sizes on local disk, for each architecture:
+  llama    dense LlamaForCausalLM, in BF16
+  mixtral  MixtralForCausalLM, with its experts in block_sparse_moe, in BF16
+  gpt-oss  GptOssForCausalLM, with its experts in MXFP4
+  gptq     LlamaForCausalLM quantized with GPTQ (4 bits, groups of 128)
+then converts each of them to every --outtype, each conversion in its own process with --profile,
+and appends the throughput, the peak memory and the tensor counts to a CSV (see plot_conversion.py)
+
+The throughput is the size of the checkpoint over the time of the whole conversion (throughput_GB_s),
+which includes the startup of the converter, and over the time of the tensors phase only (tensors_GB_s),
+which is where the tensors are read, converted and written
+
+The values of the tensors are random, so only the number of tensors of the outputs is recorded, not their content
+"""
+
+import argparse
+import json
+import math
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+UTILS_DIR = Path(__file__).resolve().parents[2] / 'utils'
+sys.path.insert(0, str(UTILS_DIR))
+
+import gguf  # noqa: E402
+
+ARCHITECTURES = ('llama', 'mixtral', 'gpt-oss', 'gptq')
+
+# the tokenizer of the synthetic checkpoints is a byte-level BPE like gpt-2's, but its pre-tokenizer isn't a known one
+RUNNER = ('import sys, convert_hf_to_gguf as c; '
+          'c.TextModel.get_vocab_base_pre = lambda self, tokenizer: "gpt-2"; '
+          'sys.argv[0] = c.__file__; c.main()')
+
+GPTQ_GROUP_SIZE = 128
+
+# (name, safetensors dtype, shape, content)
+TensorSpec = tuple[str, str, tuple[int, ...], str]
+
+DTYPE_SIZES = {'BF16': 2, 'F16': 2, 'F32': 4, 'U8': 1, 'I32': 4}
+
+
+def parse_size(size: str) -> int:
+    units = {'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+    if size[-1:].upper() in units:
+        return int(float(size[:-1]) * units[size[-1:].upper()])
+    return int(size)
+
+
+def tensor_specs(arch: str, n_layers: int, hidden: int, experts: int, vocab: int) -> list[TensorSpec]:
+    n_head = hidden // 64
+    n_head_kv = max(n_head // 4, 1)
+    head_dim = hidden // n_head
+    ff = 256 * math.ceil(hidden * 8 / 3 / 256)
+    specs: list[TensorSpec] = [
+        ('model.embed_tokens.weight', 'BF16', (vocab, hidden), 'normal'),
+        ('model.norm.weight', 'BF16', (hidden,), 'normal'),
+        ('lm_head.weight', 'BF16', (vocab, hidden), 'normal'),
+    ]
+    for i in range(n_layers):
+        p = f'model.layers.{i}.'
+        specs += [(p + 'input_layernorm.weight', 'BF16', (hidden,), 'normal'),
+                  (p + 'post_attention_layernorm.weight', 'BF16', (hidden,), 'normal')]
+        linears = [
+            ('self_attn.q_proj', n_head * head_dim, hidden),
+            ('self_attn.k_proj', n_head_kv * head_dim, hidden),
+            ('self_attn.v_proj', n_head_kv * head_dim, hidden),
+            ('self_attn.o_proj', hidden, n_head * head_dim),
+        ]
+        if arch == 'gpt-oss':
+            for name, n_out, _ in linears:
+                specs.append((p + name + '.bias', 'BF16', (n_out,), 'normal'))
+            specs += [(p + 'self_attn.sinks', 'BF16', (n_head,), 'normal'),
+                      (p + 'mlp.router.weight', 'BF16', (experts, hidden), 'normal'),
+                      (p + 'mlp.router.bias', 'BF16', (experts,), 'normal')]
+            # the experts have an intermediate size of hidden, like gpt-oss
+            for name, n_out, n_in in (('gate_up_proj', 2 * hidden, hidden), ('down_proj', hidden, hidden)):
+                specs += [(p + f'mlp.experts.{name}_blocks', 'U8', (experts, n_out, n_in // 32, 16), 'bytes'),
+                          (p + f'mlp.experts.{name}_scales', 'U8', (experts, n_out, n_in // 32), 'e8m0'),
+                          (p + f'mlp.experts.{name}_bias', 'BF16', (experts, n_out), 'normal')]
+        elif arch == 'mixtral':
+            specs.append((p + 'block_sparse_moe.gate.weight', 'BF16', (experts, hidden), 'normal'))
+            for x in range(experts):
+                linears += [(f'block_sparse_moe.experts.{x}.w1', ff, hidden),
+                            (f'block_sparse_moe.experts.{x}.w2', hidden, ff),
+                            (f'block_sparse_moe.experts.{x}.w3', ff, hidden)]
+        else:
+            linears += [('mlp.gate_proj', ff, hidden), ('mlp.up_proj', ff, hidden), ('mlp.down_proj', hidden, ff)]
+        for name, n_out, n_in in linears:
+            if arch == 'gptq':
+                n_groups = n_in // GPTQ_GROUP_SIZE
+                specs += [(p + name + '.qweight', 'I32', (n_in // 8, n_out), 'bytes'),
+                          (p + name + '.qzeros', 'I32', (n_groups, n_out // 8), 'bytes'),
+                          (p + name + '.scales', 'F16', (n_groups, n_out), 'scale'),
+                          (p + name + '.g_idx', 'I32', (n_in,), 'g_idx')]
+            else:
+                specs.append((p + name + '.weight', 'BF16', (n_out, n_in), 'normal'))
+    return specs
+
+
+def spec_nbytes(specs: list[TensorSpec]) -> int:
+    return sum(DTYPE_SIZES[dtype] * math.prod(shape) for _, dtype, shape, _ in specs)
+
+
+def n_layers_for_size(arch: str, size: int, hidden: int, experts: int, vocab: int) -> int:
+    base = spec_nbytes(tensor_specs(arch, 0, hidden, experts, vocab))
+    per_layer = spec_nbytes(tensor_specs(arch, 1, hidden, experts, vocab)) - base
+    return max(round((size - base) / per_layer), 1)
+
+
+class Pools:
+    # random data repeated in all the tensors, generating all of it would take longer than converting it
+    def __init__(self, seed: int, n: int = 4 * 1024 * 1024):
+        rng = np.random.default_rng(seed)
+        normal = rng.standard_normal(n, dtype=np.float32) * 0.02
+        self.rng = rng
+        self.pools = {
+            'normal': {
+                'BF16': (normal.view(np.uint32) >> 16).astype(np.uint16).tobytes(),
+                'F16': normal.astype(np.float16).tobytes(),
+                'F32': normal.tobytes(),
+            },
+            'bytes': rng.integers(0, 256, 4 * n, dtype=np.uint8).tobytes(),
+            # exponents of the MXFP4 blocks, around 2^0
+            'e8m0': rng.integers(118, 130, n, dtype=np.uint8).tobytes(),
+            'scale': (np.abs(normal) * 0.5 + 0.001).astype(np.float16).tobytes(),
+        }
+
+    def write(self, f, dtype: str, shape: tuple[int, ...], content: str):
+        n_bytes = DTYPE_SIZES[dtype] * math.prod(shape)
+        if content == 'g_idx':
+            f.write((np.arange(shape[0], dtype=np.int32) // GPTQ_GROUP_SIZE).tobytes())
+            return
+        pool = self.pools[content]
+        if isinstance(pool, dict):
+            pool = pool[dtype]
+        itemsize = DTYPE_SIZES[dtype]
+        start = int(self.rng.integers(0, len(pool) // itemsize)) * itemsize
+        while n_bytes > 0:
+            chunk = memoryview(pool)[start:start + n_bytes]
+            f.write(chunk)
+            n_bytes -= len(chunk)
+            start = 0
+
+
+def write_tokenizer(path: Path):
+    # gpt-2's mapping of the bytes to printable characters, without any merges
+    printable = [*range(ord('!'), ord('~') + 1), *range(ord('¡'), ord('¬') + 1), *range(ord('®'), ord('ÿ') + 1)]
+    chars: dict[int, str] = {}
+    n = 0
+    for b in range(256):
+        if b in printable:
+            chars[b] = chr(b)
+        else:
+            chars[b] = chr(256 + n)
+            n += 1
+    vocab = {chars[b]: b for b in range(256)}
+    special = ['<|begin_of_text|>', '<|end_of_text|>']
+    vocab.update({s: 256 + i for i, s in enumerate(special)})
+    tokenizer = {
+        'version': '1.0',
+        'truncation': None,
+        'padding': None,
+        'added_tokens': [{'id': vocab[s], 'content': s, 'single_word': False, 'lstrip': False, 'rstrip': False,
+                          'normalized': False, 'special': True} for s in special],
+        'normalizer': None,
+        'pre_tokenizer': {'type': 'ByteLevel', 'add_prefix_space': False, 'trim_offsets': True, 'use_regex': True},
+        'post_processor': None,
+        'decoder': {'type': 'ByteLevel', 'add_prefix_space': True, 'trim_offsets': True, 'use_regex': True},
+        'model': {'type': 'BPE', 'dropout': None, 'unk_token': None, 'continuing_subword_prefix': None, 'end_of_word_suffix': None,
+                  'fuse_unk': False, 'byte_fallback': False, 'ignore_merges': False, 'vocab': vocab, 'merges': []},
+    }
+    with open(path / 'tokenizer.json', 'w', encoding='utf-8') as f:
+        json.dump(tokenizer, f, ensure_ascii=False)
+    with open(path / 'tokenizer_config.json', 'w', encoding='utf-8') as f:
+        json.dump({'tokenizer_class': 'PreTrainedTokenizerFast', 'bos_token': special[0], 'eos_token': special[1]}, f)
+
+
+def write_config(path: Path, arch: str, n_layers: int, hidden: int, experts: int, vocab: int):
+    n_head = hidden // 64
+    config = {
+        'architectures': ['LlamaForCausalLM'], 'model_type': 'llama', 'hidden_size': hidden,
+        'intermediate_size': 256 * math.ceil(hidden * 8 / 3 / 256), 'num_attention_heads': n_head,
+        'num_key_value_heads': max(n_head // 4, 1), 'num_hidden_layers': n_layers, 'vocab_size': vocab,
+        'rms_norm_eps': 1e-5, 'max_position_embeddings': 4096, 'rope_theta': 500000.0,
+        'bos_token_id': 256, 'eos_token_id': 257, 'torch_dtype': 'bfloat16',
+    }
+    if arch == 'mixtral':
+        config.update(architectures=['MixtralForCausalLM'], model_type='mixtral', num_local_experts=experts, num_experts_per_tok=2)
+    elif arch == 'gpt-oss':
+        config.update(
+            architectures=['GptOssForCausalLM'], model_type='gpt_oss', intermediate_size=hidden, head_dim=hidden // n_head,
+            num_local_experts=experts, num_experts_per_tok=4, experts_per_token=4, sliding_window=128,
+            layer_types=['sliding_attention' if i % 2 == 0 else 'full_attention' for i in range(n_layers)],
+            rope_theta=150000.0, rope_scaling={'rope_type': 'yarn', 'factor': 32.0, 'original_max_position_embeddings': 4096,
+                                               'beta_fast': 32.0, 'beta_slow': 1.0},
+            quantization_config={'quant_method': 'mxfp4', 'modules_to_not_convert': []})
+    elif arch == 'gptq':
+        config.update(quantization_config={'quant_method': 'gptq', 'bits': 4, 'group_size': GPTQ_GROUP_SIZE, 'desc_act': False, 'sym': True})
+    with open(path / 'config.json', 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+
+def write_checkpoint(path: Path, arch: str, size: int, hidden: int, experts: int, vocab: int, shard_size: int, seed: int) -> tuple[int, int]:
+    # returns the number of tensors and their size in bytes
+    n_layers = n_layers_for_size(arch, size, hidden, experts, vocab)
+    specs = tensor_specs(arch, n_layers, hidden, experts, vocab)
+    pools = Pools(seed)
+
+    shards: list[list[TensorSpec]] = [[]]
+    shard_bytes = 0
+    for spec in specs:
+        n_bytes = spec_nbytes([spec])
+        if shards[-1] and shard_bytes + n_bytes > shard_size:
+            shards.append([])
+            shard_bytes = 0
+        shards[-1].append(spec)
+        shard_bytes += n_bytes
+
+    path.mkdir(parents=True)
+    weight_map: dict[str, str] = {}
+    for i, shard in enumerate(shards):
+        file_name = f'model-{i + 1:05d}-of-{len(shards):05d}.safetensors'
+        header: dict[str, dict] = {'__metadata__': {'format': 'pt'}}
+        offset = 0
+        for name, dtype, shape, _ in shard:
+            n_bytes = spec_nbytes([(name, dtype, shape, '')])
+            header[name] = {'dtype': dtype, 'shape': list(shape), 'data_offsets': [offset, offset + n_bytes]}
+            weight_map[name] = file_name
+            offset += n_bytes
+        header_bytes = json.dumps(header).encode()
+        header_bytes += b' ' * (-len(header_bytes) % 8)
+        with open(path / file_name, 'wb') as f:
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for _, dtype, shape, content in shard:
+                pools.write(f, dtype, shape, content)
+    total = spec_nbytes(specs)
+    with open(path / 'model.safetensors.index.json', 'w', encoding='utf-8') as f:
+        json.dump({'metadata': {'total_size': total}, 'weight_map': weight_map}, f)
+    write_config(path, arch, n_layers, hidden, experts, vocab)
+    write_tokenizer(path)
+    return len(specs), total
+
+
+def n_params(path: Path) -> int:
+    with open(path / 'model.safetensors.index.json', encoding='utf-8') as f:
+        files = sorted(set(json.load(f)['weight_map'].values()))
+    total = 0
+    for file_name in files:
+        with open(path / file_name, 'rb') as f:
+            header = json.loads(f.read(int.from_bytes(f.read(8), 'little')))
+        for name, info in header.items():
+            if name == '__metadata__':
+                continue
+            # the packed weights hold several parameters per element
+            n = math.prod(info['shape'])
+            if name.endswith('.qweight'):
+                n *= 8
+            elif name.endswith('_blocks'):
+                n *= 2
+            total += n
+    return total
+
+
+def convert(model_dir: Path, outtype: str, out_dir: Path, extra_args: list[str]) -> tuple[float, dict, int, int] | None:
+    # returns the wall time, the summary of the profile, the number of tensors and the size of the output
+    outfile = out_dir / f'{model_dir.name}-{outtype}.gguf'
+    trace = out_dir / f'{model_dir.name}-{outtype}.json'
+    log = out_dir / f'{model_dir.name}-{outtype}.log'
+    args = [sys.executable, '-c', RUNNER, str(model_dir), '--outtype', outtype, '--outfile', str(outfile), '--profile', str(trace), *extra_args]
+    start = time.perf_counter()
+    with open(log, 'w', encoding='utf-8') as f:
+        result = subprocess.run(args, cwd=UTILS_DIR, stdout=f, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        print(f'    failed, see {log}:')
+        print(''.join(f'      {line}' for line in log.read_text(encoding='utf-8').splitlines(keepends=True)[-5:]), end='')
+        return None
+    with open(trace, encoding='utf-8') as f:
+        summary = json.load(f)['otherData']
+    n_tensors = len(gguf.GGUFReader(outfile).tensors)
+    size = outfile.stat().st_size
+    outfile.unlink()
+    return wall, summary, n_tensors, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--arch', default=','.join(ARCHITECTURES), help=f'comma-separated architectures, among {", ".join(ARCHITECTURES)}')
+    parser.add_argument('--sizes', default='256M,1G', help='comma-separated approximate sizes of the checkpoints, in bytes (K, M, G suffixes)')
+    parser.add_argument('--outtype', default='f16,bf16,q8_0', help='comma-separated output types')
+    parser.add_argument('--hidden-size', type=int, default=1024)
+    parser.add_argument('--experts', type=int, default=8, help='number of experts of mixtral and gpt-oss')
+    parser.add_argument('--vocab-size', type=int, default=32000)
+    parser.add_argument('--shard-size', default='2G', help='maximum size of the safetensors files')
+    parser.add_argument('--convert-args', default='', help='extra arguments of convert_hf_to_gguf.py, e.g. "--threads 8"')
+    parser.add_argument('--label', default='current', help='name of the converter version in the CSV, to compare versions')
+    parser.add_argument('--csv', type=Path, default=Path(__file__).resolve().parent / 'conversion_benchmarks.csv',
+                        help='CSV to append the results to')
+    parser.add_argument('--work-dir', type=Path, default=None, help='where the checkpoints are generated and kept; by default, a temporary directory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    archs = args.arch.split(',')
+    for arch in archs:
+        if arch not in ARCHITECTURES:
+            parser.error(f'unknown architecture {arch!r}')
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    outtypes = args.outtype.split(',')
+    extra_args = shlex.split(args.convert_args)
+
+    columns = ['label', 'model', 'arch', 'outtype', 'args', 'size_GiB', 'params_B', 'tensors_in', 'tensors_out',
+               'output_GiB', 'wall_s', 'tensors_s', 'throughput_GB_s', 'tensors_GB_s', 'peak_rss_GiB']
+    new_csv = not args.csv.is_file()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, open(args.csv, 'a', encoding='utf-8') as csv:
+        work_dir = args.work_dir or Path(tmp_dir)
+        out_dir = work_dir / 'out'
+        out_dir.mkdir(parents=True, exist_ok=True)
+        if new_csv:
+            csv.write(','.join(columns) + '\n')
+        for arch in archs:
+            for size in sizes:
+                model_dir = work_dir / f'{arch}-{size / 1e9:g}G'
+                if model_dir.is_dir():
+                    with open(model_dir / 'model.safetensors.index.json', encoding='utf-8') as f:
+                        weight_map = json.load(f)
+                    n_tensors_in, total = len(weight_map['weight_map']), weight_map['metadata']['total_size']
+                else:
+                    start = time.perf_counter()
+                    n_tensors_in, total = write_checkpoint(model_dir, arch, size, args.hidden_size, args.experts, args.vocab_size,
+                                                           parse_size(args.shard_size), args.seed)
+                    print(f'{model_dir.name}: generated {n_tensors_in} tensors, {total / 1024 ** 3:.2f} GiB in {time.perf_counter() - start:.1f}s')
+                params = n_params(model_dir)
+                for outtype in outtypes:
+                    result = convert(model_dir, outtype, out_dir, extra_args)
+                    if result is None:
+                        continue
+                    wall, summary, n_tensors_out, output_size = result
+                    tensors_s = summary['phases'].get('tensors', 0.0)
+                    peak_rss = summary['peak_rss'] or 0
+                    row = [args.label, model_dir.name, arch, outtype, shlex.join(extra_args), f'{total / 1024 ** 3:.3f}', f'{params / 1e9:.3f}',
+                           n_tensors_in, n_tensors_out, f'{output_size / 1024 ** 3:.3f}', f'{wall:.2f}', f'{tensors_s:.2f}',
+                           f'{total / 1e9 / wall:.3f}', f'{total / 1e9 / tensors_s:.3f}' if tensors_s > 0 else '', f'{peak_rss / 1024 ** 3:.3f}']
+                    csv.write(','.join(f'"{v}"' if isinstance(v, str) and ',' in v else str(v) for v in row) + '\n')
+                    csv.flush()
+                    print(f'  {outtype:>5}: {wall:6.2f}s ({tensors_s:.2f}s converting the tensors), {total / 1e9 / wall:.3f} GB/s, '
+                          f'{peak_rss / 1024 ** 3:.2f} GiB peak RSS, {n_tensors_in} -> {n_tensors_out} tensors')
+    print(f'results appended to {args.csv}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the startup time of convert_hf_to_gguf.py
+Times, in fresh interpreters, the import of the converter and --print-supported-models,
+with torch and transformers imported lazily (after) and eagerly at startup like before (before)
+
+Also reports which of the heavy modules were imported by the bare import of the converter
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+UTILS_DIR = Path(__file__).resolve().parents[2] / 'utils'
+
+HEAVY_MODULES = ('torch', 'transformers')
+
+# the previous version imported these at the top of the converter
+EAGER_IMPORTS = 'import torch; torch.Tensor; from transformers import AutoConfig; '
+
+CASES = {
+    'import': ['-c', 'import convert_hf_to_gguf'],
+    '--print-supported-models': ['-c', 'import sys, runpy; sys.argv = ["convert_hf_to_gguf.py", "--print-supported-models"]; '
+                                       'runpy.run_path("convert_hf_to_gguf.py", run_name="__main__")'],
+}
+
+
+def run(args: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=UTILS_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def loaded_modules() -> list[str]:
+    # a module imported lazily is in sys.modules, but it's only loaded once its class is a plain module
+    code = ('import sys, types, convert_hf_to_gguf; '
+            f'print(*(n for n in {HEAVY_MODULES!r} if n in sys.modules and object.__getattribute__(sys.modules[n], "__class__") is types.ModuleType))')
+    out = subprocess.run([sys.executable, '-c', code], cwd=UTILS_DIR, check=True, capture_output=True, text=True).stdout
+    return out.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='best of N runs')
+    args = parser.parse_args()
+
+    print(f'python startup: {min(run(["-c", "pass"]) for _ in range(args.repeat)):.3f}s')
+    for case, case_args in CASES.items():
+        results = {}
+        for name, prefix in (('before', EAGER_IMPORTS), ('after', '')):
+            best = min(run([case_args[0], prefix + case_args[1]]) for _ in range(args.repeat))
+            results[name] = best
+            print(f'{case:>24} {name:>6}: {best:.3f}s')
+        print(f'{case:>24} speedup: {results["before"] / results["after"]:.2f}x')
+
+    print(f'heavy modules loaded by the import: {", ".join(loaded_modules()) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
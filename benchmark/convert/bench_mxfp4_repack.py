@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the repacking of gpt-oss MXFP4 expert blocks to the ggml layout
+Compares GptOssModel.repack_mxfp4_blocks from convert_hf_to_gguf.py with the previous implementation
+(torch nibble shuffling with intermediate tensors, then concatenation with the scales)
+Reports the time and the extra peak memory of each, and checks that both give the same bytes
+
+Each implementation runs in its own process, so that their peak memory can be measured separately
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+
+
+def transform_nibble_layout(tensor):
+    assert tensor.dtype == torch.uint8
+    assert tensor.shape[-1] == 16
+    # swap nibbles
+    t_lo = tensor & 0x0F
+    t_hi = tensor & 0xF0
+    t_swapped = (t_lo << 4) | (t_hi >> 4)
+    tensor = t_swapped
+    # transform aaaa...bbbb... to abababab...
+    blk_a, blk_b = tensor.chunk(2, dim=-1)
+    # get a_
+    blk_a0 = (blk_a & 0xF0).view(-1, 1)
+    blk_a1 = (blk_a << 4).view(-1, 1)
+    blk_a = torch.stack((blk_a0, blk_a1), dim=2).view(tensor.shape)
+    # get _b
+    blk_b0 = (blk_b >> 4).view(-1, 1)
+    blk_b1 = (blk_b & 0x0F).view(-1, 1)
+    blk_b = torch.stack((blk_b0, blk_b1), dim=2).view(tensor.shape)
+    # swap once more
+    out = blk_a | blk_b
+    out_h = out & 0xF0
+    out_l = out & 0x0F
+    out = (out_h >> 4) | (out_l << 4)
+    return out
+
+
+def repack_reference(blocks: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    blocks_t = transform_nibble_layout(torch.from_numpy(blocks))
+    new_data = torch.concat((torch.from_numpy(scales).unsqueeze(-1), blocks_t), dim=-1)
+    return new_data.view(new_data.shape[0], new_data.shape[1], new_data.shape[2] * new_data.shape[3]).numpy()
+
+
+def repack_new(blocks: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    from convert_hf_to_gguf import GptOssModel
+    return GptOssModel.repack_mxfp4_blocks(blocks, scales)
+
+
+def peak_rss_bytes() -> int:
+    # KiB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def run(name: str, shape: tuple[int, ...], seed: int, repeat: int, conn):
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=shape, dtype=np.uint8)
+    scales = rng.integers(118, 130, size=shape[:-1], dtype=np.uint8)
+    repack = repack_reference if name == 'before' else repack_new
+    # warm up, e.g. imports and the lookup table
+    repack(blocks[:1, :1], scales[:1, :1])
+    rss_before = peak_rss_bytes()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = repack(blocks, scales)
+        best = min(best, time.perf_counter() - start)
+        del out
+    extra_peak = peak_rss_bytes() - rss_before
+    out = repack(blocks, scales)
+    conn.send((best, extra_peak, out))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    # the down_proj of gpt-oss-120b has [128, 2880, 90, 16] blocks
+    parser.add_argument('--experts', type=int, default=16)
+    parser.add_argument('--rows', type=int, default=2880)
+    parser.add_argument('--blocks', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+    args = parser.parse_args()
+
+    shape = (args.experts, args.rows, args.blocks, 16)
+    print(f'blocks {list(shape)}, {np.prod(shape) / 1024 / 1024:.1f} MiB')
+
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for name in ('before', 'after'):
+        parent, child = ctx.Pipe()
+        p = ctx.Process(target=run, args=(name, shape, args.seed, args.repeat, child))
+        p.start()
+        results[name] = parent.recv()
+        p.join()
+        best, extra_peak, _ = results[name]
+        print(f'{name:>8}: {best:.3f}s, {np.prod(shape) / best / 1e9:.2f} GB/s, extra peak memory {extra_peak / 1024 / 1024:.1f} MiB')
+
+    assert np.array_equal(results['before'][2], results['after'][2]), 'the repacked blocks differ'
+    print(f' speedup: {results["before"][0] / results["after"][0]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the merges reconstruction of Qwen-style (tiktoken) vocabs
+Compares QwenModel.bpe from convert_hf_to_gguf.py with the previous implementation,
+which rescanned all the pairs after each merge, on every token of a vocab
+
+Uses a qwen.tiktoken file if given, otherwise a synthetic vocab trained with tokenizers
+"""
+
+import argparse
+import base64
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+
+from convert_hf_to_gguf import QwenModel  # noqa: E402
+
+
+def bpe_reference(mergeable_ranks: dict[bytes, int], token: bytes, max_rank: int | None = None) -> list[bytes]:
+    parts = [bytes([b]) for b in token]
+    while True:
+        min_idx = None
+        min_rank = None
+        for i, pair in enumerate(zip(parts[:-1], parts[1:])):
+            rank = mergeable_ranks.get(pair[0] + pair[1])
+            if rank is not None and (min_rank is None or rank < min_rank):
+                min_idx = i
+                min_rank = rank
+        if min_rank is None or (max_rank is not None and min_rank >= max_rank):
+            break
+        assert min_idx is not None
+        parts = parts[:min_idx] + [parts[min_idx] + parts[min_idx + 1]] + parts[min_idx + 2:]
+    return parts
+
+
+def load_tiktoken(path: Path) -> dict[bytes, int]:
+    ranks = {}
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                token, rank = line.split()
+                ranks[base64.b64decode(token)] = int(rank)
+    return ranks
+
+
+def bytes_to_unicode() -> dict[int, str]:
+    # the byte -> character mapping of byte-level BPE (from GPT-2)
+    bs = list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1)) + list(range(ord('®'), ord('ÿ') + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+def synthetic_ranks(vocab_size: int, seed: int) -> dict[bytes, int]:
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+    rng = random.Random(seed)
+    # zipf-like distribution of words, so that frequent words get long tokens
+    letters = 'abcdefghijklmnopqrstuvwxyz' * 3 + 'éàü0123456789'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(1, 14))) for _ in range(vocab_size * 2)]
+    # and long runs of the same character, like the indentation and separator tokens of real vocabs
+    words += [c * n for c in ' -=_*#' for n in range(16, 129, 8)]
+    weights = [1 / (i + 1) for i in range(len(words))]
+
+    def corpus():
+        for _ in range(2000):
+            yield ' '.join(rng.choices(words, weights, k=500))
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, initial_alphabet=pre_tokenizers.ByteLevel.alphabet(), show_progress=False)
+    tokenizer.train_from_iterator(corpus(), trainer)
+
+    byte_decoder = {c: b for b, c in bytes_to_unicode().items()}
+    vocab = tokenizer.get_vocab()
+    return {bytes(byte_decoder[c] for c in token): rank for token, rank in sorted(vocab.items(), key=lambda x: x[1])}
+
+
+def build_merges(bpe, mergeable_ranks: dict[bytes, int]) -> list[tuple[bytes, ...]]:
+    # same loop as _set_vocab_qwen
+    merges = []
+    for token, rank in mergeable_ranks.items():
+        if len(token) == 1:
+            continue
+        merged = bpe(mergeable_ranks, token, max_rank=rank)
+        assert len(merged) == 2
+        merges.append(tuple(merged))
+    return merges
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tiktoken', type=Path, help='qwen.tiktoken file of a real model')
+    parser.add_argument('--vocab-size', type=int, default=50000, help='size of the synthetic vocab')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+    args = parser.parse_args()
+
+    if args.tiktoken is not None:
+        mergeable_ranks = load_tiktoken(args.tiktoken)
+    else:
+        mergeable_ranks = synthetic_ranks(args.vocab_size, args.seed)
+    lengths = [len(t) for t in mergeable_ranks]
+    print(f'{len(mergeable_ranks)} tokens, mean length {sum(lengths) / len(lengths):.1f} bytes, max {max(lengths)} bytes')
+
+    results = {}
+    for name, bpe in (('before', bpe_reference), ('after', QwenModel.bpe)):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            merges = build_merges(bpe, mergeable_ranks)
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, merges)
+        print(f'{name:>8}: {best:.3f}s')
+
+    assert results['before'][1] == results['after'][1], 'the merges differ'
+    print(f' speedup: {results["before"][0] / results["after"][0]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the fetching of remote safetensors tensors (--remote)
+Compares RemoteFetcher from convert_hf_to_gguf.py with the previous implementation,
+one blocking HTTP range request per tensor (RemoteTensor.data), and checks that both give the same bytes
+
+The files are served by a local stand-in for the Hub, which supports HEAD and range requests,
+adds a latency to every request and can make some of them fail, to exercise the retries
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+
+import gguf  # noqa: E402
+from convert_hf_to_gguf import RemoteFetcher  # noqa: E402
+
+REPO_ID = 'local/model'
+
+
+def write_synthetic_model(path: Path, n_files: int, n_tensors: int, tensor_size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    weight_map: dict[str, str] = {}
+    for i in range(n_files):
+        file_name = f'model-{i + 1:05d}-of-{n_files:05d}.safetensors'
+        header: dict[str, dict] = {}
+        offset = 0
+        for j in range(n_tensors):
+            name = f'model.layers.{i * n_tensors + j}.weight'
+            # vary the sizes a bit, but keep them even for F16
+            size = tensor_size + 2 * int(rng.integers(0, tensor_size // 8))
+            header[name] = {'dtype': 'F16', 'shape': [size // 2], 'data_offsets': [offset, offset + size]}
+            weight_map[name] = file_name
+            offset += size
+        header_bytes = json.dumps(header).encode()
+        header_bytes += b' ' * (-len(header_bytes) % 8)
+        with open(path / file_name, 'wb') as f:
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            f.write(rng.integers(0, 256, offset, dtype=np.uint8).tobytes())
+    with open(path / 'model.safetensors.index.json', 'w') as f:
+        json.dump({'weight_map': weight_map}, f)
+
+
+def make_handler(root: Path, latency: float, fail_rate: list[float], seed: int):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _file(self) -> Path | None:
+            prefix = f'/{REPO_ID}/resolve/main/'
+            if not self.path.startswith(prefix):
+                return None
+            path = root / self.path[len(prefix):]
+            return path if path.is_file() else None
+
+        def _headers(self, path: Path, status: int, length: int, extra: dict[str, str] | None = None):
+            st = path.stat()
+            self.send_response(status)
+            self.send_header('Content-Length', str(length))
+            self.send_header('ETag', '"' + hashlib.sha256(f'{path.name}:{st.st_size}:{st.st_mtime_ns}'.encode()).hexdigest()[:16] + '"')
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+
+        def do_HEAD(self):
+            time.sleep(latency)
+            if (path := self._file()) is None:
+                self.send_error(404)
+                return
+            self._headers(path, 200, path.stat().st_size)
+
+        def do_GET(self):
+            time.sleep(latency)
+            if (path := self._file()) is None:
+                self.send_error(404)
+                return
+            file_size = path.stat().st_size
+            start, end = 0, file_size - 1
+            status = 200
+            if (m := re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))) is not None:
+                start = int(m.group(1))
+                end = min(int(m.group(2)) if m.group(2) else file_size - 1, file_size - 1)
+                status = 206
+            with lock:
+                # not the reads of the headers, which aren't retried
+                failure = rng.random() < fail_rate[0] and status == 206 and start > 0
+                truncate = rng.random() < 0.5
+            if failure and not truncate:
+                self.send_error(503)
+                return
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start + 1)
+            self._headers(path, status, len(data), {'Content-Range': f'bytes {start}-{end}/{file_size}'} if status == 206 else None)
+            if failure:
+                # the connection drops in the middle of the body
+                self.wfile.write(data[:len(data) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=4, help='number of safetensors files')
+    parser.add_argument('--tensors', type=int, default=32, help='number of tensors per file')
+    parser.add_argument('--tensor-size', type=int, default=2 * 1024 * 1024, help='approximate size of the tensors, in bytes')
+    parser.add_argument('--latency', type=float, default=20, help='latency of every request, in milliseconds')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of the range requests failing, with the fetcher only')
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir) / 'files'
+        root.mkdir()
+        write_synthetic_model(root, args.files, args.tensors, args.tensor_size, args.seed)
+        total = sum(f.stat().st_size for f in root.glob('*.safetensors'))
+        print(f'{args.files} files, {args.files * args.tensors} tensors, {total / 1024 / 1024:.1f} MiB, {args.latency:g} ms per request')
+
+        fail_rate = [0.0]
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(root, args.latency / 1000, fail_rate, args.seed))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        gguf.utility.SafetensorRemote.BASE_DOMAIN = f'http://127.0.0.1:{server.server_address[1]}'
+
+        results = {}
+        try:
+            # cached: again with the data fetched by the previous run
+            for name in ('before', 'after', 'cached'):
+                fail_rate[0] = args.fail_rate if name == 'after' else 0.0
+                tensors = gguf.utility.SafetensorRemote.get_list_tensors_hf_model(REPO_ID)
+                start = time.perf_counter()
+                if name == 'before':
+                    data = {k: bytes(t.data()) for k, t in tensors.items()}
+                    n_requests = len(tensors)
+                else:
+                    with RemoteFetcher(n_connections=args.connections, cache_dir=Path(tmp_dir) / 'cache') as fetcher:
+                        fetcher.backoff = 0.01
+                        fetcher.add(tensors.values())
+                        data = {k: fetcher.read(t).tobytes() for k, t in tensors.items()}
+                    n_requests = fetcher.n_requests
+                results[name] = (time.perf_counter() - start, data)
+                print(f'{name:>8}: {results[name][0]:.3f}s, {n_requests} range requests')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    assert results['before'][1] == results['after'][1] == results['cached'][1], 'the tensors differ'
+    print(f' speedup: {results["before"][0] / results["after"][0]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the loading of RWKV world vocabs (rwkv_vocab_v20230424.txt)
+Compares TextModel.parse_rwkv_world_vocab from convert_hf_to_gguf.py with the previous implementation,
+which used readlines() and ast.literal_eval, and checks that both give the same vocab
+
+Uses the rwkv_vocab_v20230424.txt of a model if given, otherwise a synthetic vocab file
+"""
+
+import argparse
+import ast
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+
+import gguf  # noqa: E402
+from convert_hf_to_gguf import TextModel  # noqa: E402
+
+
+def parse_reference(path: Path, vocab_size: int) -> tuple[list[bytes], list[int]]:
+    tokens: list[bytes] = ['<s>'.encode("utf-8")]
+    toktypes: list[int] = [gguf.TokenType.CONTROL]
+
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+        for line in lines:
+            parts = line.split(' ')
+            assert len(parts) >= 3
+            token, token_len = ast.literal_eval(' '.join(parts[1:-1])), int(parts[-1])
+            token = token.encode("utf-8") if isinstance(token, str) else token
+            assert isinstance(token, bytes)
+            assert len(token) == token_len
+            token_text: str = repr(token)[2:-1]  # "b'\xff'" -> "\xff"
+            tokens.append(token_text.encode("utf-8"))
+            toktypes.append(gguf.TokenType.NORMAL)
+    remainder = vocab_size - len(tokens)
+    assert remainder >= 0
+    for i in range(len(tokens), vocab_size):
+        tokens.append(f"[PAD{i}]".encode("utf-8"))
+        toktypes.append(gguf.TokenType.UNUSED)
+    return tokens, toktypes
+
+
+def write_synthetic_vocab(path: Path, n_tokens: int, seed: int):
+    # same format as the real file: the repr of the token as str when it's valid utf-8, as bytes otherwise
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz ABCXYZ0123456789'\"\\\n\t\r\x00\x7f.,-_éàüßжщ中文字日本語😀🦙 ‍"
+    tokens = [bytes([b]) for b in range(256)]
+    seen = set(tokens)
+    while len(tokens) < n_tokens:
+        if rng.random() < 0.05:
+            # invalid utf-8
+            token = bytes(rng.randrange(128, 256) for _ in range(rng.randint(2, 4)))
+        else:
+            token = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 12))).encode("utf-8")
+        if token not in seen:
+            seen.add(token)
+            tokens.append(token)
+    with open(path, "w", encoding="utf-8") as f:
+        for i, token in enumerate(tokens, start=1):
+            try:
+                literal = repr(token.decode("utf-8"))
+            except UnicodeDecodeError:
+                literal = repr(token)
+            f.write(f"{i} {literal} {len(token)}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vocab', type=Path, help='rwkv_vocab_v20230424.txt of a real model')
+    parser.add_argument('--vocab-size', type=int, default=65536)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.vocab
+        if path is None:
+            path = Path(tmp_dir) / 'rwkv_vocab_v20230424.txt'
+            write_synthetic_vocab(path, args.vocab_size - 1, args.seed)
+
+        results = {}
+        for name, parse in (('before', parse_reference), ('after', TextModel.parse_rwkv_world_vocab)):
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                tokens, toktypes = parse(path, args.vocab_size)
+                best = min(best, time.perf_counter() - start)
+            results[name] = (best, list(tokens), [int(t) for t in toktypes])
+            print(f'{name:>8}: {best:.3f}s')
+
+    assert results['before'][1:] == results['after'][1:], 'the vocabs differ'
+    print(f' speedup: {results["before"][0] / results["after"][0]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the concurrent writing of the shards of a split output (--split-count)
+Converts a synthetic checkpoint (see bench_conversion.py) into N shards with --profile,
+with a latency added to every write to simulate a slow disk, and reports from the trace
+when each shard writer was active and how long the writers were writing at the same time
+
+The writers have to overlap, otherwise the writing doesn't get faster with the number of shards:
+the check fails when there are fewer than --min-writers of them writing on average
+(writing one shard after the other gives a little more than 1, from the tensors at the boundaries)
+"""
+
+import argparse
+import itertools
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_conversion import RUNNER, UTILS_DIR, write_checkpoint
+
+# the shard writers write the tensors with os.pwrite
+SLOW_RUNNER = 'import os, time; pwrite = os.pwrite; os.pwrite = lambda *a: (time.sleep({latency}), pwrite(*a))[1]; ' + RUNNER
+
+
+def convert(model_dir: Path, out_dir: Path, n_shards: int, threads: int, latency: float) -> tuple[float, dict[str, list[tuple[float, float]]]]:
+    # returns the time of the tensors phase and the write spans of each writer thread, in seconds
+    trace = out_dir / f'{n_shards}.json'
+    args = [sys.executable, '-c', SLOW_RUNNER.format(latency=latency), str(model_dir), '--outtype', 'q8_0',
+            '--outfile', str(out_dir / f'{n_shards}.gguf'), '--split-count', str(n_shards), '--threads', str(threads), '--profile', str(trace)]
+    subprocess.run(args, cwd=UTILS_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(trace, encoding='utf-8') as f:
+        data = json.load(f)
+    threads_names = {e['tid']: e['args']['name'] for e in data['traceEvents'] if e['ph'] == 'M'}
+    spans: dict[str, list[tuple[float, float]]] = {}
+    for e in data['traceEvents']:
+        if e['ph'] == 'X' and e['cat'] in ('write', 'copy') and threads_names[e['tid']].startswith('convert-write'):
+            spans.setdefault(threads_names[e['tid']], []).append((e['ts'] / 1e6, (e['ts'] + e['dur']) / 1e6))
+    for f in out_dir.glob('*.gguf'):
+        f.unlink()
+    return data['otherData']['phases']['tensors'], spans
+
+
+def union(spans: list[tuple[float, float]]) -> float:
+    # time during which at least one of the spans was running
+    total, end = 0.0, float('-inf')
+    for b, e in sorted(spans):
+        total += max(0.0, e - max(b, end))
+        end = max(end, e)
+    return total
+
+
+def overlap(spans: dict[str, list[tuple[float, float]]]) -> float:
+    # time during which two writers were writing, summed over the pairs of writers
+    total = 0.0
+    for s1, s2 in itertools.combinations(spans.values(), 2):
+        total += sum(max(0.0, min(e1, e2) - max(b1, b2)) for b1, e1 in s1 for b2, e2 in s2)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=4, help='number of shards')
+    parser.add_argument('--size', type=int, default=200_000_000, help='approximate size of the checkpoint, in bytes')
+    parser.add_argument('--arch', default='mixtral', help='architecture of the checkpoint, see bench_conversion.py')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=50, help='latency added to every write, in milliseconds')
+    parser.add_argument('--min-writers', type=float, default=1.5, help='minimum average number of writers writing at the same time')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_dir = Path(tmp_dir) / 'model'
+        n_tensors, total = write_checkpoint(model_dir, args.arch, args.size, 512, 8, 32000, 2 * 1000 ** 3, 0)
+        print(f'{args.arch}: {n_tensors} tensors, {total / 1024 ** 2:.0f} MiB, {args.latency:g} ms per write')
+
+        start = time.perf_counter()
+        tensors_s, spans = convert(model_dir, Path(tmp_dir), args.shards, args.threads, args.latency / 1000)
+        print(f'{args.shards} shards: {tensors_s:.2f}s in the tensors phase ({time.perf_counter() - start:.2f}s in total)')
+
+    for name, s in sorted(spans.items(), key=lambda kv: kv[1][0]):
+        print(f'    {name}: active {min(b for b, _ in s):.2f}-{max(e for _, e in s):.2f}s, writing {sum(e - b for b, e in s):.2f}s')
+    writing = sum(e - b for s in spans.values() for b, e in s)
+    wall = union([span for s in spans.values() for span in s])
+    print(f'writers writing at the same time: {overlap(spans):.2f}s')
+    print(f'writing: {writing:.2f}s of writer time in {wall:.2f}s, {writing / wall:.2f} writers on average')
+    assert len(spans) == args.shards and writing / wall >= args.min_writers, 'the shard writers mostly wrote one after the other'
+
+
+if __name__ == '__main__':
+    main()
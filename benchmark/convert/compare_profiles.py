@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Comparison of two profiles of convert_hf_to_gguf.py (the traces written with --profile TRACE_JSON),
+e.g. of the same conversion with two versions of the converter
+
+Prints the time of the phases and of the stages of both, and the tensors whose time changed the most
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+
+def load(path: Path) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['otherData']
+
+
+def change(before: float, after: float) -> str:
+    return f'{100 * (after - before) / before:+.1f}%' if before > 0 else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before', type=Path, help='trace of the reference conversion')
+    parser.add_argument('after', type=Path, help='trace of the conversion to compare with it')
+    parser.add_argument('--tensors', type=int, default=10, help='number of tensors to show')
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+
+    print(f'{"":<16} {"before":>10} {"after":>10} {"change":>8}')
+    print(f'{"wall":<16} {before["wall_seconds"]:>9.3f}s {after["wall_seconds"]:>9.3f}s {change(before["wall_seconds"], after["wall_seconds"]):>8}')
+    for key in ('bytes_read', 'bytes_written', 'peak_rss'):
+        b, a = before[key] or 0, after[key] or 0
+        print(f'{key:<16} {b / 1024 / 1024:>8.1f}Mi {a / 1024 / 1024:>8.1f}Mi {change(b, a):>8}')
+
+    for section in ('phases', 'stages'):
+        print(f'{section}:')
+        for name in dict.fromkeys([*before[section], *after[section]]):
+            # the phases are durations, the stages are summed over their calls
+            b = before[section].get(name, 0.0)
+            a = after[section].get(name, 0.0)
+            if section == 'stages':
+                b, a = (b['seconds'] if b else 0.0), (a['seconds'] if a else 0.0)
+            print(f'  {name:<14} {b:>9.3f}s {a:>9.3f}s {change(b, a):>8}')
+
+    totals = {}
+    for name in before['tensors'].keys() | after['tensors'].keys():
+        totals[name] = (sum(before['tensors'].get(name, {}).values()), sum(after['tensors'].get(name, {}).values()))
+    if totals:
+        print('tensors which changed the most:')
+        for name, (b, a) in sorted(totals.items(), key=lambda kv: -abs(kv[1][1] - kv[1][0]))[:args.tensors]:
+            print(f'  {name:<40} {b:>9.3f}s {a:>9.3f}s {change(b, a):>8}')
+
+
+if __name__ == '__main__':
+    main()
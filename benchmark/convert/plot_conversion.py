@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Conversion Benchmark Plotting Script
+Generates plots from conversion_benchmarks.csv (written by bench_conversion.py)
+One plot of the throughput and one of the peak memory, against the size of the checkpoints,
+with a subplot per architecture and a line per converter version (label) and output type
+"""
+
+import pandas as pd
+import matplotlib.pyplot as plt
+import os
+import sys
+
+# Read the CSV data
+script_dir = os.path.dirname(os.path.abspath(__file__))
+csv_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(script_dir, 'conversion_benchmarks.csv')
+df = pd.read_csv(csv_path, keep_default_na=False)
+
+# Combined converter version/output type label, with the extra arguments of the converter if any
+df['series'] = df['label'] + '/' + df['outtype']
+with_args = df['args'] != ''
+df.loc[with_args, 'series'] = df.loc[with_args, 'series'] + ' ' + df.loc[with_args, 'args']
+
+# Assign colors/markers to the series
+colors = ['red', 'orange', 'green', 'blue', 'purple', 'brown', 'pink', 'gray', 'cyan', 'magenta']
+markers = ['o', 's', '^', 'D', 'v', '<', '>', 'p', '*', 'h']
+
+series_styles = {}
+for i, series in enumerate(df['series'].unique()):
+    series_styles[series] = {
+        'color': colors[i % len(colors)],
+        'marker': markers[i % len(markers)],
+        'linestyle': '-',
+        'label': series
+    }
+
+archs = list(df['arch'].unique())
+
+plots = {
+    'throughput_GB_s': ('Conversion Throughput', 'Throughput (GB/s)', 'conversion_throughput.png'),
+    'peak_rss_GiB': ('Conversion Peak Memory', 'Peak RSS (GiB)', 'conversion_memory.png'),
+}
+
+for column, (title, ylabel, filename) in plots.items():
+    # ============================================================================
+    # One subplot per architecture
+    # ============================================================================
+    fig, axes = plt.subplots(1, len(archs), figsize=(6 * len(archs), 6), squeeze=False)
+    fig.suptitle(f'{title} (convert_hf_to_gguf.py)', fontsize=16, fontweight='bold')
+
+    for idx, arch in enumerate(archs):
+        ax = axes[0][idx]
+
+        # Filter data for this architecture
+        arch_data = df[df['arch'] == arch]
+
+        # Plot each series
+        for series, style in series_styles.items():
+            series_data = arch_data[arch_data['series'] == series]
+
+            if not series_data.empty:
+                # Average the repeated runs, sorted by checkpoint size for proper line plotting
+                series_data = series_data.groupby('size_GiB', as_index=False)[column].mean().sort_values('size_GiB')
+
+                ax.plot(series_data['size_GiB'],
+                        series_data[column],
+                        color=style['color'],
+                        marker=style['marker'],
+                        linestyle=style['linestyle'],
+                        linewidth=2,
+                        markersize=8,
+                        label=style['label'])
+
+                # Add value labels on points
+                for _, row in series_data.iterrows():
+                    ax.annotate(f"{row[column]:.2f}",
+                                (row['size_GiB'], row[column]),
+                                textcoords="offset points",
+                                xytext=(0, 10),
+                                ha='center',
+                                fontsize=8,
+                                alpha=0.7)
+
+        # Configure axes
+        ax.set_xlabel('Checkpoint Size (GiB)', fontsize=12, fontweight='bold')
+        ax.set_ylabel(ylabel, fontsize=12, fontweight='bold')
+        ax.set_title(arch, fontsize=14, fontweight='bold')
+        ax.grid(True, alpha=0.3, linestyle='--')
+        ax.set_ylim(bottom=0)
+        ax.legend(loc='best', fontsize=9)
+
+    # Adjust layout
+    plt.tight_layout()
+
+    # Save the plot
+    output_path = os.path.join(script_dir, filename)
+    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    print(f"Plot saved to: {output_path}")
+
+print("\nDone!")
@@ -3,28 +3,57 @@
 
 from __future__ import annotations
 
-import ast
+import codecs
+import collections
 import logging
 import argparse
 import contextlib
+import functools
+import heapq
+import inspect
 import json
+import mmap
 import os
+import queue
 import re
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
 from pathlib import Path
 from hashlib import sha256
-from typing import TYPE_CHECKING, Any, Callable, ContextManager, Iterable, Iterator, Literal, Sequence, TypeVar, cast
-from itertools import chain
-from transformers import AutoConfig
+from typing import TYPE_CHECKING, Any, Callable, Generic, Iterable, Iterator, Literal, Sequence, TypeVar, cast, overload
+from itertools import accumulate, chain, zip_longest
 
+import importlib.util
 import math
 import numpy as np
-import torch
 
 if TYPE_CHECKING:
+    import torch
     from torch import Tensor
 
+
+def _lazy_import(name: str) -> Any:
+    # defer the execution of a heavy module to its first attribute access,
+    # so that --help and --print-supported-models don't pay for it
+    if (module := sys.modules.get(name)) is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+if not TYPE_CHECKING:
+    torch = _lazy_import("torch")
+
 if 'NO_LOCAL_GGUF' not in os.environ:
     sys.path.insert(1, str(Path(__file__).parent / 'gguf-py'))
 import gguf
@@ -68,6 +97,39 @@ class SentencePieceTokenTypes(IntEnum):
     BYTE = 6
 
 
+class PackedTokens(Sequence[bytes]):
+    """
+    Token list stored in a single buffer, which is much lighter than a list of bytes for big vocabs.
+    The bytes of the i-th token are data[offsets[i]:offsets[i + 1]].
+    """
+
+    data: bytes
+    offsets: np.ndarray
+
+    def __init__(self, tokens: Iterable[bytes]):
+        tokens = list(tokens)
+        self.data = b"".join(tokens)
+        self.offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in tokens], out=self.offsets[1:])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @overload
+    def __getitem__(self, index: int) -> bytes: ...
+    @overload
+    def __getitem__(self, index: slice) -> PackedTokens: ...
+
+    def __getitem__(self, index: int | slice) -> bytes | PackedTokens:
+        if isinstance(index, slice):
+            return PackedTokens(self[i] for i in range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("token index out of range")
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+
 class ModelType(IntEnum):
     TEXT = 1
     MMPROJ = 2
@@ -97,6 +159,8 @@ class ModelBase:
     metadata_override: Path | None
     dir_model_card: Path
     remote_hf_model_id: str | None
+    remote_fetcher: RemoteFetcher | None
+    profiler: ConversionProfiler | None
 
     # subclasses should define this!
     model_arch: gguf.MODEL_ARCH
@@ -109,6 +173,10 @@ class ModelBase:
     is_mistral_format: bool = False
     disable_mistral_community_chat_template: bool = False
     sentence_transformers_dense_modules: bool = False
+    # the float32 result of a dequantization is computed by chunks of about this many bytes
+    dequant_chunk_bytes: int = 64 * 1024 * 1024
+    # number of model parts indexed at the same time
+    index_threads: int = 8
 
     def __init__(self, dir_model: Path, ftype: gguf.LlamaFileType, fname_out: Path, *, is_big_endian: bool = False,
                  use_temp_file: bool = False, eager: bool = False,
@@ -116,7 +184,9 @@ class ModelBase:
                  split_max_tensors: int = 0, split_max_size: int = 0, dry_run: bool = False,
                  small_first_shard: bool = False, hparams: dict[str, Any] | None = None, remote_hf_model_id: str | None = None,
                  disable_mistral_community_chat_template: bool = False,
-                 sentence_transformers_dense_modules: bool = False):
+                 sentence_transformers_dense_modules: bool = False, n_threads: int = 1, max_memory: int = 0, resume: bool = False,
+                 tensor_cache: TensorCache | None = None, mmap_output: bool = False, split_count: int = 0,
+                 sequential_read: bool = False, remote_fetcher: RemoteFetcher | None = None, profiler: ConversionProfiler | None = None):
         if type(self) is ModelBase or \
                 type(self) is TextModel or \
                 type(self) is MmprojModel:
@@ -134,12 +204,17 @@ class ModelBase:
         self.lazy = not eager or (remote_hf_model_id is not None)
         self.dry_run = dry_run
         self.remote_hf_model_id = remote_hf_model_id
+        self.remote_fetcher = remote_fetcher
+        self.profiler = profiler
         self.sentence_transformers_dense_modules = sentence_transformers_dense_modules
-        self.hparams = ModelBase.load_hparams(self.dir_model, self.is_mistral_format) if hparams is None else hparams
-        self.model_tensors = self.index_tensors(remote_hf_model_id=remote_hf_model_id)
+        with self.profile("hparams"):
+            self.hparams = ModelBase.load_hparams(self.dir_model, self.is_mistral_format) if hparams is None else hparams
+        with self.profile("index"):
+            self.model_tensors = self.index_tensors(remote_hf_model_id=remote_hf_model_id)
         self.metadata_override = metadata_override
         self.model_name = model_name
         self.dir_model_card = dir_model  # overridden in convert_lora_to_gguf.py
+        self.tensor_cache = tensor_cache
 
         # Apply heuristics to figure out typical tensor encoding based on first layer tensor encoding type
         if self.ftype == gguf.LlamaFileType.GUESSED:
@@ -155,8 +230,10 @@ class ModelBase:
         self.dequant_model()
 
         # Configure GGUF Writer
-        self.gguf_writer = gguf.GGUFWriter(path=None, arch=gguf.MODEL_ARCH_NAMES[self.model_arch], endianess=self.endianess, use_temp_file=self.use_temp_file,
-                                           split_max_tensors=split_max_tensors, split_max_size=split_max_size, dry_run=dry_run, small_first_shard=small_first_shard)
+        self.gguf_writer = ConversionWriter(path=None, arch=gguf.MODEL_ARCH_NAMES[self.model_arch], endianess=self.endianess, use_temp_file=self.use_temp_file,
+                                            split_max_tensors=split_max_tensors, split_max_size=split_max_size, dry_run=dry_run, small_first_shard=small_first_shard,
+                                            n_threads=n_threads, max_memory=max_memory, resume=resume, cache=tensor_cache if self.lazy else None,
+                                            mmap_output=mmap_output, split_count=split_count, sequential_read=sequential_read, profiler=profiler)
 
         # Mistral specific
         self.disable_mistral_community_chat_template = disable_mistral_community_chat_template
@@ -167,6 +244,27 @@ class ModelBase:
         new_name = f"{prefix}{stem}{suffix}"
         return path.with_name(new_name)
 
+    def profile(self, stage: str, tensor: str | None = None) -> contextlib.AbstractContextManager[Any]:
+        # the phases of the conversion, and the operations on the tensors when they aren't lazy
+        if self.profiler is None or (tensor is not None and self.lazy):
+            return contextlib.nullcontext()
+        return self.profiler.span(stage, tensor)
+
+    def profile_iter(self, stage: str, tensor: str, items: Iterable[_T]) -> Iterator[_T]:
+        # times the production of each item, but not what's done with it
+        it = iter(items)
+        while True:
+            with self.profile(stage, tensor):
+                item = next(it, None)
+            if item is None:
+                return
+            yield item
+
+    def profile_mark(self, tensor: Any, stage: str, source: Any = None):
+        # the lazy operations are timed when they are computed, under the stage marked here
+        if self.profiler is not None and tensor is not source:
+            ConversionProfiler.mark(tensor, stage)
+
     def find_hparam(self, keys: Iterable[str], optional: bool = False) -> Any:
         key = next((k for k in keys if k in self.hparams), None)
         if key is not None:
@@ -183,8 +281,10 @@ class ModelBase:
 
             logger.info(f"Using remote model with HuggingFace id: {remote_hf_model_id}")
             remote_tensors = gguf.utility.SafetensorRemote.get_list_tensors_hf_model(remote_hf_model_id)
+            if self.remote_fetcher is not None:
+                self.remote_fetcher.add(remote_tensors.values())
             for name, remote_tensor in remote_tensors.items():
-                tensors[name] = lambda r=remote_tensor: LazyTorchTensor.from_remote_tensor(r)
+                tensors[name] = lambda r=remote_tensor, f=self.remote_fetcher: LazyTorchTensor.from_remote_tensor(r, f)
 
             return tensors
 
@@ -215,32 +315,37 @@ class ModelBase:
         else:
             weight_map = {}
 
-        for part_name in part_names:
+        safetensors_index = SafetensorsIndex(self.dir_model) if is_safetensors else None
+
+        def index_part(part_name: str) -> dict[str, Any]:
             logger.info(f"gguf: indexing model part '{part_name}'")
-            ctx: ContextManager[Any]
-            if is_safetensors:
-                ctx = cast(ContextManager[Any], gguf.utility.SafetensorsLocal(self.dir_model / part_name))
-            else:
-                ctx = contextlib.nullcontext(torch.load(str(self.dir_model / part_name), map_location="cpu", mmap=True, weights_only=True))
+            if safetensors_index is not None:
+                return safetensors_index.tensors(part_name)
+            return torch.load(str(self.dir_model / part_name), map_location="cpu", mmap=True, weights_only=True)
 
-            with ctx as model_part:
-                assert model_part is not None
+        # the parts are indexed concurrently, which hides the latency of network storage
+        with ThreadPoolExecutor(max_workers=max(1, min(self.index_threads, len(part_names))), thread_name_prefix="convert-index") as executor:
+            model_parts = list(executor.map(index_part, part_names))
 
-                for name in model_part.keys():
-                    if is_safetensors:
-                        data: gguf.utility.LocalTensor = model_part[name]
-                        if self.lazy:
-                            data_gen = lambda data=data: LazyTorchTensor.from_local_tensor(data)  # noqa: E731
-                        else:
-                            dtype = LazyTorchTensor._dtype_str_map[data.dtype]
-                            data_gen = lambda data=data, dtype=dtype: torch.from_numpy(data.mmap_bytes()).view(dtype).reshape(data.shape)  # noqa: E731
+        if safetensors_index is not None:
+            safetensors_index.save()
+
+        for model_part in model_parts:
+            for name in model_part.keys():
+                if is_safetensors:
+                    data: gguf.utility.LocalTensor = model_part[name]
+                    if self.lazy:
+                        data_gen = lambda data=data: LazyTorchTensor.from_local_tensor(data)  # noqa: E731
                     else:
-                        data_torch: Tensor = model_part[name]
-                        if self.lazy:
-                            data_gen = lambda data=data_torch: LazyTorchTensor.from_eager(data)  # noqa: E731
-                        else:
-                            data_gen = lambda data=data_torch: data  # noqa: E731
-                    tensors[name] = data_gen
+                        dtype = LazyTorchTensor._dtype_str_map[data.dtype]
+                        data_gen = lambda data=data, dtype=dtype: torch.from_numpy(data.mmap_bytes()).view(dtype).reshape(data.shape)  # noqa: E731
+                else:
+                    data_torch: Tensor = model_part[name]
+                    if self.lazy:
+                        data_gen = lambda data=data_torch: LazyTorchTensor.from_eager(data)  # noqa: E731
+                    else:
+                        data_gen = lambda data=data_torch: data  # noqa: E731
+                tensors[name] = data_gen
 
         # verify tensor name presence and identify potentially missing files
         if len(tensor_names_from_index) > 0:
@@ -259,6 +364,57 @@ class ModelBase:
 
         return tensors
 
+    def dequant_tensor(
+        self, dequant_rows: Callable[..., Tensor], *args: Any, shape: Sequence[int] | None = None, row_align: int = 1,
+        transcode: dict[gguf.GGMLQuantizationType, Callable[..., np.ndarray]] | None = None,
+    ) -> Tensor:
+        """
+        Dequantize a tensor by chunks of rows, so that the intermediate tensors stay small.
+
+        dequant_rows(start, stop, *args) computes the float32 rows [start, stop) of the result, start being a multiple of row_align.
+        The tensors in args can be lazy, the result is then lazy too.
+        The shape of the result is the shape of the first argument when not given.
+
+        transcode can map an output type to a function with the same arguments as dequant_rows,
+        computing the quantized rows directly from the quantized ones, bit-exact with quantizing the dequantized rows.
+        """
+        shape = tuple(args[0].shape if shape is None else shape)
+        row_bytes = 4 * math.prod(shape[1:])
+        chunk_rows = max(self.dequant_chunk_bytes // (row_bytes * row_align), 1) * row_align
+
+        def dequant(*args: Any) -> Tensor:
+            out = torch.empty(shape, dtype=torch.float32)
+            for start in range(0, shape[0], chunk_rows):
+                stop = min(start + chunk_rows, shape[0])
+                out[start:stop] = dequant_rows(start, stop, *args)
+            return out
+
+        def quantized(qtype: gguf.GGMLQuantizationType) -> Callable[..., np.ndarray]:
+            # dequantize and quantize to qtype chunk by chunk, without the whole float32 intermediate
+            transcode_rows = transcode.get(qtype) if transcode is not None else None
+
+            def quantize(*args: Any) -> np.ndarray:
+                out = None
+                for start in range(0, shape[0], chunk_rows):
+                    stop = min(start + chunk_rows, shape[0])
+                    if transcode_rows is not None:
+                        chunk = transcode_rows(start, stop, *args)
+                    else:
+                        chunk = gguf.quants.quantize(dequant_rows(start, stop, *args).numpy(), qtype)
+                    if out is None:
+                        out = np.empty((shape[0], *chunk.shape[1:]), dtype=chunk.dtype)
+                    out[start:stop] = chunk
+                assert out is not None
+                return out
+            return quantize
+
+        # used by prepare_tensors when the tensor is written unchanged
+        dequant.quantized = quantized  # type: ignore
+
+        if any(isinstance(a, LazyTorchTensor) for a in args):
+            return cast(torch.Tensor, LazyTorchTensor(meta=LazyTorchTensor.meta_with_dtype_and_shape(torch.float32, shape), args=args, func=dequant))
+        return dequant(*args)
+
     def dequant_model(self):
         tensors_to_remove: list[str] = []
         new_tensors: dict[str, Callable[[], Tensor]] = {}
@@ -266,31 +422,103 @@ class ModelBase:
         if (quant_config := self.hparams.get("quantization_config")) and isinstance(quant_config, dict):
             quant_method = quant_config.get("quant_method")
 
-            def dequant_bitnet(weight: Tensor, scale: Tensor) -> Tensor:
+            def rows_of(t: Tensor, start: int, stop: int, shape: Sequence[int]) -> Tensor:
+                # the part of t which is broadcast against the rows [start, stop) of a tensor of the given shape
+                if t.ndim == len(shape) and t.shape[0] == shape[0] and shape[0] > 1:
+                    return t[start:stop]
+                return t
+
+            # each of these computes the float32 rows [start, stop) of a dequantized tensor,
+            # see dequant_tensor() for how they are called
+            def dequant_bitnet(start: int, stop: int, weight: Tensor, scale: Tensor) -> Tensor:
                 weight = weight.view(torch.uint8)
-                orig_shape = weight.shape
+                n_rows = weight.shape[0]
 
-                shift = torch.tensor([0, 2, 4, 6], dtype=torch.uint8).reshape((4, *(1 for _ in range(len(orig_shape)))))
-                data = weight.unsqueeze(0).expand((4, *orig_shape)) >> shift
-                data = data & 3
-                data = (data.float() - 1).reshape((orig_shape[0] * 4, *orig_shape[1:]))
+                # the 4 values of a byte are spread over 4 blocks of rows
+                data = torch.cat([
+                    (weight[max(start - i * n_rows, 0):min(stop - i * n_rows, n_rows)] >> (2 * i)) & 3
+                    for i in range(start // n_rows, (stop - 1) // n_rows + 1)
+                ])
+                data = data.float() - 1
 
                 # The scale is inverted
-                return data / scale.float()
+                return data / rows_of(scale.float(), start, stop, (4 * n_rows, *weight.shape[1:]))
 
-            def dequant_simple(weight: Tensor, scale: Tensor, block_size: Sequence[int] | None = None) -> Tensor:
+            def dequant_simple(start: int, stop: int, weight: Tensor, scale: Tensor, block_size: Sequence[int] | None = None) -> Tensor:
                 scale = scale.float()
 
                 if block_size is not None:
+                    # start is a multiple of the block size
+                    scale = scale[start // block_size[0]:(stop + block_size[0] - 1) // block_size[0]]
                     for i, size in enumerate(block_size):
                         scale = scale.repeat_interleave(size, i)
                     # unpad the scale (e.g. when the tensor size isn't a multiple of the block size)
-                    scale = scale[tuple(slice(0, size) for size in weight.shape)]
-
-                return weight.float() * scale
+                    scale = scale[(slice(0, stop - start), *(slice(0, size) for size in weight.shape[1:]))]
+                else:
+                    scale = rows_of(scale, start, stop, weight.shape)
+
+                return weight[start:stop].float() * scale
+
+            def unpack_3bit(packed: Tensor) -> Tensor:
+                # 32 values of 3 bits are packed along dim 0 in 3 words, as a little-endian stream of 96 bits,
+                # so that the values 10 and 21 straddle two words
+                assert packed.dtype == torch.int32 and packed.shape[0] % 3 == 0
+                words = packed.reshape(-1, 3, *packed.shape[1:]).to(torch.int64) & 0xFFFFFFFF
+                # bits 0-63 hold the values 0-20, and bits 32-95 hold the values 21-31
+                low = words[:, 0] | (words[:, 1] << 32)
+                high = words[:, 1] | (words[:, 2] << 32)
+                broadcast = (1, -1) + (1,) * (packed.ndim - 1)
+                values = torch.cat([
+                    (low.unsqueeze(1) >> torch.arange(0, 63, 3).reshape(broadcast)) & 7,
+                    (high.unsqueeze(1) >> torch.arange(31, 64, 3).reshape(broadcast)) & 7,
+                ], dim=1)
+                return values.to(torch.int8).reshape(-1, *packed.shape[1:])
+
+            def transcode_simple_q8_0(start: int, stop: int, weight: Tensor, scale: Tensor, block_size: Sequence[int] | None = None) -> np.ndarray:
+                # Q8_0 rows straight from 8-bit rows whose scale is shared by each block of 32 values.
+                # The maximum of a block is found on the 8-bit values, and the scales aren't expanded to the shape of the weight.
+                n_rows, n_blocks = stop - start, weight.shape[1] // 32
+                scale = scale.float()
+                if block_size is not None:
+                    scale = scale[start // block_size[0]:(stop + block_size[0] - 1) // block_size[0]]
+                    scale = scale.repeat_interleave(block_size[0], 0)[:n_rows].repeat_interleave(block_size[1] // 32, 1)[:, :n_blocks]
+                else:
+                    scale = rows_of(scale, start, stop, weight.shape)
+                s = scale.numpy()
+                s = s.reshape(s.shape[0] if s.ndim == 2 else 1, -1, 1)
+
+                weight = weight[start:stop]
+                if weight.dtype == torch.int8:
+                    codes = weight.numpy().reshape(n_rows, n_blocks, 32)
+                    amax = np.abs(codes.astype(np.int16)).max(axis=-1, keepdims=True).astype(np.float32)
+                    values = codes.astype(np.float32)
+                else:
+                    # the magnitude of a float8 grows with its bits without the sign
+                    magnitudes = torch.arange(256, dtype=torch.uint8).view(weight.dtype).float().numpy()
+                    codes = weight.view(torch.uint8).numpy().reshape(n_rows, n_blocks, 32)
+                    amax = np.take(magnitudes, (codes & 0x7F).max(axis=-1, keepdims=True))
+                    values = np.take(magnitudes, codes)
+
+                # same operations as gguf.quants.Q8_0, on the same float32 values
+                d = np.abs(amax * s) / 127
+                with np.errstate(divide="ignore"):
+                    id = np.where(d == 0, 0, 1 / d)
+                x = values * s * id
+
+                # round half away from zero like np_roundf, from the truncation and the exact fractional part
+                qs = x.astype(np.int8)
+                frac = x - qs
+                qs += frac >= 0.5
+                qs -= frac <= -0.5
+
+                out = np.empty((n_rows, n_blocks, 34), dtype=np.uint8)
+                out[..., :2] = d.astype(np.float16).view(np.uint8)
+                out[..., 2:] = qs.view(np.uint8)
+                return out.reshape(n_rows, n_blocks * 34)
 
             # ref: https://github.com/ModelCloud/GPTQModel/blob/037c5c0f6c9e33c500d975b038d02e7ca437546d/gptqmodel/nn_modules/qlinear/__init__.py#L437-L476
-            def dequant_gptq(g_idx: Tensor, qweight: Tensor, qzeros: Tensor, scales: Tensor) -> Tensor:
+            def dequant_gptq(start: int, stop: int, g_idx: Tensor, qweight: Tensor, qzeros: Tensor, scales: Tensor) -> Tensor:
+                # the rows of the result are the columns of the weight
                 bits = quant_config["bits"]
                 assert bits in (2, 3, 4, 8)
                 assert qweight.dtype == qzeros.dtype
@@ -302,69 +530,123 @@ class ModelBase:
                 if bits in [2, 4, 8]:
                     pack_factor = pack_dtype_bits // bits
                     wf = torch.tensor(list(range(0, pack_dtype_bits, bits)), dtype=torch.int32).unsqueeze(0)
-                    if self.lazy:
-                        wf = LazyTorchTensor.from_eager(wf)
 
+                    # start is a multiple of pack_factor, since the zeros are packed along the columns
+                    qzeros = qzeros[:, start // pack_factor:(stop + pack_factor - 1) // pack_factor]
                     zeros = torch.bitwise_right_shift(
                         qzeros.unsqueeze(2).expand(-1, -1, pack_factor),
                         wf.unsqueeze(0)
                     ).to(torch.int16 if bits == 8 else torch.int8)
-                    zeros = torch.bitwise_and(zeros, maxq).reshape(scales.shape)
+                    zeros = torch.bitwise_and(zeros, maxq).reshape(qzeros.shape[0], -1)[:, :stop - start]
 
                     weight = torch.bitwise_and(
                         torch.bitwise_right_shift(
-                            qweight.unsqueeze(1).expand(-1, pack_factor, -1),
+                            qweight[:, start:stop].unsqueeze(1).expand(-1, pack_factor, -1),
                             wf.unsqueeze(-1)
                         ).to(torch.int16 if bits == 8 else torch.int8),
                         maxq
                     )
+                    weight = weight.reshape(weight.shape[0] * weight.shape[1], weight.shape[2])
                 elif bits == 3:
-                    raise NotImplementedError("3-bit gptq dequantization is not yet implemented")
+                    # start is a multiple of 32, since the zeros are packed by 32 in 3 words along the columns
+                    qzeros = qzeros[:, start // 32 * 3:(stop + 31) // 32 * 3]
+                    zeros = unpack_3bit(qzeros.T).T[:, :stop - start]
+                    weight = unpack_3bit(qweight[:, start:stop])
 
                 assert weight is not None
                 assert zeros is not None
 
-                weight = weight.reshape(weight.shape[0] * weight.shape[1], weight.shape[2])
-
                 # gptq_v2 doesn't need to offset zeros
                 if quant_config.get("checkpoint_format", "gptq") == "gptq":
                     zeros += 1
 
-                return (scales[g_idx].float() * (weight - zeros[g_idx]).float()).T
+                return (scales[:, start:stop][g_idx].float() * (weight - zeros[g_idx]).float()).T
 
-            def dequant_packed(w: Tensor, scale: Tensor, shape_tensor: Tensor, zero_point: Tensor | None, num_bits: int, group_size: int):
+            def dequant_packed(start: int, stop: int, w: Tensor, scale: Tensor, zero_point: Tensor | None, shape: tuple[int, ...], num_bits: int, group_size: int):
                 assert w.dtype == torch.int32
-                shape = tuple(shape_tensor.tolist())
                 assert len(shape) == 2
                 mask = (1 << num_bits) - 1
 
                 shifts = torch.arange(0, 32 - (num_bits - 1), num_bits, dtype=torch.int32)
-                if self.lazy:
-                    shifts = LazyTorchTensor.from_eager(shifts)
 
                 if zero_point is None:
                     offset = 1 << (num_bits - 1)
                 else:
                     assert len(zero_point.shape) == 2
+                    # start is a multiple of the pack factor, since the zero-point is packed along dim 0
+                    pack_factor = len(shifts)
+                    zero_point = zero_point[start // pack_factor:(stop + pack_factor - 1) // pack_factor]
                     offset = (zero_point.unsqueeze(1) >> shifts.reshape(1, -1, 1)) & mask
                     offset = offset.reshape(-1, zero_point.shape[1])
                     # trim padding, and prepare for broadcast
-                    # NOTE: the zero-point is packed along dim 0
-                    offset = offset[:shape[0], :].unsqueeze(-1)
+                    offset = offset[:stop - start, :].unsqueeze(-1)
 
                 # extract values
                 # NOTE: the weights are packed along dim 1
-                unpacked = (w.unsqueeze(-1) >> shifts.reshape(1, 1, -1)) & mask
-                unpacked = unpacked.reshape(shape[0], -1)
+                unpacked = (w[start:stop].unsqueeze(-1) >> shifts.reshape(1, 1, -1)) & mask
+                unpacked = unpacked.reshape(stop - start, -1)
 
                 # trim padding
                 unpacked = unpacked[:, :shape[1]]
 
                 # prepare for broadcast of the scale
-                unpacked = unpacked.reshape(shape[0], (unpacked.shape[-1] + group_size - 1) // group_size, group_size)
+                unpacked = unpacked.reshape(stop - start, (unpacked.shape[-1] + group_size - 1) // group_size, group_size)
                 unpacked = unpacked - offset
 
-                return (unpacked * scale.unsqueeze(-1).float()).reshape(shape)
+                return (unpacked * scale[start:stop].unsqueeze(-1).float()).reshape(stop - start, shape[1])
+
+            def compressed_tensors_group_of(groups: dict[str, Any]) -> Callable[[str], str | None]:
+                # A target is either a module name, a regex prefixed by "re:" which must match from the start of the module name,
+                # or a module class name. Like in compressed-tensors, a module name takes precedence over a regex,
+                # and a regex over a class name. The classes aren't known here, so a class name (e.g. "Linear") matches any module.
+                by_name: dict[str, str] = {}
+                regexes: list[tuple[re.Pattern[str], str]] = []
+                by_class: str | None = None
+                for group_name, group in groups.items():
+                    for target in group.get("targets", ()):
+                        if target.startswith("re:"):
+                            # each regex is compiled on its own, so that its inline flags and backreferences keep working
+                            regexes.append((re.compile(target[3:]), group_name))
+                        elif "." not in target and target[:1].isupper():
+                            by_class = by_class or group_name
+                        else:
+                            by_name.setdefault(target, group_name)
+
+                def group_of(module_name: str) -> str | None:
+                    if (group_name := by_name.get(module_name)) is not None:
+                        return group_name
+                    # the first matching regex wins
+                    for regex, group_name in regexes:
+                        if regex.match(module_name) is not None:
+                            return group_name
+                    return by_class
+
+                return group_of
+
+            def dequant_bitnet_tensor(weight: Tensor, scale: Tensor) -> Tensor:
+                return self.dequant_tensor(dequant_bitnet, weight, scale, shape=(4 * weight.shape[0], *weight.shape[1:]))
+
+            def dequant_simple_tensor(weight: Tensor, scale: Tensor, block_size: Sequence[int] | None) -> Tensor:
+                transcode = None
+                if weight.dtype in (torch.float8_e4m3fn, torch.float8_e5m2, torch.int8) and weight.ndim == 2 and (
+                    block_size[1] % 32 == 0 if block_size is not None else scale.ndim < 2 or scale.shape[-1] == 1
+                ):
+                    transcode = {gguf.GGMLQuantizationType.Q8_0: transcode_simple_q8_0}
+                return self.dequant_tensor(
+                    dequant_simple, weight, scale, block_size, row_align=block_size[0] if block_size is not None else 1, transcode=transcode,
+                )
+
+            def dequant_gptq_tensor(g_idx: Tensor, qweight: Tensor, qzeros: Tensor, scales: Tensor) -> Tensor:
+                bits = quant_config["bits"]
+                pack_dtype_bits = qweight.dtype.itemsize * 8
+                shape = (qweight.shape[1], qweight.shape[0] * pack_dtype_bits // bits)
+                # the number of values packed in a whole number of words
+                row_align = pack_dtype_bits // math.gcd(pack_dtype_bits, bits)
+                return self.dequant_tensor(dequant_gptq, g_idx, qweight, qzeros, scales, shape=shape, row_align=row_align)
+
+            def dequant_packed_tensor(w: Tensor, scale: Tensor, shape_tensor: Tensor, zero_point: Tensor | None, num_bits: int, group_size: int) -> Tensor:
+                shape = tuple(shape_tensor.tolist())
+                return self.dequant_tensor(dequant_packed, w, scale, zero_point, shape, num_bits, group_size, shape=shape, row_align=32 // num_bits)
 
             if quant_method == "bitnet":
                 for name in self.model_tensors.keys():
@@ -372,7 +654,7 @@ class ModelBase:
                         weight_name = name.removesuffix("_scale")
                         w = self.model_tensors[weight_name]
                         s = self.model_tensors[name]
-                        self.model_tensors[weight_name] = lambda w=w, s=s: dequant_bitnet(w(), s())
+                        self.model_tensors[weight_name] = lambda w=w, s=s: dequant_bitnet_tensor(w(), s())
                         tensors_to_remove.append(name)
             elif quant_method == "fp8":
                 block_size = quant_config.get("weight_block_size")
@@ -381,7 +663,7 @@ class ModelBase:
                         weight_name = name.removesuffix("_scale_inv")
                         w = self.model_tensors[weight_name]
                         s = self.model_tensors[name]
-                        self.model_tensors[weight_name] = lambda w=w, s=s, bs=block_size: dequant_simple(w(), s(), bs)
+                        self.model_tensors[weight_name] = lambda w=w, s=s, bs=block_size: dequant_simple_tensor(w(), s(), bs)
                         tensors_to_remove.append(name)
                     if name.endswith(".activation_scale"):  # unused
                         tensors_to_remove.append(name)
@@ -390,7 +672,7 @@ class ModelBase:
                         weight_name = name.removesuffix("qscale_weight") + "weight"
                         w = self.model_tensors[weight_name]
                         s = self.model_tensors[name]
-                        self.model_tensors[weight_name] = lambda w=w, s=s, bs=block_size: dequant_simple(w(), s(), bs)
+                        self.model_tensors[weight_name] = lambda w=w, s=s, bs=block_size: dequant_simple_tensor(w(), s(), bs)
                         tensors_to_remove.append(name)
                     if name.endswith(".qscale_act"):
                         tensors_to_remove.append(name)
@@ -403,7 +685,7 @@ class ModelBase:
                         qzeros = self.model_tensors[base_name + ".qzeros"]
                         scales = self.model_tensors[base_name + ".scales"]
                         new_tensors[base_name + ".weight"] = (
-                            lambda g=g_idx, z=qzeros, w=qweight, s=scales: dequant_gptq(
+                            lambda g=g_idx, z=qzeros, w=qweight, s=scales: dequant_gptq_tensor(
                                 g(), w(), z(), s()
                             )
                         )
@@ -417,32 +699,36 @@ class ModelBase:
                             )
                         ]
             elif quant_method == "compressed-tensors":
-                quant_format = quant_config["format"]
-                groups = quant_config["config_groups"]
-                if len(groups) > 1:
-                    raise NotImplementedError("Can't handle multiple config groups for compressed-tensors yet")
-                weight_config = tuple(groups.values())[0]["weights"]
-
-                if quant_format == "float-quantized" or quant_format == "int-quantized" or quant_format == "naive-quantized":
-                    block_size = weight_config.get("block_structure", None)
-                    strategy = weight_config.get("strategy")
-                    assert strategy == "channel" or strategy == "block"
-                    assert weight_config.get("group_size") is None  # didn't find a model using this yet
-                    for name in self.model_tensors.keys():
-                        if name.endswith(".weight_scale"):
-                            weight_name = name.removesuffix("_scale")
-                            w = self.model_tensors[weight_name]
-                            s = self.model_tensors[name]
-                            self.model_tensors[weight_name] = lambda w=w, s=s: dequant_simple(w(), s(), block_size)
-                            tensors_to_remove.append(name)
-                elif quant_format == "pack-quantized":
-                    assert weight_config.get("strategy") == "group"
-                    assert weight_config.get("type", "int") == "int"
-                    num_bits = weight_config.get("num_bits")
-                    group_size = weight_config.get("group_size")
-                    assert isinstance(num_bits, int)
-                    assert isinstance(group_size, int)
-                    for name in self.model_tensors.keys():
+                groups: dict[str, Any] = quant_config["config_groups"]
+                group_of = compressed_tensors_group_of(groups)
+
+                formats: dict[str, str] = {}
+                for group_name, group in groups.items():
+                    # mixed-precision checkpoints have a format per group
+                    quant_format = group.get("format") or quant_config["format"]
+                    weight_config = group["weights"]
+                    if quant_format == "float-quantized" or quant_format == "int-quantized" or quant_format == "naive-quantized":
+                        strategy = weight_config.get("strategy")
+                        assert strategy == "channel" or strategy == "block"
+                        assert weight_config.get("group_size") is None  # didn't find a model using this yet
+                    elif quant_format == "pack-quantized":
+                        assert weight_config.get("strategy") == "group"
+                        assert weight_config.get("type", "int") == "int"
+                        assert isinstance(weight_config.get("num_bits"), int)
+                        assert isinstance(weight_config.get("group_size"), int)
+                    else:
+                        raise NotImplementedError(f"Quant format {quant_format!r} for method {quant_method!r} is not yet supported")
+                    formats[group_name] = quant_format
+
+                for name in self.model_tensors.keys():
+                    if not name.endswith((".weight_scale", ".weight_packed")):
+                        continue
+                    module_name = name.rsplit(".", 1)[0]
+                    if (group_name := group_of(module_name)) is None:
+                        raise ValueError(f"No compressed-tensors config group targets {module_name!r}")
+                    weight_config = groups[group_name]["weights"]
+
+                    if formats[group_name] == "pack-quantized":
                         if name.endswith(".weight_packed"):
                             base_name = name.removesuffix("_packed")
                             w = self.model_tensors[name]
@@ -450,15 +736,19 @@ class ModelBase:
                             shape = self.model_tensors[base_name + "_shape"]
                             zero_point = self.model_tensors.get(base_name + "_zero_point", lambda: None)
                             new_tensors[base_name] = (
-                                lambda w=w, scale=scale, shape=shape, zero_point=zero_point: dequant_packed(
-                                    w(), scale(), shape(), zero_point(), num_bits, group_size,
+                                lambda w=w, scale=scale, shape=shape, zero_point=zero_point, nb=weight_config["num_bits"], gs=weight_config["group_size"]: dequant_packed_tensor(
+                                    w(), scale(), shape(), zero_point(), nb, gs,
                                 )
                             )
                             tensors_to_remove += [base_name + n for n in ("_packed", "_shape", "_scale")]
                             if (base_name + "_zero_point") in self.model_tensors:
                                 tensors_to_remove.append(base_name + "_zero_point")
-                else:
-                    raise NotImplementedError(f"Quant format {quant_format!r} for method {quant_method!r} is not yet supported")
+                    elif name.endswith(".weight_scale"):
+                        weight_name = name.removesuffix("_scale")
+                        w = self.model_tensors[weight_name]
+                        s = self.model_tensors[name]
+                        self.model_tensors[weight_name] = lambda w=w, s=s, bs=weight_config.get("block_structure"): dequant_simple_tensor(w(), s(), bs)
+                        tensors_to_remove.append(name)
             else:
                 raise NotImplementedError(f"Quant method is not yet supported: {quant_method!r}")
 
@@ -521,16 +811,25 @@ class ModelBase:
     def prepare_tensors(self):
         max_name_len = max(len(s) for _, s in self.tensor_map.mapping.values()) + len(".weight,")
 
-        for name, data_torch in chain(self.generate_extra_tensors(), self.get_tensors()):
+        tensors: Iterable[tuple[str, Tensor]] = chain(self.generate_extra_tensors(), self.get_tensors())
+        if self.profiler is not None and not self.lazy:
+            tensors = self.profiler.reads(tensors)
+
+        for name, data_torch in tensors:
             # we don't need these
             if name.endswith((".attention.masked_bias", ".attention.bias", ".rotary_emb.inv_freq")):
                 continue
 
             old_dtype = data_torch.dtype
+            # the tensor as it is in a local safetensors file, if it's not converted its bytes can be copied as is
+            source_torch = data_torch
+            source = LazyTorchTensor.local_source(data_torch)
 
             # convert any unsupported data types to float32
             if data_torch.dtype not in (torch.float16, torch.float32):
-                data_torch = data_torch.to(torch.float32)
+                with self.profile("cast", name):
+                    data_torch = data_torch.to(torch.float32)
+                self.profile_mark(data_torch, "cast", source_torch)
 
             # use the first number-like part of the tensor name as the block id
             bid = None
@@ -539,10 +838,12 @@ class ModelBase:
                     bid = int(part)
                     break
 
-            for new_name, data_torch in (self.modify_tensors(data_torch, name, bid)):
+            for new_name, data_torch in self.profile_iter("modify", name, self.modify_tensors(data_torch, name, bid)):
                 # TODO: why do we squeeze here?
                 # data = data_torch.squeeze().numpy()
-                data = data_torch.numpy()
+                with self.profile("cast", new_name):
+                    data = data_torch.numpy()
+                self.profile_mark(data, "cast")
 
                 n_dims = len(data.shape)
                 data_qtype: gguf.GGMLQuantizationType | bool = self.tensor_force_quant(name, new_name, bid, n_dims)
@@ -615,12 +916,15 @@ class ModelBase:
                     else:
                         raise ValueError(f"Unknown file type: {self.ftype.name}")
 
-                try:
-                    data = gguf.quants.quantize(data, data_qtype)
-                except gguf.QuantError as e:
-                    logger.warning("%s, %s", e, "falling back to F16")
-                    data_qtype = gguf.GGMLQuantizationType.F16
-                    data = gguf.quants.quantize(data, data_qtype)
+                unquantized = data
+                with self.profile("quantize", new_name):
+                    try:
+                        data = gguf.quants.quantize(data, data_qtype)
+                    except gguf.QuantError as e:
+                        logger.warning("%s, %s", e, "falling back to F16")
+                        data_qtype = gguf.GGMLQuantizationType.F16
+                        data = gguf.quants.quantize(data, data_qtype)
+                self.profile_mark(data, "quantize", unquantized)
 
                 shape = gguf.quant_shape_from_byte_shape(data.shape, data_qtype) if data.dtype == np.uint8 else data.shape
 
@@ -630,8 +934,19 @@ class ModelBase:
                 # n_dims is implicit in the shape
                 logger.info(f"{f'%-{max_name_len}s' % f'{new_name},'} {old_dtype} --> {data_qtype.name}, shape = {shape_str}")
 
+                # unchanged by modify_tensors, so it can be dequantized and quantized by chunks
+                if data_torch is source_torch and isinstance(data_torch, LazyTorchTensor) and \
+                        (quantized := getattr(data_torch._func, "quantized", None)) is not None:
+                    data = gguf.LazyNumpyTensor(meta=data._meta, args=data_torch._args, func=quantized(data_qtype))
+                    self.profile_mark(data, "quantize")
+
                 self.gguf_writer.add_tensor(new_name, data, raw_dtype=data_qtype)
 
+                # unchanged by modify_tensors, and already of the output type
+                if source is not None and data_torch is source_torch and \
+                        (old_dtype, data_qtype) in ((torch.float16, gguf.GGMLQuantizationType.F16), (torch.float32, gguf.GGMLQuantizationType.F32)):
+                    self.gguf_writer.add_tensor_source(new_name, source)
+
     def set_type(self):
         self.gguf_writer.add_type(gguf.GGUFType.MODEL)
 
@@ -668,12 +983,16 @@ class ModelBase:
         raise NotImplementedError("write_vocab() must be implemented in subclasses")
 
     def write(self):
-        self.prepare_tensors()
-        self.prepare_metadata(vocab_only=False)
-        self.gguf_writer.write_header_to_file(path=self.fname_out)
-        self.gguf_writer.write_kv_data_to_file()
-        self.gguf_writer.write_tensors_to_file(progress=True)
-        self.gguf_writer.close()
+        with self.profile("prepare"):
+            self.prepare_tensors()
+        with self.profile("metadata"):
+            self.prepare_metadata(vocab_only=False)
+        with self.profile("header"):
+            self.gguf_writer.write_header_to_file(path=self.fname_out)
+            self.gguf_writer.write_kv_data_to_file()
+        with self.profile("tensors"):
+            self.gguf_writer.write_tensors_to_file(progress=True)
+            self.gguf_writer.close()
 
     @staticmethod
     def get_model_part_names(dir_model: Path, prefix: str, suffix: str) -> list[str]:
@@ -696,6 +1015,7 @@ class ModelBase:
         try:
             # for security reason, we don't allow loading remote code by default
             # if a model need remote code, we will fallback to config.json
+            from transformers import AutoConfig
             config = AutoConfig.from_pretrained(dir_model, trust_remote_code=False).to_dict()
         except Exception as e:
             logger.warning(f"Failed to load model config from {dir_model}: {e}")
@@ -885,8 +1205,40 @@ class TextModel(ModelBase):
 
         return seems_special
 
+    # files which can change the vocab extracted by AutoTokenizer
+    tokenizer_files = ("tokenizer.json", "tokenizer_config.json", "special_tokens_map.json", "added_tokens.json",
+                       "vocab.json", "vocab.txt", "merges.txt", "tokenizer.model", "tiktoken.model")
+
+    def vocab_cache_key(self) -> str | None:
+        if self.tensor_cache is None:
+            return None
+        try:
+            # remote code can also define the tokenizer
+            files = sorted(f for f in self.dir_model.iterdir() if f.name in self.tokenizer_files or f.suffix == ".py")
+            parts = [f"{f.name}:{self.tensor_cache.content_id(f)}" for f in files]
+            parts += [self.tensor_cache._id(getattr(type(self), name), {}) for name in ("_get_vocab_base", "get_vocab_base_pre", "does_token_look_special")]
+        except (TensorCache.Uncacheable, OSError) as e:
+            logger.debug(f"not caching the vocab: {e}")
+            return None
+        parts += [self.tensor_cache.code_version, type(self).__qualname__, repr(self.hparams.get("vocab_size")), repr(sorted(self.vocab_base_pre.items()))]
+        return sha256("\n".join(parts).encode()).hexdigest()
+
     # used for GPT-2 BPE and WordPiece vocabs
     def get_vocab_base(self) -> tuple[list[str], list[int], str]:
+        # the vocab only depends on the tokenizer files, so it can be reused without loading the tokenizer
+        if (key := self.vocab_cache_key()) is not None:
+            if (cached := self.tensor_cache.load_metadata(key)) is not None:  # type: ignore
+                logger.info("Using the cached vocab")
+                tokens, toktypes, tokpre = cached
+                return tokens, [gguf.TokenType(t) for t in toktypes], tokpre
+
+        tokens, toktypes, tokpre = self._get_vocab_base()
+
+        if key is not None:
+            self.tensor_cache.store_metadata(key, [tokens, [int(t) for t in toktypes], tokpre])  # type: ignore
+        return tokens, toktypes, tokpre
+
+    def _get_vocab_base(self) -> tuple[list[str], list[int], str]:
         tokens: list[str] = []
         toktypes: list[int] = []
 
@@ -930,9 +1282,150 @@ class TextModel(ModelBase):
 
         return tokens, toktypes, tokpre
 
-    # NOTE: this function is generated by convert_hf_to_gguf_update.py
-    #       do not modify it manually!
+    # NOTE: this table is maintained by hand
+    #       convert_hf_to_gguf_update.py still generates a chain of `if chkhsh == ...` (between the markers below),
+    #       add the new hashes it finds here
     # ref:  https://github.com/ggml-org/llama.cpp/pull/6920
+    # maps the hash of the tokens of chktxt (see get_vocab_base_pre()) to the name of the pre-tokenizer
+    vocab_base_pre: dict[str, str] = {
+        # ref: https://huggingface.co/THUDM/glm-4-9b-chat
+        "b6e8e1518dc4305be2fe39c313ed643381c4da5db34a98f6a04c093f8afbe99b": "chatglm-bpe",
+        # ref: https://huggingface.co/THUDM/glm-4-9b-chat
+        "81d72c7348a9f0ebe86f23298d37debe0a5e71149e29bd283904c02262b27516": "chatglm-bpe",
+        # ref: https://huggingface.co/THUDM/glm-4-9b-hf
+        "a1336059768a55c99a734006ffb02203cd450fed003e9a71886c88acf24fdbc2": "glm4",
+        # ref: https://huggingface.co/zai-org/GLM-4.5-Air
+        "9ca2dd618e8afaf09731a7cf6e2105b373ba6a1821559f258b272fe83e6eb902": "glm4",
+        # ref: https://huggingface.co/sapienzanlp/Minerva-7B-base-v1.0
+        "1431a23e583c97432bc230bff598d103ddb5a1f89960c8f1d1051aaa944d0b35": "minerva-7b",
+        # ref: https://huggingface.co/tencent/Hunyuan-A13B-Instruct
+        "7e57df22b1fe23a7b1e1c7f3dc4e3f96d43a4eb0836d0c6bdc3436d7b2f1c664": "hunyuan",
+        # ref: https://huggingface.co/tencent/Hunyuan-4B-Instruct
+        "bba3b3366b646dbdded5dbc42d59598b849371afc42f7beafa914afaa5b70aa6": "hunyuan-dense",
+        # ref: https://huggingface.co/tiiuae/Falcon-H1-0.5B-Base
+        "a6b57017d60e6edb4d88ecc2845188e0eb333a70357e45dcc9b53964a73bbae6": "falcon-h1",
+        # ref: https://huggingface.co/tiiuae/Falcon-H1-1B-Base
+        "60476e1243776c4fb1b993dbd7a5f15ac22f83c80afdf425fa5ae01c8d44ef86": "falcon-h1",
+        # ref: https://huggingface.co/tiiuae/Falcon-H1-7B-Base
+        "3eda48b4c4dc7de733d1a8b3e3b4a85243dbbf704da2ee9d42c6beced8897896": "falcon-h1",
+        # ref: https://huggingface.co/tiiuae/Falcon-H1-34B-Base
+        "48f8e02c0359c0bbdd82f26909171fac1c18a457bb47573ed1fe3bbb2c1cfd4b": "falcon-h1",
+        # ref: https://huggingface.co/moonshotai/Kimi-K2-Base
+        "81212dc7cdb7e0c1074ca62c5aeab0d43c9f52b8a737be7b12a777c953027890": "kimi-k2",
+        # ref: https://huggingface.co/Qwen/Qwen3-Embedding-0.6B
+        "d4540891389ea895b53b399da6ac824becc30f2fba0e9ddbb98f92e55ca0e97c": "qwen2",
+        # ref: https://huggingface.co/alvarobartt/grok-2-tokenizer
+        "66b8d4e19ab16c3bfd89bce5d785fb7e0155e8648708a1f42077cb9fe002c273": "grok-2",
+        # ref: https://huggingface.co/meta-llama/Meta-Llama-3-8B
+        "0ef9807a4087ebef797fc749390439009c3b9eda9ad1a097abbe738f486c01e5": "llama-bpe",
+        # ref: https://huggingface.co/deepseek-ai/deepseek-llm-7b-base
+        "049ecf7629871e3041641907f3de7c733e4dbfdc736f57d882ba0b0845599754": "deepseek-llm",
+        # ref: https://huggingface.co/deepseek-ai/deepseek-coder-6.7b-base
+        "347715f544604f9118bb75ed199f68779f423cabb20db6de6f31b908d04d7821": "deepseek-coder",
+        # ref: https://huggingface.co/tiiuae/falcon-7b
+        "8aeee3860c56296a157a1fe2fad249ec40aa59b1bb5709f4ade11c4e6fe652ed": "falcon",
+        # ref: https://huggingface.co/tiiuae/Falcon3-7B-Base
+        "9d032fcbd5501f4a38150912590928bfb36091efb5df11b8e2124b0390e3fb1e": "falcon3",
+        # ref: https://huggingface.co/BAAI/bge-large-zh-v1.5
+        "8e62295832751ca1e8f92f2226f403dea30dc5165e448b5bfa05af5340c64ec7": "bert-bge-large",
+        # ref: https://huggingface.co/bigcode/starcoder2-3b
+        "35d91631860c815f952d711435f48d356ebac988362536bed955d43bfa436e34": "starcoder",
+        # ref: https://huggingface.co/openai-community/gpt2
+        "3ce83efda5659b07b1ad37ca97ca5797ea4285d9b9ab0dc679e4a720c9da7454": "gpt-2",
+        # ref: https://huggingface.co/stabilityai/stablelm-2-zephyr-1_6b
+        "32d85c31273f8019248f2559fed492d929ea28b17e51d81d3bb36fff23ca72b3": "stablelm2",
+        # ref: https://huggingface.co/smallcloudai/Refact-1_6-base
+        "6221ad2852e85ce96f791f476e0b390cf9b474c9e3d1362f53a24a06dc8220ff": "refact",
+        # ref: https://huggingface.co/CohereForAI/c4ai-command-r-v01
+        "9c2227e4dd922002fb81bde4fc02b0483ca4f12911410dee2255e4987644e3f8": "command-r",
+        # ref: https://huggingface.co/Qwen/Qwen1.5-7B
+        "e636dc30a262dcc0d8c323492e32ae2b70728f4df7dfe9737d9f920a282b8aea": "qwen2",
+        # ref: https://huggingface.co/mosaicml/mpt-7b
+        # (same hash as the 'mpt' pre-tokenizer, which this entry supersedes)
+        # ref: https://huggingface.co/allenai/OLMo-1.7-7B-hf
+        "b6dc8df998e1cfbdc4eac8243701a65afe638679230920b50d6f17d81c098166": "olmo",
+        # ref: https://huggingface.co/databricks/dbrx-base
+        "a8594e3edff7c29c003940395316294b2c623e09894deebbc65f33f1515df79e": "dbrx",
+        # ref: https://huggingface.co/jinaai/jina-reranker-v1-tiny-en
+        "c7699093ba4255a91e702aa38a596aa81669f3525dae06c2953267dde580f448": "jina-v1-en",
+        # ref: https://huggingface.co/BAAI/bge-small-en-v1.5
+        # (same hash as the 'bert-bge' pre-tokenizer, which this entry supersedes)
+        # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-en
+        "0876d13b50744004aa9aeae05e7b0647eac9d801b5ba4668afc01e709c15e19f": "jina-v2-en",
+        # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-es
+        "171aeeedd6fb548d418a7461d053f11b6f1f1fc9b387bd66640d28a4b9f5c643": "jina-v2-es",
+        # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-de
+        "27949a2493fc4a9f53f5b9b029c82689cfbe5d3a1929bb25e043089e28466de6": "jina-v2-de",
+        # ref: https://huggingface.co/abacusai/Smaug-Llama-3-70B-Instruct
+        "c136ed14d01c2745d4f60a9596ae66800e2b61fa45643e72436041855ad4089d": "smaug-bpe",
+        # ref: https://huggingface.co/LumiOpen/Poro-34B-chat
+        "c7ea5862a53e4272c035c8238367063e2b270d51faa48c0f09e9d5b54746c360": "poro-chat",
+        # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-code
+        "7967bfa498ade6b757b064f31e964dddbb80f8f9a4d68d4ba7998fcf281c531a": "jina-v2-code",
+        # ref: https://huggingface.co/LumiOpen/Viking-7B
+        "7fc505bd3104ca1083b150b17d088b59534ede9bde81f0dd2090967d7fe52cee": "viking",
+        # ref: https://huggingface.co/core42/jais-13b
+        "b53802fb28e26d645c3a310b34bfe07da813026ec7c7716883404d5e0f8b1901": "jais",
+        # ref: https://huggingface.co/WisdomShell/CodeShell-7B
+        "7b3e7548e4308f52a76e8229e4e6cc831195d0d1df43aed21ac6c93da05fec5f": "codeshell",
+        # ref: https://huggingface.co/mistralai/Mistral-Nemo-Base-2407
+        "63b97e4253352e6f357cc59ea5b583e3a680eaeaf2632188c2b952de2588485e": "tekken",
+        # ref: https://huggingface.co/HuggingFaceTB/SmolLM-135M
+        "855059429035d75a914d1eda9f10a876752e281a054a7a3d421ef0533e5b6249": "smollm",
+        # ref: https://huggingface.co/bigscience/bloom
+        "3c30d3ad1d6b64202cd222813e7736c2db6e1bd6d67197090fc1211fbc612ae7": "bloom",
+        # ref: https://huggingface.co/TurkuNLP/gpt3-finnish-small
+        "bc01ce58980e1db43859146dc51b1758b3b88729b217a74792e9f8d43e479d21": "gpt3-finnish",
+        # ref: https://huggingface.co/LGAI-EXAONE/EXAONE-3.0-7.8B-Instruct
+        "4e2b24cc4770243d65a2c9ec19770a72f08cffc161adbb73fcbb6b7dd45a0aae": "exaone",
+        # ref: https://huggingface.co/microsoft/phi-2
+        "fcace8b9cac38ce847670c970cd5892031a753a1ef381abd1d9af00f713da085": "phi-2",
+        # ref: https://huggingface.co/facebook/chameleon-7b
+        "60824e3c0d9401f89943cbb2fff727f0e2d4c545ba4df2d6e4f09a6db0f5b450": "chameleon",
+        # ref: https://huggingface.co/sentence-transformers/stsb-roberta-base
+        "8b5a93ed704057481f240da0be7e7dca721d7f8f4755263b6807227a2cbeae65": "roberta-bpe",
+        # ref: https://huggingface.co/ai-sage/GigaChat-20B-A3B-instruct
+        "ad851be1dba641f2e3711822f816db2c265f788b37c63b4e1aeacb9ee92de8eb": "gigachat",
+        # ref: https://huggingface.co/Infinigence/Megrez-3B-Instruct
+        "d4c8f286ea6b520b3d495c4455483cfa2302c0cfcd4be05d781b6a8a0a7cdaf1": "megrez",
+        # ref: https://huggingface.co/deepseek-ai/DeepSeek-V3
+        "877081d19cf6996e2c4ff0e1236341e9b7bde288f5311a56a937f0afbbb3aeb5": "deepseek-v3",
+        # ref: https://huggingface.co/deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B
+        "b3f499bb4255f8ca19fccd664443283318f2fd2414d5e0b040fbdd0cc195d6c5": "deepseek-r1-qwen",
+        # ref: https://huggingface.co/Xenova/gpt-4o
+        "ccc2ef013c104be7bae2965776d611e1d7a8a2a9c547dd93a682c9a9fc80352e": "gpt-4o",
+        # ref: https://huggingface.co/UW/OLMo2-8B-SuperBPE-t180k
+        "7dec86086fcc38b66b7bc1575a160ae21cf705be7718b9d5598190d7c12db76f": "superbpe",
+        # ref: https://huggingface.co/trillionlabs/Trillion-7B-preview
+        "1994ffd01900cfb37395608534236ecd63f2bd5995d6cb1004dda1af50240f15": "trillion",
+        # ref: https://huggingface.co/inclusionAI/Ling-lite
+        "96a5f08be6259352137b512d4157e333e21df7edd3fcd152990608735a65b224": "bailingmoe",
+        # ref: https://huggingface.co/meta-llama/Llama-4-Scout-17B-16E-Instruct
+        "d353350c764d8c3b39c763113960e4fb4919bea5fbf208a0e3b22e8469dc7406": "llama4",
+        # ref: https://huggingface.co/mistral-community/pixtral-12b
+        "0e9433cbbb161f89e264eb32e8e64bfe69e834973ffca5d41d3948a604a3e2a3": "pixtral",
+        # ref: https://huggingface.co/ByteDance-Seed/Seed-Coder-8B-Base
+        "d5f1dd6f980fec569fb218a81a7658ac45fc56b38c5a0adeb1c232fbe04ef5ec": "seed-coder",
+        # ref: https://huggingface.co/skt/A.X-4.0
+        "b0a6b1c0bd5998ebd9df08611efde34a4ff03faed45ae09c43e6b31ebd4b94cf": "a.x-4.0",
+        # ref: https://huggingface.co/K-intelligence/Midm-2.0-Base-Instruct
+        "f6791d196f87ce6b56a7d234be618e0d58f8cda3549416635b2bebcd22cd95c4": "midm-2.0",
+        # ref: https://huggingface.co/LiquidAI/LFM2-Tokenizer
+        "169bf0296a13c4d9b7672313f749eb36501d931022de052aad6e36f2bf34dd51": "lfm2",
+        # ref: https://huggingface.co/LGAI-EXAONE/EXAONE-4.0-32B
+        "2085e1638f6c377a0aa4ead21b27bb4cb941bf800df86ed391011769c1758dfb": "exaone4",
+        # ref: https://huggingface.co/JetBrains/Mellum-4b-base
+        "a1e163ecab2e718a4c829d1148b6e86824ec36163bb71941c3dca9cd5ac25756": "mellum",
+        # ref: https://huggingface.co/arcee-ai/Trinity-Tokenizer
+        "49fc0303c9e0d2c2c565c510f64b2d9b271276acdcdadff733249eda9f7d59df": "afmoe",
+        # ref: https://huggingface.co/inclusionAI/Ling-mini-base-2.0
+        "9b1be57e70d20d9501b2b3186e792d81181ae36ada3903c26f9fea418cf87206": "bailingmoe2",
+        # ref: https://huggingface.co/ibm-granite/granite-docling-258M
+        "53e325976a6e142379c19b09afcae354f2f496f147afa8f9e189a33fe4e3024e": "granite-docling",
+        # ref: https://huggingface.co/MiniMaxAI/MiniMax-M2
+        "f4f37b6c8eb9ea29b3eac6bb8c8487c5ab7885f8d8022e67edc1c68ce8403e95": "minimax-m2",
+    }
+
     # Marker: Start get_vocab_base_pre
     def get_vocab_base_pre(self, tokenizer) -> str:
         # encoding this string and hashing the resulting tokens would (hopefully) give us a unique identifier that
@@ -948,215 +1441,7 @@ class TextModel(ModelBase):
         logger.debug(f"chktok: {chktok}")
         logger.debug(f"chkhsh: {chkhsh}")
 
-        res = None
-
-        # NOTE: if you get an error here, you need to update the convert_hf_to_gguf_update.py script
-        #       or pull the latest version of the model from Huggingface
-        #       don't edit the hashes manually!
-        if chkhsh == "b6e8e1518dc4305be2fe39c313ed643381c4da5db34a98f6a04c093f8afbe99b":
-            # ref: https://huggingface.co/THUDM/glm-4-9b-chat
-            res = "chatglm-bpe"
-        if chkhsh == "81d72c7348a9f0ebe86f23298d37debe0a5e71149e29bd283904c02262b27516":
-            # ref: https://huggingface.co/THUDM/glm-4-9b-chat
-            res = "chatglm-bpe"
-        if chkhsh == "a1336059768a55c99a734006ffb02203cd450fed003e9a71886c88acf24fdbc2":
-            # ref: https://huggingface.co/THUDM/glm-4-9b-hf
-            res = "glm4"
-        if chkhsh == "9ca2dd618e8afaf09731a7cf6e2105b373ba6a1821559f258b272fe83e6eb902":
-            # ref: https://huggingface.co/zai-org/GLM-4.5-Air
-            res = "glm4"
-        if chkhsh == "1431a23e583c97432bc230bff598d103ddb5a1f89960c8f1d1051aaa944d0b35":
-            # ref: https://huggingface.co/sapienzanlp/Minerva-7B-base-v1.0
-            res = "minerva-7b"
-        if chkhsh == "7e57df22b1fe23a7b1e1c7f3dc4e3f96d43a4eb0836d0c6bdc3436d7b2f1c664":
-            # ref: https://huggingface.co/tencent/Hunyuan-A13B-Instruct
-            res = "hunyuan"
-        if chkhsh == "bba3b3366b646dbdded5dbc42d59598b849371afc42f7beafa914afaa5b70aa6":
-            # ref: https://huggingface.co/tencent/Hunyuan-4B-Instruct
-            res = "hunyuan-dense"
-        if chkhsh == "a6b57017d60e6edb4d88ecc2845188e0eb333a70357e45dcc9b53964a73bbae6":
-            # ref: https://huggingface.co/tiiuae/Falcon-H1-0.5B-Base
-            res = "falcon-h1"
-        if chkhsh == "60476e1243776c4fb1b993dbd7a5f15ac22f83c80afdf425fa5ae01c8d44ef86":
-            # ref: https://huggingface.co/tiiuae/Falcon-H1-1B-Base
-            res = "falcon-h1"
-        if chkhsh == "3eda48b4c4dc7de733d1a8b3e3b4a85243dbbf704da2ee9d42c6beced8897896":
-            # ref: https://huggingface.co/tiiuae/Falcon-H1-7B-Base
-            res = "falcon-h1"
-        if chkhsh == "48f8e02c0359c0bbdd82f26909171fac1c18a457bb47573ed1fe3bbb2c1cfd4b":
-            # ref: https://huggingface.co/tiiuae/Falcon-H1-34B-Base
-            res = "falcon-h1"
-        if chkhsh == "81212dc7cdb7e0c1074ca62c5aeab0d43c9f52b8a737be7b12a777c953027890":
-            # ref: https://huggingface.co/moonshotai/Kimi-K2-Base
-            res = "kimi-k2"
-        if chkhsh == "d4540891389ea895b53b399da6ac824becc30f2fba0e9ddbb98f92e55ca0e97c":
-            # ref: https://huggingface.co/Qwen/Qwen3-Embedding-0.6B
-            res = "qwen2"
-        if chkhsh == "66b8d4e19ab16c3bfd89bce5d785fb7e0155e8648708a1f42077cb9fe002c273":
-            # ref: https://huggingface.co/alvarobartt/grok-2-tokenizer
-            res = "grok-2"
-        if chkhsh == "0ef9807a4087ebef797fc749390439009c3b9eda9ad1a097abbe738f486c01e5":
-            # ref: https://huggingface.co/meta-llama/Meta-Llama-3-8B
-            res = "llama-bpe"
-        if chkhsh == "049ecf7629871e3041641907f3de7c733e4dbfdc736f57d882ba0b0845599754":
-            # ref: https://huggingface.co/deepseek-ai/deepseek-llm-7b-base
-            res = "deepseek-llm"
-        if chkhsh == "347715f544604f9118bb75ed199f68779f423cabb20db6de6f31b908d04d7821":
-            # ref: https://huggingface.co/deepseek-ai/deepseek-coder-6.7b-base
-            res = "deepseek-coder"
-        if chkhsh == "8aeee3860c56296a157a1fe2fad249ec40aa59b1bb5709f4ade11c4e6fe652ed":
-            # ref: https://huggingface.co/tiiuae/falcon-7b
-            res = "falcon"
-        if chkhsh == "0876d13b50744004aa9aeae05e7b0647eac9d801b5ba4668afc01e709c15e19f":
-            # ref: https://huggingface.co/BAAI/bge-small-en-v1.5
-            res = "bert-bge"
-        if chkhsh == "9d032fcbd5501f4a38150912590928bfb36091efb5df11b8e2124b0390e3fb1e":
-            # ref: https://huggingface.co/tiiuae/Falcon3-7B-Base
-            res = "falcon3"
-        if chkhsh == "8e62295832751ca1e8f92f2226f403dea30dc5165e448b5bfa05af5340c64ec7":
-            # ref: https://huggingface.co/BAAI/bge-large-zh-v1.5
-            res = "bert-bge-large"
-        if chkhsh == "b6dc8df998e1cfbdc4eac8243701a65afe638679230920b50d6f17d81c098166":
-            # ref: https://huggingface.co/mosaicml/mpt-7b
-            res = "mpt"
-        if chkhsh == "35d91631860c815f952d711435f48d356ebac988362536bed955d43bfa436e34":
-            # ref: https://huggingface.co/bigcode/starcoder2-3b
-            res = "starcoder"
-        if chkhsh == "3ce83efda5659b07b1ad37ca97ca5797ea4285d9b9ab0dc679e4a720c9da7454":
-            # ref: https://huggingface.co/openai-community/gpt2
-            res = "gpt-2"
-        if chkhsh == "32d85c31273f8019248f2559fed492d929ea28b17e51d81d3bb36fff23ca72b3":
-            # ref: https://huggingface.co/stabilityai/stablelm-2-zephyr-1_6b
-            res = "stablelm2"
-        if chkhsh == "6221ad2852e85ce96f791f476e0b390cf9b474c9e3d1362f53a24a06dc8220ff":
-            # ref: https://huggingface.co/smallcloudai/Refact-1_6-base
-            res = "refact"
-        if chkhsh == "9c2227e4dd922002fb81bde4fc02b0483ca4f12911410dee2255e4987644e3f8":
-            # ref: https://huggingface.co/CohereForAI/c4ai-command-r-v01
-            res = "command-r"
-        if chkhsh == "e636dc30a262dcc0d8c323492e32ae2b70728f4df7dfe9737d9f920a282b8aea":
-            # ref: https://huggingface.co/Qwen/Qwen1.5-7B
-            res = "qwen2"
-        if chkhsh == "b6dc8df998e1cfbdc4eac8243701a65afe638679230920b50d6f17d81c098166":
-            # ref: https://huggingface.co/allenai/OLMo-1.7-7B-hf
-            res = "olmo"
-        if chkhsh == "a8594e3edff7c29c003940395316294b2c623e09894deebbc65f33f1515df79e":
-            # ref: https://huggingface.co/databricks/dbrx-base
-            res = "dbrx"
-        if chkhsh == "c7699093ba4255a91e702aa38a596aa81669f3525dae06c2953267dde580f448":
-            # ref: https://huggingface.co/jinaai/jina-reranker-v1-tiny-en
-            res = "jina-v1-en"
-        if chkhsh == "0876d13b50744004aa9aeae05e7b0647eac9d801b5ba4668afc01e709c15e19f":
-            # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-en
-            res = "jina-v2-en"
-        if chkhsh == "171aeeedd6fb548d418a7461d053f11b6f1f1fc9b387bd66640d28a4b9f5c643":
-            # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-es
-            res = "jina-v2-es"
-        if chkhsh == "27949a2493fc4a9f53f5b9b029c82689cfbe5d3a1929bb25e043089e28466de6":
-            # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-de
-            res = "jina-v2-de"
-        if chkhsh == "c136ed14d01c2745d4f60a9596ae66800e2b61fa45643e72436041855ad4089d":
-            # ref: https://huggingface.co/abacusai/Smaug-Llama-3-70B-Instruct
-            res = "smaug-bpe"
-        if chkhsh == "c7ea5862a53e4272c035c8238367063e2b270d51faa48c0f09e9d5b54746c360":
-            # ref: https://huggingface.co/LumiOpen/Poro-34B-chat
-            res = "poro-chat"
-        if chkhsh == "7967bfa498ade6b757b064f31e964dddbb80f8f9a4d68d4ba7998fcf281c531a":
-            # ref: https://huggingface.co/jinaai/jina-embeddings-v2-base-code
-            res = "jina-v2-code"
-        if chkhsh == "7fc505bd3104ca1083b150b17d088b59534ede9bde81f0dd2090967d7fe52cee":
-            # ref: https://huggingface.co/LumiOpen/Viking-7B
-            res = "viking"
-        if chkhsh == "b53802fb28e26d645c3a310b34bfe07da813026ec7c7716883404d5e0f8b1901":
-            # ref: https://huggingface.co/core42/jais-13b
-            res = "jais"
-        if chkhsh == "7b3e7548e4308f52a76e8229e4e6cc831195d0d1df43aed21ac6c93da05fec5f":
-            # ref: https://huggingface.co/WisdomShell/CodeShell-7B
-            res = "codeshell"
-        if chkhsh == "63b97e4253352e6f357cc59ea5b583e3a680eaeaf2632188c2b952de2588485e":
-            # ref: https://huggingface.co/mistralai/Mistral-Nemo-Base-2407
-            res = "tekken"
-        if chkhsh == "855059429035d75a914d1eda9f10a876752e281a054a7a3d421ef0533e5b6249":
-            # ref: https://huggingface.co/HuggingFaceTB/SmolLM-135M
-            res = "smollm"
-        if chkhsh == "3c30d3ad1d6b64202cd222813e7736c2db6e1bd6d67197090fc1211fbc612ae7":
-            # ref: https://huggingface.co/bigscience/bloom
-            res = "bloom"
-        if chkhsh == "bc01ce58980e1db43859146dc51b1758b3b88729b217a74792e9f8d43e479d21":
-            # ref: https://huggingface.co/TurkuNLP/gpt3-finnish-small
-            res = "gpt3-finnish"
-        if chkhsh == "4e2b24cc4770243d65a2c9ec19770a72f08cffc161adbb73fcbb6b7dd45a0aae":
-            # ref: https://huggingface.co/LGAI-EXAONE/EXAONE-3.0-7.8B-Instruct
-            res = "exaone"
-        if chkhsh == "fcace8b9cac38ce847670c970cd5892031a753a1ef381abd1d9af00f713da085":
-            # ref: https://huggingface.co/microsoft/phi-2
-            res = "phi-2"
-        if chkhsh == "60824e3c0d9401f89943cbb2fff727f0e2d4c545ba4df2d6e4f09a6db0f5b450":
-            # ref: https://huggingface.co/facebook/chameleon-7b
-            res = "chameleon"
-        if chkhsh == "8b5a93ed704057481f240da0be7e7dca721d7f8f4755263b6807227a2cbeae65":
-            # ref: https://huggingface.co/sentence-transformers/stsb-roberta-base
-            res = "roberta-bpe"
-        if chkhsh == "ad851be1dba641f2e3711822f816db2c265f788b37c63b4e1aeacb9ee92de8eb":
-            # ref: https://huggingface.co/ai-sage/GigaChat-20B-A3B-instruct
-            res = "gigachat"
-        if chkhsh == "d4c8f286ea6b520b3d495c4455483cfa2302c0cfcd4be05d781b6a8a0a7cdaf1":
-            # ref: https://huggingface.co/Infinigence/Megrez-3B-Instruct
-            res = "megrez"
-        if chkhsh == "877081d19cf6996e2c4ff0e1236341e9b7bde288f5311a56a937f0afbbb3aeb5":
-            # ref: https://huggingface.co/deepseek-ai/DeepSeek-V3
-            res = "deepseek-v3"
-        if chkhsh == "b3f499bb4255f8ca19fccd664443283318f2fd2414d5e0b040fbdd0cc195d6c5":
-            # ref: https://huggingface.co/deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B
-            res = "deepseek-r1-qwen"
-        if chkhsh == "ccc2ef013c104be7bae2965776d611e1d7a8a2a9c547dd93a682c9a9fc80352e":
-            # ref: https://huggingface.co/Xenova/gpt-4o
-            res = "gpt-4o"
-        if chkhsh == "7dec86086fcc38b66b7bc1575a160ae21cf705be7718b9d5598190d7c12db76f":
-            # ref: https://huggingface.co/UW/OLMo2-8B-SuperBPE-t180k
-            res = "superbpe"
-        if chkhsh == "1994ffd01900cfb37395608534236ecd63f2bd5995d6cb1004dda1af50240f15":
-            # ref: https://huggingface.co/trillionlabs/Trillion-7B-preview
-            res = "trillion"
-        if chkhsh == "96a5f08be6259352137b512d4157e333e21df7edd3fcd152990608735a65b224":
-            # ref: https://huggingface.co/inclusionAI/Ling-lite
-            res = "bailingmoe"
-        if chkhsh == "d353350c764d8c3b39c763113960e4fb4919bea5fbf208a0e3b22e8469dc7406":
-            # ref: https://huggingface.co/meta-llama/Llama-4-Scout-17B-16E-Instruct
-            res = "llama4"
-        if chkhsh == "0e9433cbbb161f89e264eb32e8e64bfe69e834973ffca5d41d3948a604a3e2a3":
-            # ref: https://huggingface.co/mistral-community/pixtral-12b
-            res = "pixtral"
-        if chkhsh == "d5f1dd6f980fec569fb218a81a7658ac45fc56b38c5a0adeb1c232fbe04ef5ec":
-            # ref: https://huggingface.co/ByteDance-Seed/Seed-Coder-8B-Base
-            res = "seed-coder"
-        if chkhsh == "b0a6b1c0bd5998ebd9df08611efde34a4ff03faed45ae09c43e6b31ebd4b94cf":
-            # ref: https://huggingface.co/skt/A.X-4.0
-            res = "a.x-4.0"
-        if chkhsh == "f6791d196f87ce6b56a7d234be618e0d58f8cda3549416635b2bebcd22cd95c4":
-            # ref: https://huggingface.co/K-intelligence/Midm-2.0-Base-Instruct
-            res = "midm-2.0"
-        if chkhsh == "169bf0296a13c4d9b7672313f749eb36501d931022de052aad6e36f2bf34dd51":
-            # ref: https://huggingface.co/LiquidAI/LFM2-Tokenizer
-            res = "lfm2"
-        if chkhsh == "2085e1638f6c377a0aa4ead21b27bb4cb941bf800df86ed391011769c1758dfb":
-            # ref: https://huggingface.co/LGAI-EXAONE/EXAONE-4.0-32B
-            res = "exaone4"
-        if chkhsh == "a1e163ecab2e718a4c829d1148b6e86824ec36163bb71941c3dca9cd5ac25756":
-            # ref: https://huggingface.co/JetBrains/Mellum-4b-base
-            res = "mellum"
-        if chkhsh == "49fc0303c9e0d2c2c565c510f64b2d9b271276acdcdadff733249eda9f7d59df":
-            # ref: https://huggingface.co/arcee-ai/Trinity-Tokenizer
-            res = "afmoe"
-        if chkhsh == "9b1be57e70d20d9501b2b3186e792d81181ae36ada3903c26f9fea418cf87206":
-            # ref: https://huggingface.co/inclusionAI/Ling-mini-base-2.0
-            res = "bailingmoe2"
-        if chkhsh == "53e325976a6e142379c19b09afcae354f2f496f147afa8f9e189a33fe4e3024e":
-            # ref: https://huggingface.co/ibm-granite/granite-docling-258M
-            res = "granite-docling"
-        if chkhsh == "f4f37b6c8eb9ea29b3eac6bb8c8487c5ab7885f8d8022e67edc1c68ce8403e95":
-            # ref: https://huggingface.co/MiniMaxAI/MiniMax-M2
-            res = "minimax-m2"
+        res = self.vocab_base_pre.get(chkhsh)
 
         if res is None:
             logger.warning("\n")
@@ -1274,32 +1559,27 @@ class TextModel(ModelBase):
             "vocab_size",
         ], optional=True) or tokenizer.vocab_size()
 
-        tokens: list[bytes] = [f"[PAD{i}]".encode("utf-8") for i in range(vocab_size)]
-        scores: list[float] = [-10000.0] * vocab_size
-        toktypes: list[int] = [SentencePieceTokenTypes.UNUSED] * vocab_size
-
-        for token_id in range(tokenizer.vocab_size()):
-            if token_id >= vocab_size:
-                logger.warning(f'ignore tokens from {token_id}: id is out of range, max={vocab_size - 1}')
-                break
-
-            piece = tokenizer.IdToPiece(token_id)
-            text = piece.encode("utf-8")
-            score = tokenizer.GetScore(token_id)
-
-            toktype = SentencePieceTokenTypes.NORMAL
-            if tokenizer.IsUnknown(token_id):
-                toktype = SentencePieceTokenTypes.UNKNOWN
-            elif tokenizer.IsControl(token_id):
-                toktype = SentencePieceTokenTypes.CONTROL
-            elif tokenizer.IsUnused(token_id):
-                toktype = SentencePieceTokenTypes.UNUSED
-            elif tokenizer.IsByte(token_id):
-                toktype = SentencePieceTokenTypes.BYTE
-
-            tokens[token_id] = text
-            scores[token_id] = score
-            toktypes[token_id] = toktype
+        n_tokens = tokenizer.vocab_size()
+        if n_tokens > vocab_size:
+            logger.warning(f'ignore tokens from {vocab_size}: id is out of range, max={vocab_size - 1}')
+            n_tokens = vocab_size
+
+        # query the whole vocab at once, calling the tokenizer for each token is slow for big vocabs
+        ids = list(range(n_tokens))
+        tokens: list[bytes] = [piece.encode("utf-8") for piece in tokenizer.IdToPiece(ids)]
+        tokens += [f"[PAD{i}]".encode("utf-8") for i in range(n_tokens, vocab_size)]
+        scores = np.full(vocab_size, -10000.0, dtype=np.float32)
+        scores[:n_tokens] = tokenizer.GetScore(ids)
+        toktypes = np.full(vocab_size, SentencePieceTokenTypes.UNUSED, dtype=np.int32)
+        toktypes[:n_tokens] = SentencePieceTokenTypes.NORMAL
+        # in reverse order of precedence, so that the first matching type wins
+        for toktype, is_type in (
+            (SentencePieceTokenTypes.BYTE, tokenizer.IsByte),
+            (SentencePieceTokenTypes.UNUSED, tokenizer.IsUnused),
+            (SentencePieceTokenTypes.CONTROL, tokenizer.IsControl),
+            (SentencePieceTokenTypes.UNKNOWN, tokenizer.IsUnknown),
+        ):
+            toktypes[:n_tokens][np.array(is_type(ids), dtype=bool)] = toktype
 
         added_tokens_file = self.dir_model / 'added_tokens.json'
         if added_tokens_file.is_file():
@@ -1341,12 +1621,11 @@ class TextModel(ModelBase):
         if vocab_size > len(tokens):
             pad_count = vocab_size - len(tokens)
             logger.debug(f"Padding vocab with {pad_count} token(s) - [PAD1] through [PAD{pad_count}]")
-            for i in range(1, pad_count + 1):
-                tokens.append(bytes(f"[PAD{i}]", encoding="utf-8"))
-                scores.append(-1000.0)
-                toktypes.append(SentencePieceTokenTypes.UNUSED)
+            tokens += [bytes(f"[PAD{i}]", encoding="utf-8") for i in range(1, pad_count + 1)]
+            scores = np.concatenate([scores, np.full(pad_count, -1000.0, dtype=np.float32)])
+            toktypes = np.concatenate([toktypes, np.full(pad_count, SentencePieceTokenTypes.UNUSED, dtype=np.int32)])
 
-        return tokens, scores, toktypes
+        return PackedTokens(tokens), scores, toktypes
 
     def _set_vocab_llama_hf(self):
         vocab = gguf.LlamaHfVocab(self.dir_model)
@@ -1370,30 +1649,47 @@ class TextModel(ModelBase):
         special_vocab = gguf.SpecialVocab(self.dir_model, n_vocab=len(tokens))
         special_vocab.add_to_gguf(self.gguf_writer)
 
+    @staticmethod
+    def parse_rwkv_world_vocab(path: Path, vocab_size: int) -> tuple[PackedTokens, np.ndarray]:
+        # each line is "<id> <python str or bytes literal> <length in bytes>", e.g. "257 b'\xe0' 1"
+        # the literals are decoded directly (the escapes are the same as the ones of python),
+        # since ast.literal_eval is slow for a whole vocab
+        tokens: list[bytes] = [b""] * vocab_size
+        toktypes = np.full(vocab_size, gguf.TokenType.UNUSED, dtype=np.int32)
+        tokens[0] = '<s>'.encode("utf-8")
+        toktypes[0] = gguf.TokenType.CONTROL
+
+        n_tokens = 1
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                _, literal_and_len = line.split(' ', 1)
+                literal, token_len = literal_and_len.rsplit(' ', 1)
+                is_bytes = literal[0] == 'b'
+                quote = literal[1] if is_bytes else literal[0]
+                assert quote in "'\"" and literal[-1] == quote and len(literal) >= 2 + is_bytes
+                body = literal[1 + is_bytes:-1]
+                if is_bytes:
+                    token = codecs.escape_decode(body)[0] if '\\' in body else body.encode("latin-1")
+                else:
+                    if '\\' in body:
+                        # characters which are not escaped are kept as is
+                        body = body.encode("latin-1", "backslashreplace").decode("unicode_escape")
+                    token = body.encode("utf-8")
+                assert len(token) == int(token_len)
+                assert n_tokens < vocab_size
+                tokens[n_tokens] = repr(token)[2:-1].encode("utf-8")  # "b'\xff'" -> "\xff"
+                toktypes[n_tokens] = gguf.TokenType.NORMAL
+                n_tokens += 1
+
+        for i in range(n_tokens, vocab_size):
+            tokens[i] = f"[PAD{i}]".encode("utf-8")
+        return PackedTokens(tokens), toktypes
+
     def _set_vocab_rwkv_world(self):
         assert (self.dir_model / "rwkv_vocab_v20230424.txt").is_file()
         vocab_size = self.hparams.get("vocab_size", 65536)
 
-        tokens: list[bytes] = ['<s>'.encode("utf-8")]
-        toktypes: list[int] = [gguf.TokenType.CONTROL]
-
-        with open(self.dir_model / "rwkv_vocab_v20230424.txt", "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            for line in lines:
-                parts = line.split(' ')
-                assert len(parts) >= 3
-                token, token_len = ast.literal_eval(' '.join(parts[1:-1])), int(parts[-1])
-                token = token.encode("utf-8") if isinstance(token, str) else token
-                assert isinstance(token, bytes)
-                assert len(token) == token_len
-                token_text: str = repr(token)[2:-1]  # "b'\xff'" -> "\xff"
-                tokens.append(token_text.encode("utf-8"))
-                toktypes.append(gguf.TokenType.NORMAL)
-        remainder = vocab_size - len(tokens)
-        assert remainder >= 0
-        for i in range(len(tokens), vocab_size):
-            tokens.append(f"[PAD{i}]".encode("utf-8"))
-            toktypes.append(gguf.TokenType.UNUSED)
+        tokens, toktypes = self.parse_rwkv_world_vocab(self.dir_model / "rwkv_vocab_v20230424.txt", vocab_size)
 
         self.gguf_writer.add_tokenizer_model("rwkv")
         self.gguf_writer.add_token_list(tokens)
@@ -3384,20 +3680,51 @@ class QwenModel(TextModel):
 
     @staticmethod
     def bpe(mergeable_ranks: dict[bytes, int], token: bytes, max_rank: int | None = None) -> list[bytes]:
-        parts = [bytes([b]) for b in token]
-        while True:
-            min_idx = None
-            min_rank = None
-            for i, pair in enumerate(zip(parts[:-1], parts[1:])):
-                rank = mergeable_ranks.get(pair[0] + pair[1])
-                if rank is not None and (min_rank is None or rank < min_rank):
-                    min_idx = i
-                    min_rank = rank
-            if min_rank is None or (max_rank is not None and min_rank >= max_rank):
-                break
-            assert min_idx is not None
-            parts = parts[:min_idx] + [parts[min_idx] + parts[min_idx + 1]] + parts[min_idx + 2:]
-        return parts
+        # merge the pair with the lowest rank until there is none left (below max_rank).
+        # the candidate pairs are kept in a heap, and the parts in a linked list,
+        # so only the pairs around a merge are looked up again instead of all of them.
+        # pairs are identified by the index of their left part, so that ties go to the leftmost pair.
+        get_rank = mergeable_ranks.get
+        if max_rank is None:
+            max_rank = sys.maxsize
+        if len(token) == 2:
+            # common case with a single pair
+            rank = get_rank(token)
+            return [token] if rank is not None and rank < max_rank else [token[:1], token[1:]]
+
+        parts: list[bytes | None] = [bytes([b]) for b in token]
+        n = len(parts)
+        next_part = list(range(1, n + 1))
+        prev_part = list(range(-1, n - 1))
+
+        heap: list[tuple[int, int]] = []
+        for i in range(n - 1):
+            rank = get_rank(parts[i] + parts[i + 1])  # type: ignore
+            if rank is not None and rank < max_rank:
+                heap.append((rank, i))
+        heapq.heapify(heap)
+
+        while heap:
+            rank, i = heapq.heappop(heap)
+            j = next_part[i]
+            left = parts[i]
+            # skip the pairs which were changed by a merge since they were pushed
+            if left is None or j >= n or get_rank(left + parts[j]) != rank:  # type: ignore
+                continue
+            parts[i] = left = left + parts[j]  # type: ignore
+            parts[j] = None
+            k = next_part[i] = next_part[j]
+            if k < n:
+                prev_part[k] = i
+                rank = get_rank(left + parts[k])  # type: ignore
+                if rank is not None and rank < max_rank:
+                    heapq.heappush(heap, (rank, i))
+            if (h := prev_part[i]) >= 0:
+                rank = get_rank(parts[h] + left)  # type: ignore
+                if rank is not None and rank < max_rank:
+                    heapq.heappush(heap, (rank, h))
+
+        return [part for part in parts if part is not None]
 
     def set_vocab(self):
         self._set_vocab_qwen()
@@ -9500,64 +9827,71 @@ class GptOssModel(TextModel):
             return
         return super().dequant_model()
 
-    def transform_nibble_layout(self, tensor):
-        assert tensor.dtype == torch.uint8
-        assert tensor.shape[-1] == 16
-        # swap nibbles
-        t_lo = tensor & 0x0F
-        t_hi = tensor & 0xF0
-        t_swapped = (t_lo << 4) | (t_hi >> 4)
-        tensor = t_swapped
-        # transform aaaa...bbbb... to abababab...
-        blk_a, blk_b = tensor.chunk(2, dim=-1)
-        # get a_
-        blk_a0 = (blk_a & 0xF0).view(-1, 1)
-        blk_a1 = (blk_a << 4).view(-1, 1)
-        blk_a = torch.stack((blk_a0, blk_a1), dim=2).view(tensor.shape)
-        # get _b
-        blk_b0 = (blk_b >> 4).view(-1, 1)
-        blk_b1 = (blk_b & 0x0F).view(-1, 1)
-        blk_b = torch.stack((blk_b0, blk_b1), dim=2).view(tensor.shape)
-        # swap once more
-        out = blk_a | blk_b
-        out_h = out & 0xF0
-        out_l = out & 0x0F
-        out = (out_h >> 4) | (out_l << 4)
-        return out
+    @staticmethod
+    @functools.cache
+    def mxfp4_pair_lut() -> np.ndarray:
+        # the nibbles of a byte spread over a pair of bytes: the low nibble in the first byte, the high nibble in the second one
+        x = np.arange(256, dtype=np.uint16)
+        spread = (x & 0x0F) | ((x >> 4) << 8)
+        # indexed by (a << 8) | b for the bytes a and b at positions k and k + 8 of a block,
+        # the little-endian value of the bytes 2k and 2k + 1 of the repacked block
+        return (spread[:, None] | (spread[None, :] << 4)).astype("<u2").ravel()
+
+    @staticmethod
+    def repack_mxfp4_blocks(blocks: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        # ggml MXFP4 blocks are the scale followed by 16 bytes, where the bytes 2k and 2k + 1
+        # hold the low and the high nibbles of the bytes k and k + 8 of the source block
+        n_expert, n_row, n_block, _ = blocks.shape
+        out = np.empty((n_expert, n_row, n_block, 17), dtype=np.uint8)
+        out[..., 0] = scales
+        pairs = out[..., 1:].view("<u2")
+        lut = GptOssModel.mxfp4_pair_lut()
+        # one expert at a time, so that the temporary indices stay small
+        for i in range(n_expert):
+            idx = blocks[i, ..., :8].astype(np.uint16) << 8
+            idx |= blocks[i, ..., 8:]
+            np.take(lut, idx, out=pairs[i])
+        return out.reshape(n_expert, n_row, n_block * 17)
 
     def repack_mxfp4(self, new_name: str, blocks: Tensor, scales: Tensor):
         assert blocks.dtype == torch.uint8
         assert scales.dtype == torch.uint8
-        scales = scales.unsqueeze(-1)
         assert len(blocks.shape) == 4
-        assert len(scales.shape) == 4
-        blocks = self.transform_nibble_layout(blocks)
-        new_data = torch.concat((scales, blocks), dim=-1)
-        new_shape = [new_data.shape[0], new_data.shape[1], new_data.shape[2] * 32]
+        assert len(scales.shape) == 3
+        assert blocks.shape[-1] == 16
+        new_shape = [blocks.shape[0], blocks.shape[1], blocks.shape[2] * 32]
         logger.info(f"Repacked {new_name} with shape {new_shape} and quantization MXFP4")
-        # flatten last dim
-        new_data = new_data.view(new_data.shape[0], new_data.shape[1], new_data.shape[2] * new_data.shape[3])
-        new_data = new_data.numpy()
+        blocks_np, scales_np = blocks.numpy(), scales.numpy()
+        if isinstance(blocks_np, gguf.LazyNumpyTensor):
+            repack = gguf.LazyNumpyTensor._wrap_fn(GptOssModel.repack_mxfp4_blocks, meta_noop=(np.uint8, lambda s: (s[0], s[1], s[2] * 17)))
+            new_data = repack(blocks_np, scales_np)
+        else:
+            new_data = GptOssModel.repack_mxfp4_blocks(blocks_np, scales_np)
         self.gguf_writer.add_tensor(new_name, new_data, raw_dtype=gguf.GGMLQuantizationType.MXFP4)
 
     def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
-        blocks0: Tensor = torch.zeros(1)
-        blocks1: Tensor = torch.zeros(1)
-        # we assume that tensors are loaded in the correct order
-        for name, data_torch in self.get_tensors():
-            if "mlp.experts.down_proj_blocks" in name:
-                blocks0 = data_torch
-            elif "mlp.experts.down_proj_scales" in name:
-                new_name = self.map_tensor_name(name.replace("_scales", ".weight"))
-                self.repack_mxfp4(new_name, blocks0, data_torch)
-            elif "mlp.experts.gate_up_proj_blocks" in name:
-                blocks0, blocks1 = data_torch[:, ::2, :, :], data_torch[:, 1::2, :, :]
-            elif "mlp.experts.gate_up_proj_scales" in name:
-                scales0, scales1 = data_torch[:, ::2, :], data_torch[:, 1::2, :]
-                new_name_gate = self.map_tensor_name(name.replace("gate_up_proj_scales", "gate_proj.weight"))
-                new_name_up = self.map_tensor_name(name.replace("gate_up_proj_scales", "up_proj.weight"))
-                self.repack_mxfp4(new_name_gate, blocks0, scales0)
-                self.repack_mxfp4(new_name_up, blocks1, scales1)
+        # repack the MXFP4 experts as soon as both their blocks and their scales are known, in whichever order they come.
+        # they are removed from the tensors left to convert, so that each of them is only loaded once
+        pending: dict[str, str] = {}
+        for name in list(self.model_tensors.keys()):
+            if "mlp.experts." not in name or not name.endswith(("_blocks", "_scales")):
+                continue
+            prefix = name.rsplit("_", 1)[0]
+            if pending.setdefault(prefix, name) == name:
+                continue
+            del pending[prefix]
+            blocks = self.model_tensors.pop(prefix + "_blocks")()
+            scales = self.model_tensors.pop(prefix + "_scales")()
+            if prefix.endswith(".down_proj"):
+                self.repack_mxfp4(self.map_tensor_name(prefix + ".weight"), blocks, scales)
+            elif prefix.endswith(".gate_up_proj"):
+                blocks0, blocks1 = blocks[:, ::2, :, :], blocks[:, 1::2, :, :]
+                scales0, scales1 = scales[:, ::2, :], scales[:, 1::2, :]
+                prefix = prefix.removesuffix("gate_up_proj")
+                self.repack_mxfp4(self.map_tensor_name(prefix + "gate_proj.weight"), blocks0, scales0)
+                self.repack_mxfp4(self.map_tensor_name(prefix + "up_proj.weight"), blocks1, scales1)
+        for name in pending.values():
+            logger.warning(f"{name} has no matching {'scales' if name.endswith('_blocks') else 'blocks'}, it is ignored")
         return []
 
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
@@ -10294,22 +10628,39 @@ class JanusProVisionModel(MmprojModel):
 ###### CONVERSION LOGIC ######
 
 
+_T = TypeVar("_T")
+
+
+class _LazyTorchAttr(Generic[_T]):
+    # class attribute built from torch on first access, which keeps `import torch` lazy
+    def __init__(self, build: Callable[[], _T]):
+        self.build = build
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, instance: Any, owner: type) -> _T:
+        value = self.build()
+        setattr(owner, self.name, value)
+        return value
+
+
 # tree of lazy tensors
 class LazyTorchTensor(gguf.LazyBase):
-    _tensor_type = torch.Tensor
+    _tensor_type = _LazyTorchAttr(lambda: torch.Tensor)
     # to keep the type-checker happy
     dtype: torch.dtype
     shape: torch.Size
 
     # only used when converting a torch.Tensor to a np.ndarray
-    _dtype_map: dict[torch.dtype, type] = {
+    _dtype_map = _LazyTorchAttr(lambda: {
         torch.float16: np.float16,
         torch.float32: np.float32,
         torch.uint8: np.uint8,
-    }
+    })
 
     # only used when byteswapping data. Only correct size is needed
-    _dtype_byteswap_map: dict[torch.dtype, type] = {
+    _dtype_byteswap_map = _LazyTorchAttr(lambda: {
         torch.float64: np.float64,
         torch.float32: np.float32,
         torch.bfloat16: np.float16,
@@ -10325,12 +10676,12 @@ class LazyTorchTensor(gguf.LazyBase):
         torch.bool: np.uint8,
         torch.float8_e4m3fn: np.uint8,
         torch.float8_e5m2: np.uint8,
-    }
+    })
 
     # used for safetensors slices
     # ref: https://github.com/huggingface/safetensors/blob/079781fd0dc455ba0fe851e2b4507c33d0c0d407/bindings/python/src/lib.rs#L1046
     # TODO: uncomment U64, U32, and U16, ref: https://github.com/pytorch/pytorch/issues/58734
-    _dtype_str_map: dict[str, torch.dtype] = {
+    _dtype_str_map = _LazyTorchAttr(lambda: {
         "F64": torch.float64,
         "F32": torch.float32,
         "BF16": torch.bfloat16,
@@ -10346,7 +10697,7 @@ class LazyTorchTensor(gguf.LazyBase):
         "BOOL": torch.bool,
         "F8_E4M3": torch.float8_e4m3fn,
         "F8_E5M2": torch.float8_e5m2,
-    }
+    })
 
     def numpy(self) -> gguf.LazyNumpyTensor:
         dtype = self._dtype_map[self.dtype]
@@ -10367,24 +10718,39 @@ class LazyTorchTensor(gguf.LazyBase):
         lazy = cls(meta=cls.meta_with_dtype_and_shape(dtype, shape), args=(st_slice,), func=lambda s: s[...] if len(s.get_shape()) == 0 else s[:])
         return cast(torch.Tensor, lazy)
 
+    @classmethod
+    def load_local_tensor(cls, tensor: gguf.utility.LocalTensor, *, read: bool = False) -> Tensor:
+        def byteswap_tensor(tensor: np.ndarray, dtype: type) -> np.ndarray:
+            if sys.byteorder == 'big':
+                # switch data back to big endian
+                tensor = tensor.view(dtype).byteswap(inplace=False)
+            return tensor
+        dtype = cls._dtype_str_map[tensor.dtype]
+        numpy_dtype = cls._dtype_byteswap_map[dtype]
+        if read:
+            # read the bytes right away instead of faulting them in from the mmap on first use
+            data_range = tensor.data_range
+            data = np.fromfile(data_range.filename, dtype=np.uint8, count=data_range.size, offset=data_range.offset)
+        else:
+            data = tensor.mmap_bytes()
+        return torch.from_numpy(byteswap_tensor(data, numpy_dtype)).view(dtype).reshape(tensor.shape)
+
+    @staticmethod
+    def local_source(tensor: Any) -> gguf.utility.LocalTensor | None:
+        # the tensor of a local safetensors file from which a lazy tensor was loaded without any transformation
+        if isinstance(tensor, LazyTorchTensor) and len(tensor._args) == 1 and isinstance(tensor._args[0], gguf.utility.LocalTensor):
+            return tensor._args[0]
+        return None
+
     @classmethod
     def from_local_tensor(cls, t: gguf.utility.LocalTensor) -> Tensor:
-        def load_tensor(tensor: gguf.utility.LocalTensor) -> Tensor:
-            def byteswap_tensor(tensor: np.ndarray, dtype: type) -> np.ndarray:
-                if sys.byteorder == 'big':
-                    # switch data back to big endian
-                    tensor = tensor.view(dtype).byteswap(inplace=False)
-                return tensor
-            dtype = cls._dtype_str_map[tensor.dtype]
-            numpy_dtype = cls._dtype_byteswap_map[dtype]
-            return torch.from_numpy(byteswap_tensor(tensor.mmap_bytes(), numpy_dtype)).view(dtype).reshape(tensor.shape)
         dtype = cls._dtype_str_map[t.dtype]
         shape = t.shape
-        lazy = cls(meta=cls.meta_with_dtype_and_shape(dtype, shape), args=(t,), func=lambda r: load_tensor(r))
+        lazy = cls(meta=cls.meta_with_dtype_and_shape(dtype, shape), args=(t,), func=lambda r: cls.load_local_tensor(r))
         return cast(torch.Tensor, lazy)
 
     @classmethod
-    def from_remote_tensor(cls, remote_tensor: gguf.utility.RemoteTensor):
+    def from_remote_tensor(cls, remote_tensor: gguf.utility.RemoteTensor, fetcher: RemoteFetcher | None = None):
         def byteswap_tensor(tensor: np.ndarray, dtype: type) -> np.ndarray:
             if sys.byteorder == 'big':
                 # switch data back to big endian
@@ -10394,7 +10760,13 @@ class LazyTorchTensor(gguf.LazyBase):
         numpy_dtype = cls._dtype_byteswap_map[dtype]
         shape = remote_tensor.shape
         meta = cls.meta_with_dtype_and_shape(dtype, shape)
-        lazy = cls(meta=meta, args=(remote_tensor,), func=lambda r: torch.from_numpy(byteswap_tensor(np.frombuffer(r.data(), dtype=numpy_dtype), numpy_dtype)).view(dtype).reshape(shape))
+
+        def load(r: gguf.utility.RemoteTensor) -> Tensor:
+            # NOTE: the buffer must be writable, otherwise PyTorch complains
+            data = fetcher.read(r) if fetcher is not None else np.frombuffer(r.data(), dtype=np.uint8)
+            return torch.from_numpy(byteswap_tensor(data.view(numpy_dtype), numpy_dtype)).view(dtype).reshape(shape)
+
+        lazy = cls(meta=meta, args=(remote_tensor,), func=load)
         return cast(torch.Tensor, lazy)
 
     @classmethod
@@ -10410,6 +10782,1515 @@ class LazyTorchTensor(gguf.LazyBase):
         return cls._wrap_fn(func)(*args, **kwargs)
 
 
+def get_peak_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, in KiB elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryBudget:
+    """
+    Accounts for the memory used by the tensors being converted.
+
+    acquire() blocks while admitting more bytes would go over the limit.
+    A request bigger than the whole limit is admitted once nothing else is live, so that progress is always possible.
+    """
+
+    limit: int
+    live: int
+    peak: int
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.live = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n_bytes: int, stop: threading.Event | None = None) -> bool:
+        with self._cond:
+            while self.limit > 0 and self.live > 0 and self.live + n_bytes > self.limit:
+                self._cond.wait(timeout=0.1)
+                if stop is not None and stop.is_set():
+                    return False
+            self.live += n_bytes
+            self.peak = max(self.peak, self.live)
+            return True
+
+    def release(self, n_bytes: int):
+        with self._cond:
+            self.live -= n_bytes
+            self._cond.notify_all()
+
+
+class ConversionProfiler:
+    """
+    Records where the time of a conversion goes (see --profile).
+
+    Spans of work are recorded with their stage (e.g. read, modify, cast, quantize, write),
+    the tensor they are for, the thread which ran them and the number of bytes they read or wrote.
+    The spans without a tensor are the phases of the conversion, which contain the others.
+
+    Lazy tensors are only computed when they are written, so each operation of their graph
+    is timed then (see instrument), without the time of its inputs.
+    Without lazy tensors, the operations are timed as they are done by prepare_tensors.
+    """
+
+    # (stage, tensor, thread, start, end, bytes)
+    events: list[tuple[str, str | None, int, float, float, int]]
+    read_stages = ("read", "copy")
+    write_stages = ("write", "copy")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        self.events = []
+        self.threads: dict[int, str] = {}
+
+    def add(self, stage: str, tensor: str | None, start: float, end: float, n_bytes: int = 0):
+        thread = threading.get_ident()
+        if thread not in self.threads:
+            self.threads[thread] = threading.current_thread().name
+        self.events.append((stage, tensor, thread, start, end, n_bytes))
+
+    @contextlib.contextmanager
+    def span(self, stage: str, tensor: str | None = None, n_bytes: int = 0) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, tensor, start, time.perf_counter(), n_bytes)
+
+    @staticmethod
+    def mark(tensor: Any, stage: str):
+        # the stage of the operation which computes a lazy tensor, when it's not obvious from the graph
+        if isinstance(tensor, gguf.LazyBase) and tensor._data is None:
+            tensor.__dict__["_profile_stage"] = stage
+
+    def instrument(self, name: str, tensor: Any):
+        # time the not yet computed operations of the graph of a lazy tensor
+        seen: set[int] = set()
+        stack: list[Any] = [tensor]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, (list, tuple)):
+                stack.extend(t)
+                continue
+            if not isinstance(t, gguf.LazyBase) or t._data is not None or id(t) in seen or "_profiled" in t.__dict__:
+                continue
+            seen.add(id(t))
+            n_bytes = 0
+            if (stage := t.__dict__.get("_profile_stage")) is None:
+                if len(t._args) == 1 and isinstance(t._args[0], gguf.utility.LocalTensor):
+                    stage, n_bytes = "read", t._args[0].data_range.size
+                elif len(t._args) == 1 and isinstance(t._args[0], gguf.utility.RemoteTensor):
+                    stage, n_bytes = "read", t._args[0].size
+                elif hasattr(t._func, "quantized"):
+                    stage = "dequant"
+                else:
+                    stage = "modify"
+            t.__dict__["_profiled"] = True
+            t._func = self._timed(t._func, stage, name, n_bytes)
+            stack.extend(t._args)
+            stack.extend(t._kwargs.values())
+
+    def reads(self, tensors: Iterable[tuple[str, Any]]) -> Iterator[tuple[str, Any]]:
+        # time the loading of tensors which aren't lazy
+        it = iter(tensors)
+        while True:
+            start = time.perf_counter()
+            if (item := next(it, None)) is None:
+                return
+            self.add("read", item[0], start, time.perf_counter(), item[1].nbytes)
+            yield item
+
+    def _timed(self, func: Callable[..., Any], stage: str, tensor: str, n_bytes: int) -> Callable[..., Any]:
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, tensor, start, time.perf_counter(), n_bytes)
+        return timed
+
+    def summary(self) -> dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        phases: dict[str, float] = {}
+        stages: dict[str, dict[str, float]] = {}
+        tensors: dict[str, dict[str, float]] = {}
+        for stage, tensor, _, start, stop, n_bytes in self.events:
+            if tensor is None:
+                phases[stage] = phases.get(stage, 0.0) + stop - start
+                continue
+            s = stages.setdefault(stage, {"calls": 0, "seconds": 0.0, "bytes": 0})
+            s["calls"] += 1
+            s["seconds"] += stop - start
+            s["bytes"] += n_bytes
+            t = tensors.setdefault(tensor, {})
+            t[stage] = t.get(stage, 0.0) + stop - start
+        return {
+            "wall_seconds": end - self.start,
+            "peak_rss": get_peak_rss(),
+            "bytes_read": sum(s["bytes"] for k, s in stages.items() if k in self.read_stages),
+            "bytes_written": sum(s["bytes"] for k, s in stages.items() if k in self.write_stages),
+            "phases": phases,
+            "stages": stages,
+            "tensors": tensors,
+        }
+
+    def log_summary(self, n_tensors: int = 10):
+        fmt = gguf.GGUFWriter.format_n_bytes_to_str
+        summary = self.summary()
+        wall = summary["wall_seconds"]
+        peak_rss = fmt(summary["peak_rss"]) if summary["peak_rss"] is not None else "unknown"
+        lines = [f"Profile: {wall:.2f}s, {fmt(summary['bytes_read'])} read, {fmt(summary['bytes_written'])} written, {peak_rss} peak RSS"]
+        lines.append(f"  {'phase':<12} {'time':>9} {'share':>6}")
+        for phase, seconds in summary["phases"].items():
+            lines.append(f"  {phase:<12} {seconds:>8.3f}s {100 * seconds / wall:>5.1f}%")
+        # the stages run concurrently with --threads, their time is summed over the threads
+        lines.append(f"  {'stage':<12} {'time':>9} {'calls':>6} {'bytes':>8} {'rate':>10}")
+        for stage, s in sorted(summary["stages"].items(), key=lambda kv: -kv[1]["seconds"]):
+            n_bytes = fmt(s["bytes"]) if s["bytes"] else "-"
+            rate = f"{fmt(s['bytes'] / s['seconds'])}/s" if s["bytes"] and s["seconds"] > 0 else "-"
+            lines.append(f"  {stage:<12} {s['seconds']:>8.3f}s {s['calls']:>6} {n_bytes:>8} {rate:>10}")
+        slowest = sorted(summary["tensors"].items(), key=lambda kv: -sum(kv[1].values()))[:n_tensors]
+        if slowest:
+            lines.append("  slowest tensors:")
+            for tensor, times in slowest:
+                detail = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in sorted(times.items(), key=lambda kv: -kv[1]))
+                lines.append(f"    {tensor}: {sum(times.values()):.3f}s ({detail})")
+        logger.info("\n".join(lines))
+
+    def write_trace(self, path: Path):
+        # in the Chrome trace event format, see chrome://tracing or https://ui.perfetto.dev
+        pid = os.getpid()
+        tids = {thread: i for i, thread in enumerate(self.threads)}
+        events: list[dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tids[thread], "args": {"name": name}}
+            for thread, name in self.threads.items()
+        ]
+        for stage, tensor, thread, start, stop, n_bytes in sorted(self.events, key=lambda e: e[3]):
+            event: dict[str, Any] = {
+                "name": stage if tensor is None else f"{stage} {tensor}",
+                "cat": "phase" if tensor is None else stage,
+                "ph": "X", "pid": pid, "tid": tids[thread],
+                "ts": round((start - self.start) * 1e6, 3), "dur": round((stop - start) * 1e6, 3),
+            }
+            if tensor is not None:
+                event["args"] = {"tensor": tensor, "bytes": n_bytes}
+            events.append(event)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.summary()}, f)
+        logger.info(f"Profile trace written to {path}")
+
+
+class ReadScheduler:
+    """
+    Schedules the reads of the model files for the tensors being converted.
+
+    The tensors are ordered by where their source data is in the model files (by file, then by offset),
+    which turns the reads into a sequential scan of each file instead of jumping between files and offsets.
+    The kernel is asked to read ahead the sources of the next tensors (POSIX_FADV_WILLNEED),
+    and to drop the pages of a source once all the tensors reading it are done (POSIX_FADV_DONTNEED),
+    so that the page cache doesn't grow to the size of the model.
+    The advice works for both the reads and the memory maps of the files; it's skipped where it isn't supported.
+    """
+
+    order: list[str]
+    read_ahead: int
+
+    def __init__(self, sources: dict[str, list[gguf.utility.LocalTensorRange]], read_ahead: int = 256 * 1024 * 1024):
+        self.read_ahead = read_ahead
+        self._sources = {name: [(str(r.filename), r.offset, r.size) for r in ranges] for name, ranges in sources.items()}
+        # the tensors without any local source (e.g. remote tensors) go last
+        self.order = sorted(self._sources, key=lambda name: (0, *min(self._sources[name])) if self._sources[name] else (1,))
+        self._users = collections.Counter(r for ranges in self._sources.values() for r in ranges)
+        # bytes of sources of the tensors before each position in the order
+        self._ends = [0, *accumulate(sum(size for _, _, size in self._sources[name]) for name in self.order)]
+        self._rank = {name: i for i, name in enumerate(self.order)}
+        self._advised = 0
+        self._fds: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sources(tensor: Any) -> list[gguf.utility.LocalTensorRange]:
+        # the ranges of the local safetensors files from which a lazy tensor is computed
+        ranges: list[gguf.utility.LocalTensorRange] = []
+        seen: set[int] = set()
+        stack: list[Any] = [tensor]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, (list, tuple)):
+                stack.extend(t)
+                continue
+            if not isinstance(t, gguf.LazyBase) or t._data is not None or id(t) in seen:
+                continue
+            seen.add(id(t))
+            if len(t._args) == 1 and isinstance(t._args[0], gguf.utility.LocalTensor):
+                ranges.append(t._args[0].data_range)
+            else:
+                stack.extend(t._args)
+                stack.extend(t._kwargs.values())
+        return ranges
+
+    def _advise(self, filename: str, offset: int, size: int, advice: int):
+        if not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            if (fd := self._fds.get(filename)) is None:
+                fd = self._fds[filename] = os.open(filename, os.O_RDONLY)
+            os.posix_fadvise(fd, offset, size, advice)
+        except OSError as e:
+            logger.debug(f"Can't advise the kernel about {filename}: {e}")
+
+    def start(self, name: str):
+        # the tensor is about to be read: read ahead the sources of the next tensors, up to read_ahead bytes past it
+        with self._lock:
+            if (rank := self._rank.get(name)) is None:
+                return
+            while self._advised < len(self.order) and (self._advised <= rank or self._ends[self._advised] - self._ends[rank + 1] < self.read_ahead):
+                for r in self._sources[self.order[self._advised]]:
+                    self._advise(*r, getattr(os, "POSIX_FADV_WILLNEED", 0))
+                self._advised += 1
+
+    def done(self, name: str):
+        # the tensor was computed, its sources aren't needed anymore unless other tensors also read them
+        with self._lock:
+            for r in self._sources.get(name, ()):
+                self._users[r] -= 1
+                if self._users[r] <= 0:
+                    self._advise(*r, getattr(os, "POSIX_FADV_DONTNEED", 0))
+
+    def drop(self, filename: Path | str, offset: int, size: int):
+        # a range which was read outside of the scheduled tensors (e.g. copied as is)
+        with self._lock:
+            if self._users[(str(filename), offset, size)] <= 0:
+                self._advise(str(filename), offset, size, getattr(os, "POSIX_FADV_DONTNEED", 0))
+
+    def close(self):
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+
+def copy_file_range(src_fd: int, dst_fd: int, count: int, src_offset: int, dst_offset: int):
+    # let the kernel copy (or reflink) the data when possible
+    if hasattr(os, "copy_file_range"):
+        try:
+            while count > 0:
+                n = os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+                if n == 0:
+                    break
+                count -= n
+                src_offset += n
+                dst_offset += n
+        except OSError:
+            # e.g. not supported across these file systems
+            pass
+    while count > 0:
+        data = os.pread(src_fd, min(count, 64 * 1024 * 1024), src_offset)
+        if len(data) == 0:
+            raise EOFError(f"Unexpected end of file when copying {count} more bytes")
+        n = os.pwrite(dst_fd, data, dst_offset)
+        count -= n
+        src_offset += n
+        dst_offset += n
+
+
+class SafetensorsIndex:
+    """
+    Sidecar file next to a model caching the parsed headers of its safetensors parts
+    (the names, dtypes, shapes and offsets of their tensors), so that later conversions don't have to read them.
+
+    A part is identified by its size and modification time, the header of a part which changed is parsed again.
+    The cache is only an optimization: it's ignored when it can't be read, and not updated when it can't be written.
+    """
+
+    name = ".gguf-tensor-index.json"
+    version = 1
+
+    dir_model: Path
+    path: Path
+
+    def __init__(self, dir_model: Path):
+        self.dir_model = dir_model
+        self.path = dir_model / self.name
+        self._lock = threading.Lock()
+        self._parts: dict[str, dict[str, Any]] = {}
+        self._used: set[str] = set()
+        self._dirty = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index["version"] == self.version:
+                self._parts = index["parts"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def tensors(self, part_name: str) -> dict[str, gguf.utility.LocalTensor]:
+        filename = self.dir_model / part_name
+        st = os.stat(filename)
+        with self._lock:
+            self._used.add(part_name)
+            part = self._parts.get(part_name)
+        if part is not None and part.get("size") == st.st_size and part.get("mtime_ns") == st.st_mtime_ns:
+            try:
+                return {
+                    name: gguf.utility.LocalTensor(dtype, tuple(shape), gguf.utility.LocalTensorRange(filename, offset, size))
+                    for name, (dtype, shape, offset, size) in part["tensors"].items()
+                }
+            except (KeyError, TypeError, ValueError):
+                logger.debug(f"Ignoring the invalid entry of {part_name!r} in {self.path}")
+
+        with gguf.utility.SafetensorsLocal(filename) as tensors:
+            part = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "tensors": {name: [t.dtype, list(t.shape), t.data_range.offset, t.data_range.size] for name, t in tensors.items()},
+            }
+        with self._lock:
+            self._parts[part_name] = part
+            self._dirty = True
+        return tensors
+
+    def save(self):
+        # only keep the parts of the current model
+        if not self._dirty and self._used == self._parts.keys():
+            return
+        parts = {part_name: self._parts[part_name] for part_name in sorted(self._used)}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": self.version, "parts": parts}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.debug(f"Can't write the tensor index {self.path}: {e}")
+            with contextlib.suppress(OSError):
+                tmp_path.unlink()
+
+
+class RemoteFetcher:
+    """
+    Fetches the data of remote safetensors files (see --remote) with concurrent HTTP range requests.
+
+    The tensors of each file are coalesced into ranges of up to range_size bytes, including the small gaps between them,
+    and the ranges are fetched by a pool of threads sharing a pool of connections. When a tensor is read,
+    the ranges which follow it in the files are fetched ahead, up to read_ahead bytes.
+    Failed and truncated requests are retried with an exponential backoff, from where they stopped.
+
+    The fetched bytes are spilled to sparse files at their offsets in a local directory instead of being kept in memory.
+    With a persistent cache_dir, the fetched ranges are reused by later conversions,
+    as long as the remote file still has the same ETag and size.
+    """
+
+    range_size: int = 64 * 1024 * 1024
+    # tensors separated by at most this many bytes are fetched in the same range
+    max_gap: int = 1024 * 1024
+    retries: int = 5
+    # seconds before the first retry, doubled for each following one
+    backoff: float = 0.5
+    timeout: float = 60.0
+
+    class _File:
+        url: str
+        path: Path
+        lock: threading.Lock
+        opened: bool
+        fd: int
+        source_url: str
+        etag: str | None
+        size: int
+        fetched: set[tuple[int, int]]
+
+        def __init__(self, url: str, path: Path):
+            self.url = url
+            self.path = path
+            self.lock = threading.Lock()
+            self.opened = False
+            self.fd = -1
+            self.source_url = url
+            self.etag = None
+            self.size = -1
+            self.fetched = set()
+
+    class _Range:
+        url: str
+        start: int
+        size: int
+        future: Future[None] | None
+
+        def __init__(self, url: str, start: int, size: int):
+            self.url = url
+            self.start = start
+            self.size = size
+            self.future = None
+
+    def __init__(self, n_connections: int = 8, cache_dir: Path | None = None, read_ahead: int | None = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.n_connections = max(n_connections, 1)
+        self.read_ahead = read_ahead if read_ahead is not None else 2 * self.n_connections * self.range_size
+        self.session = requests.Session()
+        self.session.headers.update(gguf.utility.SafetensorRemote._get_request_headers())
+        adapter = HTTPAdapter(pool_connections=self.n_connections, pool_maxsize=self.n_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.persistent = cache_dir is not None
+        self._tmp_dir = None
+        if cache_dir is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="convert-remote-")
+            cache_dir = Path(self._tmp_dir.name)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir = cache_dir
+        self._files: dict[str, RemoteFetcher._File] = {}
+        # all the ranges, ordered by file and offset
+        self._ranges: list[RemoteFetcher._Range] = []
+        self._tensor_ranges: dict[tuple[str, int, int], range] = {}
+        self._ends: list[int] = [0]
+        self._ahead = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=self.n_connections, thread_name_prefix="convert-fetch")
+        self.n_requests = 0
+        self.n_retries = 0
+        self.n_bytes = 0
+
+    def add(self, tensors: Iterable[gguf.utility.RemoteTensor]):
+        # plan the ranges covering these tensors
+        by_url: dict[str, list[gguf.utility.RemoteTensor]] = {}
+        for t in tensors:
+            by_url.setdefault(t.url, []).append(t)
+        with self._lock:
+            for url, url_tensors in by_url.items():
+                if url not in self._files:
+                    self._files[url] = RemoteFetcher._File(url, self.cache_dir / sha256(url.encode()).hexdigest()[:32])
+                url_tensors.sort(key=lambda t: t.offset_start)
+                # the spans of tensors close to each other, cut into ranges
+                spans: list[list[Any]] = []
+                for t in url_tensors:
+                    if spans and t.offset_start - spans[-1][1] <= self.max_gap:
+                        spans[-1][1] = max(spans[-1][1], t.offset_start + t.size)
+                        spans[-1][2].append(t)
+                    else:
+                        spans.append([t.offset_start, t.offset_start + t.size, [t]])
+                for span_start, span_end, span_tensors in spans:
+                    first = len(self._ranges)
+                    for start in range(span_start, span_end, self.range_size):
+                        size = min(self.range_size, span_end - start)
+                        self._ranges.append(RemoteFetcher._Range(url, start, size))
+                        self._ends.append(self._ends[-1] + size)
+                    for t in span_tensors:
+                        lo = first + (t.offset_start - span_start) // self.range_size
+                        hi = first + (t.offset_start + max(t.size, 1) - 1 - span_start) // self.range_size
+                        self._tensor_ranges[(url, t.offset_start, t.size)] = range(lo, hi + 1)
+
+    def _open(self, f: RemoteFetcher._File):
+        # resolve the redirections once, and check whether what was fetched before is still valid
+        with f.lock:
+            if f.opened:
+                return
+            response = self.session.head(f.url, allow_redirects=True, timeout=self.timeout)
+            response.raise_for_status()
+            f.source_url = response.url
+            f.etag = response.headers.get("ETag")
+            f.size = int(response.headers.get("Content-Length", -1))
+            index_path = f.path.with_suffix(".json")
+            try:
+                with open(index_path, "r", encoding="utf-8") as fp:
+                    index = json.load(fp)
+                if index["url"] == f.url and index["etag"] == f.etag and index["size"] == f.size:
+                    f.fetched = {(start, size) for start, size in index["ranges"]}
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+            flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+            if not f.fetched:
+                flags |= os.O_TRUNC
+            f.fd = os.open(f.path.with_suffix(".data"), flags, 0o644)
+            f.opened = True
+
+    def _fetch(self, r: RemoteFetcher._Range):
+        import requests
+
+        f = self._files[r.url]
+        received = 0
+        n_requests = n_retries = 0
+        for attempt in range(self.retries + 1):
+            if self._stop.is_set():
+                raise RuntimeError("The remote fetcher was closed")
+            received_before = received
+            try:
+                self._open(f)
+                if (r.start, r.size) in f.fetched:
+                    return
+                n_requests += 1
+                start = r.start + received
+                headers = {"Range": f"bytes={start}-{r.start + r.size - 1}"}
+                with self.session.get(f.source_url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 200:
+                        raise ValueError(f"{f.url} doesn't support range requests")
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        chunk = chunk[:r.size - received]
+                        view = memoryview(chunk)
+                        while len(view) > 0:
+                            n = os.pwrite(f.fd, view, r.start + received)
+                            view = view[n:]
+                            received += n
+                        if self._stop.is_set():
+                            raise RuntimeError("The remote fetcher was closed")
+                if received < r.size:
+                    raise requests.exceptions.ChunkedEncodingError(f"got {received} of {r.size} bytes")
+                break
+            except requests.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                # a redirection to a signed URL can expire, it's then followed again from the original URL
+                expired = status == 403 and f.source_url != f.url
+                if attempt == self.retries or not (status is None or status >= 500 or status in (408, 429) or expired):
+                    raise
+                if expired:
+                    f.source_url = f.url
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Fetching bytes {r.start + received}-{r.start + r.size - 1} of {f.url} failed ({e}), retrying in {delay:.1f}s")
+                n_retries += 1
+                self._stop.wait(delay)
+            finally:
+                with self._lock:
+                    self.n_requests += n_requests
+                    self.n_retries += n_retries
+                    self.n_bytes += received - received_before
+                n_requests = n_retries = 0
+
+        with f.lock:
+            if self.persistent:
+                os.fsync(f.fd)
+            f.fetched.add((r.start, r.size))
+            if self.persistent:
+                index_path = f.path.with_suffix(".json")
+                tmp_path = index_path.with_name(index_path.name + ".tmp")
+                with open(tmp_path, "w", encoding="utf-8") as fp:
+                    json.dump({"url": f.url, "etag": f.etag, "size": f.size, "ranges": sorted(f.fetched)}, fp)
+                os.replace(tmp_path, index_path)
+
+    def _schedule(self, i: int) -> Future[None]:
+        r = self._ranges[i]
+        if r.future is None:
+            r.future = self._pool.submit(self._fetch, r)
+        return r.future
+
+    def read(self, t: gguf.utility.RemoteTensor) -> np.ndarray:
+        # the bytes of a tensor, as a writable array
+        if t.size == 0:
+            return np.empty(0, dtype=np.uint8)
+        with self._lock:
+            ranges = self._tensor_ranges.get((t.url, t.offset_start, t.size))
+            if ranges is None:
+                return np.frombuffer(t.data(), dtype=np.uint8)
+            futures = [self._schedule(i) for i in ranges]
+            # fetch the following ranges ahead, they are likely needed soon
+            self._ahead = max(self._ahead, ranges.stop)
+            while self._ahead < len(self._ranges) and self._ends[self._ahead] - self._ends[ranges.stop] < self.read_ahead:
+                self._schedule(self._ahead)
+                self._ahead += 1
+        for future in futures:
+            future.result()
+        return np.fromfile(self._files[t.url].path.with_suffix(".data"), dtype=np.uint8, count=t.size, offset=t.offset_start)
+
+    def close(self):
+        self._stop.set()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for f in self._files.values():
+            if f.fd >= 0:
+                os.close(f.fd)
+                f.fd = -1
+        self.session.close()
+        if self.n_requests > 0:
+            logger.info(f"Fetched {gguf.GGUFWriter.format_n_bytes_to_str(self.n_bytes)} in {self.n_requests} requests ({self.n_retries} retries)")
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+
+    def __enter__(self) -> RemoteFetcher:
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+
+class TensorCache:
+    """
+    On-disk cache of converted tensors, shared between conversions.
+
+    A tensor is keyed by its sources (the identity of the safetensors files and where the tensor is in them),
+    the whole chain of transformations applied to it (including the code of the functions),
+    its name, its output type and the version of the code (of this script and of the gguf package),
+    since the functions called from the chain (e.g. the quantization in gguf) aren't part of it.
+    Tensors which can't be identified this way (e.g. big tensors already in memory, or remote tensors) are not cached.
+    The least recently used entries are evicted when the cache grows over its maximum size.
+
+    Small derived metadata (e.g. the vocab extracted from the tokenizer files) is also stored here, but is never evicted.
+    """
+
+    path: Path
+    max_size: int
+
+    class Uncacheable(Exception):
+        pass
+
+    # small tensors created in memory (e.g. constants) are hashed, bigger ones make the tensor uncacheable
+    max_eager_bytes = 1024 * 1024
+
+    def __init__(self, path: Path, max_size: int = 0):
+        self.path = path
+        self.max_size = max_size
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._file_ids: dict[Path, str] = {}
+        self.code_version = self._code_version()
+        self.size = sum(f.stat().st_size for f in self.path.glob("*/*.bin"))
+        self.hits = 0
+        self.misses = 0
+
+    def file_id(self, filename: Path) -> str:
+        if (file_id := self._file_ids.get(filename)) is None:
+            st = os.stat(filename)
+            with open(filename, "rb") as f:
+                header = f.read(8)
+                header += f.read(int.from_bytes(header, byteorder="little"))
+            file_id = sha256(f"{st.st_size}:{st.st_mtime_ns}:".encode() + header).hexdigest()
+            self._file_ids[filename] = file_id
+        return file_id
+
+    @staticmethod
+    def _code_version() -> str:
+        h = sha256(Path(__file__).read_bytes())
+        gguf_dir = Path(gguf.__file__).parent
+        for f in sorted(gguf_dir.rglob("*.py")):
+            h.update(f"{f.relative_to(gguf_dir)}:".encode())
+            h.update(f.read_bytes())
+        return h.hexdigest()
+
+    def _code_id(self, code: Any) -> str:
+        consts = ",".join(self._code_id(c) if hasattr(c, "co_code") else repr(c) for c in code.co_consts)
+        return sha256(code.co_code + repr((code.co_names, code.co_varnames)).encode() + consts.encode()).hexdigest()
+
+    def _id(self, o: Any, memo: dict[int, str]) -> str:
+        if (cached := memo.get(id(o))) is not None:
+            return cached
+        if isinstance(o, gguf.LazyBase):
+            if o._data is not None:
+                res = self._id(o._data, memo)
+            else:
+                res = "lazy(" + ",".join((self._id(o._func, memo), self._id(o._args, memo), self._id(o._kwargs, memo))) + ")"
+            # don't let long chains of operations grow the key
+            res = sha256(res.encode()).hexdigest()
+        elif isinstance(o, gguf.utility.LocalTensor):
+            r = o.data_range
+            res = f"local({self.file_id(Path(r.filename))},{r.offset},{r.size},{o.dtype},{o.shape})"
+        elif isinstance(o, (torch.Tensor, np.ndarray)):
+            if o.nbytes > self.max_eager_bytes:
+                raise TensorCache.Uncacheable(f"in-memory tensor of {o.nbytes} bytes")
+            data = o.contiguous().view(torch.uint8).numpy() if isinstance(o, torch.Tensor) else np.ascontiguousarray(o).view(np.uint8)
+            res = f"eager({o.dtype},{tuple(o.shape)},{sha256(data.data).hexdigest()})"
+        elif isinstance(o, (list, tuple)):
+            res = type(o).__name__ + "(" + ",".join(self._id(x, memo) for x in o) + ")"
+        elif isinstance(o, dict):
+            res = "dict(" + ",".join(f"{k!r}:{self._id(v, memo)}" for k, v in sorted(o.items())) + ")"
+        elif isinstance(o, (int, float, complex, str, bytes, bool, slice, torch.dtype, np.dtype, torch.device)) or o is None or o is Ellipsis:
+            res = repr(o)
+        elif isinstance(o, type):
+            res = f"type({o.__module__}.{o.__qualname__})"
+        elif inspect.ismethod(o):
+            res = f"method({self._id(o.__func__, memo)},{self._id(o.__self__, memo)})"
+        elif inspect.isfunction(o):
+            closure = tuple(c.cell_contents for c in o.__closure__ or ())
+            res = f"func({o.__module__}.{o.__qualname__},{self._code_id(o.__code__)},{self._id(o.__defaults__, memo)},{self._id(closure, memo)})"
+        elif callable(o) and hasattr(o, "__qualname__"):
+            # builtins, e.g. torch operators
+            res = f"builtin({getattr(o, '__module__', None)}.{o.__qualname__})"
+        else:
+            raise TensorCache.Uncacheable(f"unknown object of type {type(o).__qualname__}")
+        memo[id(o)] = res
+        return res
+
+    def key(self, name: str, tensor: Any, qtype: gguf.GGMLQuantizationType, endianess: gguf.GGUFEndian) -> str | None:
+        try:
+            tensor_id = self._id(tensor, {})
+        except (TensorCache.Uncacheable, OSError) as e:
+            logger.debug(f"not caching {name}: {e}")
+            return None
+        return sha256(f"{self.code_version}:{name}:{qtype.name}:{endianess.name}:{tensor_id}".encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.bin"
+
+    def content_id(self, filename: Path) -> str:
+        # for small files which are read whole, e.g. the tokenizer files
+        with open(filename, "rb") as f:
+            return sha256(f.read()).hexdigest()
+
+    def load_metadata(self, key: str) -> Any:
+        try:
+            with open(self.path / "metadata" / f"{key}.json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def store_metadata(self, key: str, value: Any):
+        path = self.path / "metadata" / f"{key}.json"
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def lookup(self, key: str, nbytes: int) -> Path | None:
+        path = self._entry_path(key)
+        try:
+            if path.stat().st_size == nbytes:
+                # mark as recently used
+                os.utime(path)
+                self.hits += 1
+                return path
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        return None
+
+    def insert(self, key: str, data: np.ndarray):
+        path = self._entry_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        data.tofile(tmp_path)
+        os.replace(tmp_path, path)
+        self.size += data.nbytes
+        if self.max_size > 0 and self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for f in self.path.glob("*/*.bin"):
+            st = f.stat()
+            entries.append((st.st_mtime_ns, st.st_size, f))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, f in entries:
+            if self.size <= self.max_size:
+                break
+            f.unlink(missing_ok=True)
+            self.size -= size
+
+
+class ConversionJournal:
+    """
+    Journal of the tensors which were completely written to the output files,
+    so that an interrupted conversion can be resumed.
+
+    This is a JSON lines file: the first line describes the output files
+    (the checksum of their header, metadata and tensor infos), the following lines
+    record the shard, offset, size and checksum of each written tensor.
+    """
+
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file: Any = None
+
+    def load(self) -> tuple[dict[str, Any] | None, list[dict[str, Any]]]:
+        if not self.path.is_file():
+            return None, []
+        header = None
+        entries: list[dict[str, Any]] = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line can be truncated if the conversion was interrupted while writing it
+                    break
+                if header is None:
+                    header = record
+                else:
+                    entries.append(record)
+        return header, entries
+
+    def start(self, shards: list[dict[str, Any]], entries: list[dict[str, Any]]):
+        self.close()
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in ({"shards": shards}, *entries):
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def add(self, entry: dict[str, Any]):
+        assert self._file is not None
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+class ConversionWriter(gguf.GGUFWriter):
+    """
+    GGUFWriter which streams the tensors through a read -> compute -> write pipeline.
+
+    Lazy tensors are only materialized when they are written, so this is where the reading,
+    the transformations from modify_tensors and the quantization actually happen.
+    With more than one thread, a reader thread loads the source data of the upcoming tensors,
+    a pool of threads computes and quantizes them, and the results are written as soon as they are ready.
+    The tensors are still written in the same order as the serial writer,
+    so the output is byte-identical.
+
+    With a memory budget, a tensor only enters the pipeline once the estimated memory
+    of the tensors already in it leaves enough room for it.
+
+    When resuming, every written tensor is recorded in a journal next to the output,
+    and the tensors recorded by a previous attempt of the same conversion are skipped.
+
+    With a tensor cache, the tensors converted by a previous conversion are copied from the cache
+    instead of being computed again.
+
+    Tensors which are written exactly as they are in a local safetensors file
+    (see add_tensor_source) are copied from that file, without going through the pipeline.
+
+    With split_count, the tensors are spread over that many shards of about the same size once they are all known,
+    instead of filling the shards one after the other.
+
+    With mmap_output, the output files are preallocated to their final size and memory-mapped,
+    since the offset of every tensor is known from the tensor infos. Each tensor is then written
+    at its offset by the thread which computed it, in whatever order they are ready.
+
+    With sequential_read, the tensors are computed in the order of their data in the model files
+    (see ReadScheduler) and written at their offsets, so the output is the same.
+
+    With a profiler, the reading, computing and writing of every tensor is timed (see ConversionProfiler).
+    """
+
+    n_threads: int
+    max_inflight: int
+    budget: MemoryBudget
+    resume: bool
+    journal: ConversionJournal | None
+    cache: TensorCache | None
+    sources: dict[str, gguf.utility.LocalTensorRange]
+    mmap_output: bool
+    split_count: int
+    sequential_read: bool
+    profiler: ConversionProfiler | None
+
+    def __init__(self, *args, n_threads: int = 1, max_inflight: int | None = None, max_memory: int = 0, resume: bool = False,
+                 cache: TensorCache | None = None, mmap_output: bool = False, split_count: int = 0, sequential_read: bool = False,
+                 profiler: ConversionProfiler | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_threads = max(n_threads, 1)
+        # bound the number of tensors between the reader and the writer, and thus the memory usage
+        self.max_inflight = max_inflight if max_inflight is not None else 2 * self.n_threads
+        self.budget = MemoryBudget(max_memory)
+        self.resume = resume
+        self.journal = None
+        self.cache = cache
+        self.sources = {}
+        self.mmap_output = mmap_output
+        self.split_count = split_count
+        self.shards_planned = False
+        self.sequential_read = sequential_read
+        self.profiler = profiler
+
+    def profile(self, stage: str, tensor: str | None = None, n_bytes: int = 0) -> contextlib.AbstractContextManager[Any]:
+        return self.profiler.span(stage, tensor, n_bytes) if self.profiler is not None else contextlib.nullcontext()
+
+    def plan_shards(self):
+        # Spread the tensors over split_count shards with the same number of bytes as much as possible:
+        # the biggest groups of tensors go first, each to the shard which is the smallest so far.
+        # The tensors of a block are kept together, the other tensors are placed one by one.
+        first = 1 if self.small_first_shard else 0
+        tensors: dict[str, gguf.TensorInfo] = {}
+        for shard in self.tensors[first:]:
+            tensors.update(shard)
+
+        groups: dict[str, list[str]] = {}
+        for name in tensors:
+            block = re.match(r"(?:\w+\.)?blk\.\d+\.", name)
+            groups.setdefault(block.group(0) if block is not None else name, []).append(name)
+        group_sizes = {key: sum(self.ggml_pad(tensors[name].nbytes, self.data_alignment) for name in names) for key, names in groups.items()}
+
+        n_shards = max(min(self.split_count, len(groups)), 1)
+        shards: list[list[str]] = [[] for _ in range(n_shards)]
+        sizes: list[tuple[int, int]] = [(0, i) for i in range(n_shards)]
+        for key in sorted(groups, key=lambda k: group_sizes[k], reverse=True):
+            size, i = heapq.heappop(sizes)
+            shards[i] += groups[key]
+            heapq.heappush(sizes, (size + group_sizes[key], i))
+
+        # keep the order of the tensors, and number the shards in the order of their first tensor
+        order = {name: i for i, name in enumerate(tensors)}
+        shards = sorted((sorted(shard, key=order.__getitem__) for shard in shards if shard), key=lambda shard: order[shard[0]])
+        # without any tensor (e.g. --vocab-only), there's still one file for the metadata
+        self.tensors = self.tensors[:first] + ([{name: tensors[name] for name in shard} for shard in shards] or [{}])
+        self.shards_planned = True
+
+        if len(shards) > 1:
+            smallest, largest = min(sizes)[0], max(sizes)[0]
+            logger.info(f"Balanced {len(tensors)} tensors in {len(groups)} groups over {len(shards)} shards "
+                        f"of {self.format_n_bytes_to_str(smallest)} to {self.format_n_bytes_to_str(largest)}")
+
+    def print_plan(self) -> list[Path]:
+        # the shards are planned once all the tensors are known, right before the output files are opened
+        if self.split_count > 0 and not self.shards_planned:
+            self.plan_shards()
+        return super().print_plan()
+
+    def add_tensor_source(self, name: str, source: gguf.utility.LocalTensor):
+        # the bytes of the tensor added as name are the same as in the source (little-endian) safetensors file
+        if self.endianess == gguf.GGUFEndian.LITTLE:
+            self.sources[name] = source.data_range
+
+    @staticmethod
+    def materialize(tensor: np.ndarray) -> np.ndarray:
+        if isinstance(tensor, gguf.LazyNumpyTensor):
+            data = gguf.LazyNumpyTensor.to_eager(tensor)
+            # the evaluated inputs are kept as args, drop them now instead of when the tensor is written
+            tensor._args = ()
+            tensor._kwargs = {}
+            return data
+        return tensor
+
+    @staticmethod
+    def estimate_memory(tensor: Any) -> int:
+        # upper bound of the memory needed to compute a lazy tensor: the sum of all its not yet computed parts
+        n_bytes = 0
+        seen: set[int] = set()
+        stack: list[Any] = [tensor]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, (list, tuple)):
+                stack.extend(t)
+                continue
+            if isinstance(t, np.ndarray):
+                # eager tensors (e.g. with --no-lazy) are already in memory
+                n_bytes += t.nbytes if t is tensor else 0
+                continue
+            if not isinstance(t, gguf.LazyBase) or t._data is not None or id(t) in seen:
+                continue
+            seen.add(id(t))
+            n_bytes += t._meta.nbytes
+            stack.extend(t._args)
+            stack.extend(t._kwargs.values())
+        return n_bytes
+
+    @staticmethod
+    def read_sources(tensor: Any) -> int:
+        # load the source tensors of a lazy tensor, so that computing it does not wait on I/O
+        n_bytes = 0
+        seen: set[int] = set()
+        stack: list[Any] = [tensor]
+        while stack:
+            t = stack.pop()
+            if isinstance(t, (list, tuple)):
+                stack.extend(t)
+                continue
+            if not isinstance(t, gguf.LazyBase) or t._data is not None or id(t) in seen:
+                continue
+            seen.add(id(t))
+            if len(t._args) == 1 and isinstance(t._args[0], gguf.utility.LocalTensor):
+                t._data = LazyTorchTensor.load_local_tensor(t._args[0], read=True)
+                n_bytes += t._args[0].data_range.size
+            elif len(t._args) == 1 and isinstance(t._args[0], gguf.utility.RemoteTensor):
+                t._data = LazyTorchTensor.to_eager(t)
+                n_bytes += t._args[0].size
+            else:
+                stack.extend(t._args)
+                stack.extend(t._kwargs.values())
+        return n_bytes
+
+    def compute(self, name: str, tensor: np.ndarray, out: tuple[mmap.mmap, int] | None = None) -> tuple[np.ndarray | None, str | None]:
+        # with out, the data is written at that offset of the mapped output, and isn't returned
+        if self.profiler is not None:
+            self.profiler.instrument(name, tensor)
+        data = ConversionWriter.materialize(tensor)
+        digest = None
+        if self.journal is not None:
+            with self.profile("digest", name):
+                digest = sha256(np.ascontiguousarray(data).reshape(-1).view(np.uint8).data).hexdigest()
+        if out is not None:
+            mm, offset = out
+            with self.profile("write", name, data.nbytes):
+                np.ndarray(data.shape, dtype=data.dtype, buffer=mm, offset=offset)[...] = data
+            return None, digest
+        return data, digest
+
+    def _read_stage(self, tensors: Iterable[tuple[int, str, gguf.TensorInfo, int, int]], pool: ThreadPoolExecutor,
+                    ready: queue.SimpleQueue[tuple[Any, Future[tuple[np.ndarray | None, str | None]]]],
+                    slots: Sequence[threading.Semaphore], stop: threading.Event, maps: Sequence[mmap.mmap] | None, ordered: bool,
+                    scheduler: ReadScheduler | None):
+        try:
+            for job in tensors:
+                i, name, ti, offset, n_bytes = job
+                while not slots[i].acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if 0 < self.budget.limit < n_bytes:
+                    logger.warning(f"{name} needs about {self.format_n_bytes_to_str(n_bytes)}, more than the memory budget, converting it alone")
+                if stop.is_set() or not self.budget.acquire(n_bytes, stop):
+                    return
+                assert ti.tensor is not None  # can only iterate once over the tensors
+                if scheduler is not None:
+                    scheduler.start(name)
+                start = time.perf_counter()
+                n_read = ConversionWriter.read_sources(ti.tensor)
+                if self.profiler is not None:
+                    self.profiler.add("read", name, start, time.perf_counter(), n_read)
+                future = pool.submit(self.compute, name, ti.tensor, (maps[i], offset) if maps is not None else None)
+                if ordered:
+                    ready.put((job, future))
+                else:
+                    future.add_done_callback(lambda f, job=job: ready.put((job, f)))
+        except BaseException as e:
+            failed: Future[tuple[np.ndarray | None, str | None]] = Future()
+            failed.set_exception(e)
+            ready.put((None, failed))
+
+    def compute_tensors(self, tensors: Sequence[tuple[int, str, gguf.TensorInfo, int]], maps: Sequence[mmap.mmap] | None = None, ordered: bool = True,
+                        scheduler: ReadScheduler | None = None, per_shard: bool = False,
+                        ) -> Iterator[tuple[tuple[int, str, gguf.TensorInfo, int], tuple[np.ndarray | None, str | None]]]:
+        # yields the computed tensors in the given order, or as soon as they are ready when not ordered.
+        # With the mapped output files, they are written to them instead of being returned.
+        # With per_shard, the tensors in flight are bounded for each shard instead of overall,
+        # so that a shard waiting on its writer doesn't hold back the others
+        if self.n_threads <= 1 and self.budget.limit <= 0:
+            for i, name, ti, offset in tensors:
+                assert ti.tensor is not None  # can only iterate once over the tensors
+                if scheduler is not None:
+                    scheduler.start(name)
+                yield (i, name, ti, offset), self.compute(name, ti.tensor, (maps[i], offset) if maps is not None else None)
+                if scheduler is not None:
+                    scheduler.done(name)
+            return
+
+        # (shard index, name, tensor info, offset, estimated memory)
+        jobs = [(i, name, ti, offset, ConversionWriter.estimate_memory(ti.tensor)) for i, name, ti, offset in tensors]
+        ready: queue.SimpleQueue[tuple[Any, Future[tuple[np.ndarray | None, str | None]]]] = queue.SimpleQueue()
+        n_shards = max((job[0] for job in jobs), default=0) + 1
+        if per_shard:
+            slots = [threading.Semaphore(max(-(-self.max_inflight // n_shards), 2)) for _ in range(n_shards)]
+        else:
+            slots = [threading.Semaphore(self.max_inflight)] * n_shards
+        stop = threading.Event()
+
+        pool = ThreadPoolExecutor(max_workers=self.n_threads, thread_name_prefix="convert")
+        reader = threading.Thread(target=self._read_stage, args=(jobs, pool, ready, slots, stop, maps, ordered, scheduler), name="convert-read", daemon=True)
+        reader.start()
+        try:
+            for _ in jobs:
+                job, future = ready.get()
+                result = future.result()
+                yield job[:-1], result
+                # the tensor was written
+                self.budget.release(job[-1])
+                slots[job[0]].release()
+                if scheduler is not None:
+                    scheduler.done(job[1])
+        finally:
+            stop.set()
+            reader.join()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def interleave_shards(tensors: Sequence[tuple[int, str, gguf.TensorInfo, int]]) -> list[tuple[int, str, gguf.TensorInfo, int]]:
+        # one tensor of each shard in turn, keeping their order within each shard
+        shards: dict[int, list[tuple[int, str, gguf.TensorInfo, int]]] = {}
+        for t in tensors:
+            shards.setdefault(t[0], []).append(t)
+        return [t for ts in zip_longest(*shards.values()) for t in ts if t is not None]
+
+    def write_shards(self, tensors: Iterable[tuple[int, str, gguf.TensorInfo, int, np.ndarray | None, str | None]],
+                     write_copy: Callable[[int, str, gguf.TensorInfo, int], str | None], tensor_written: Callable[..., None]):
+        # one writer thread per shard, writing the tensors at their offsets in whatever order they come;
+        # a tensor without data is copied with write_copy, tensor_written is called from this thread once a tensor is written
+        assert self.fout is not None
+        for fout in self.fout:
+            fout.flush()
+        # a few tensors wait for each writer, so that a slow shard holds back the computation instead of piling up in memory
+        queues: list[queue.Queue[tuple[Any, ...] | None]] = [queue.Queue(maxsize=2) for _ in self.fout]
+        written: queue.SimpleQueue[tuple[tuple[Any, ...], BaseException | None]] = queue.SimpleQueue()
+
+        def writer(i: int):
+            assert self.fout is not None
+            fd = self.fout[i].fileno()
+            failed = False
+            while (job := queues[i].get()) is not None:
+                # keep consuming after a failure, so that nothing blocks on this queue
+                if failed:
+                    continue
+                _, name, ti, offset, data, digest = job
+                try:
+                    if data is None:
+                        digest = write_copy(i, name, ti, offset)
+                    else:
+                        with self.profile("write", name, ti.nbytes):
+                            buf = memoryview(np.ascontiguousarray(data).reshape(-1).view(np.uint8))
+                            while len(buf) > 0:
+                                n = os.pwrite(fd, buf, offset)
+                                buf = buf[n:]
+                                offset += n
+                            del buf
+                    written.put(((i, name, ti, job[3], data, digest), None))
+                except BaseException as e:
+                    failed = True
+                    written.put((job, e))
+
+        def finish(job: tuple[Any, ...], error: BaseException | None):
+            if error is not None:
+                raise error
+            tensor_written(*job)
+
+        threads = [threading.Thread(target=writer, args=(i,), name=f"convert-write-{i}", daemon=True) for i in range(len(self.fout))]
+        for thread in threads:
+            thread.start()
+        n_pending = 0
+        try:
+            for job in tensors:
+                while True:
+                    try:
+                        queues[job[0]].put(job, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                    finally:
+                        while not written.empty():
+                            n_pending -= 1
+                            finish(*written.get())
+                n_pending += 1
+                del job
+            while n_pending > 0:
+                n_pending -= 1
+                finish(*written.get())
+        finally:
+            for q in queues:
+                q.put(None)
+            for thread in threads:
+                thread.join()
+
+    def map_output_files(self, sizes: Sequence[int]) -> list[mmap.mmap]:
+        # preallocate the output files to their final size, and map them to write the tensors in place
+        assert self.fout is not None
+        maps: list[mmap.mmap] = []
+        for fout, size in zip(self.fout, sizes):
+            fout.flush()
+            # the output files are usually opened write-only, which isn't enough to map them
+            fd = os.open(fout.name, os.O_RDWR | getattr(os, "O_BINARY", 0))
+            try:
+                if hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(fd, 0, size)
+                    except OSError:
+                        # e.g. not supported by the file system, the blocks are then allocated when written
+                        pass
+                # also drops anything past the end, e.g. when resuming
+                os.ftruncate(fd, size)
+                maps.append(mmap.mmap(fd, size))
+            finally:
+                os.close(fd)
+        return maps
+
+    def log_peak_memory(self):
+        msg = []
+        if self.budget.peak > 0:
+            limit = f" (limit: {self.format_n_bytes_to_str(self.budget.limit)})" if self.budget.limit > 0 else ""
+            msg.append(f"{self.format_n_bytes_to_str(self.budget.peak)} in tensors being converted{limit}")
+        if (peak_rss := get_peak_rss()) is not None:
+            msg.append(f"{self.format_n_bytes_to_str(peak_rss)} peak RSS")
+        if msg:
+            logger.info(f"Peak memory usage: {', '.join(msg)}")
+
+    def open_output_file(self, path: Path | None = None) -> None:
+        if not self.resume:
+            return super().open_output_file(path)
+
+        if self.state is gguf.WriterState.EMPTY and self.fout is not None and (path is None or path == self.path):
+            # allow calling this multiple times as long as the path is the same
+            return
+
+        if self.state is not gguf.WriterState.NO_FILE:
+            raise ValueError(f'Expected output file to be not yet opened, got {self.state}')
+
+        if path is not None:
+            self.path = path
+
+        if self.path is not None:
+            filenames = self.print_plan()
+            self.journal = ConversionJournal(self.path.with_name(self.path.name + ".journal"))
+            # keep the existing files if there's something to resume from; the header is rewritten identically
+            can_resume = self.journal.path.is_file() and all(f.is_file() for f in filenames)
+            self.fout = [open(filename, "r+b" if can_resume else "w+b") for filename in filenames]
+            self.state = gguf.WriterState.EMPTY
+
+    def resume_from_journal(self, tensors: Sequence[tuple[int, str, gguf.TensorInfo, int]], data_offsets: Sequence[int]) -> set[str]:
+        # returns the names of the tensors which are already in the output files
+        assert self.journal is not None
+        assert self.fout is not None
+
+        # the header, the metadata and the tensor infos identify the conversion
+        shards: list[dict[str, Any]] = []
+        for fout, data_offset in zip(self.fout, data_offsets):
+            fout.flush()
+            shards.append({
+                "file": Path(fout.name).name,
+                "data_offset": data_offset,
+                "sha256": sha256(os.pread(fout.fileno(), data_offset, 0)).hexdigest(),
+            })
+
+        header, entries = self.journal.load()
+        done: set[str] = set()
+        if header is not None and header.get("shards") == shards:
+            expected = {name: (i, offset, ti.nbytes) for i, name, ti, offset in tensors}
+            last: dict[int, dict[str, Any]] = {}
+            for entry in entries:
+                name = entry.get("name")
+                if name in expected and expected[name] == (entry.get("shard"), entry.get("offset"), entry.get("nbytes")):
+                    done.add(name)
+                    last[entry["shard"]] = entry
+            # the data of the other tensors was synced before journaling them, but double check the last one of each shard
+            for i, entry in last.items():
+                data = os.pread(self.fout[i].fileno(), entry["nbytes"], entry["offset"])
+                if len(data) != entry["nbytes"] or sha256(data).hexdigest() != entry.get("sha256"):
+                    logger.warning(f"{entry['name']} is incomplete in the output, converting it again")
+                    done.discard(entry["name"])
+            logger.info(f"Resuming conversion, {len(done)} of {len(tensors)} tensors are already written")
+            self.journal.start(shards, [e for e in entries if e.get("name") in done])
+        else:
+            if header is not None:
+                logger.warning(f"{self.journal.path} is for a different conversion, starting over")
+            self.journal.start(shards, [])
+        return done
+
+    # the element type of metadata arrays given as numpy arrays
+    array_value_types: dict[np.dtype, gguf.GGUFValueType] = {
+        np.dtype(np.uint8): gguf.GGUFValueType.UINT8,
+        np.dtype(np.int8): gguf.GGUFValueType.INT8,
+        np.dtype(np.uint16): gguf.GGUFValueType.UINT16,
+        np.dtype(np.int16): gguf.GGUFValueType.INT16,
+        np.dtype(np.uint32): gguf.GGUFValueType.UINT32,
+        np.dtype(np.int32): gguf.GGUFValueType.INT32,
+        np.dtype(np.float32): gguf.GGUFValueType.FLOAT32,
+        np.dtype(np.uint64): gguf.GGUFValueType.UINT64,
+        np.dtype(np.int64): gguf.GGUFValueType.INT64,
+        np.dtype(np.float64): gguf.GGUFValueType.FLOAT64,
+        np.dtype(np.bool_): gguf.GGUFValueType.BOOL,
+    }
+
+    def _pack_val(self, val: Any, vtype: gguf.GGUFValueType, add_vtype: bool, sub_type: gguf.GGUFValueType | None = None) -> bytes:
+        # big arrays (e.g. the vocab) are packed at once instead of one item at a time
+        if vtype == gguf.GGUFValueType.ARRAY and sub_type is None and len(val) > 0:
+            byteorder = ">" if self.endianess == gguf.GGUFEndian.BIG else "<"
+            if isinstance(val, PackedTokens):
+                lengths = np.diff(val.offsets)
+                packed = np.empty(8 * len(val) + len(val.data), dtype=np.uint8)
+                # each string is its length followed by its bytes
+                starts = val.offsets[:-1] + 8 * np.arange(len(val))
+                packed[starts[:, None] + np.arange(8)] = lengths.astype(f"{byteorder}u8").view(np.uint8).reshape(-1, 8)
+                packed[np.arange(len(val.data)) + 8 * np.repeat(np.arange(1, len(val) + 1), lengths)] = np.frombuffer(val.data, dtype=np.uint8)
+                ltype = gguf.GGUFValueType.STRING
+            elif isinstance(val, np.ndarray) and (ltype := self.array_value_types.get(val.dtype)) is not None:
+                packed = val.astype(val.dtype.newbyteorder(byteorder), copy=False)
+            else:
+                return super()._pack_val(val, vtype, add_vtype, sub_type)
+            kv_data = bytearray()
+            if add_vtype:
+                kv_data += self._pack("I", vtype)
+            kv_data += self._pack("I", ltype)
+            kv_data += self._pack("Q", len(val))
+            kv_data += packed.tobytes()
+            return bytes(kv_data)
+        return super()._pack_val(val, vtype, add_vtype, sub_type)
+
+    def write_tensors_to_file(self, *, progress: bool = False) -> None:
+        if self.temp_file is not None:
+            super().write_tensors_to_file(progress=progress)
+            self.log_peak_memory()
+            return
+
+        self.write_ti_data_to_file()
+
+        assert self.fout is not None
+
+        for fout in self.fout:
+            self.write_padding(fout, fout.tell())
+
+        # (shard index, name, tensor info, offset) in the order they have to be written
+        tensors: list[tuple[int, str, gguf.TensorInfo, int]] = []
+        data_offsets: list[int] = []
+        data_ends: list[int] = []
+        for i, (fout, shard) in enumerate(zip(self.fout, self.tensors)):
+            offset = fout.tell()
+            data_offsets.append(offset)
+            for name, ti in shard.items():
+                tensors.append((i, name, ti, offset))
+                offset += self.ggml_pad(ti.nbytes, self.data_alignment)
+            data_ends.append(offset)
+
+        done: set[str] = set()
+        if self.journal is not None:
+            done = self.resume_from_journal(tensors, data_offsets)
+
+        bar = None
+
+        if progress:
+            from tqdm import tqdm
+
+            total_bytes = sum(ti.nbytes for t in self.tensors for ti in t.values())
+
+            # the shards are written concurrently, so there's only an overall progress
+            bar = tqdm(desc="Writing" if len(self.fout) == 1 else f"Writing {len(self.fout)} shards", total=total_bytes, unit="byte", unit_scale=True)
+            bar.update(sum(ti.nbytes for _, name, ti, _ in tensors if name in done))
+
+        todo: list[tuple[int, str, gguf.TensorInfo, int]] = []
+        for t in tensors:
+            if t[1] in done:
+                t[2].tensor = None
+            else:
+                todo.append(t)
+
+        # (file, offset) of the tensors which are copied instead of computed
+        copied: dict[str, tuple[Path, int]] = {}
+        for _, name, ti, _ in todo:
+            if (source := self.sources.get(name)) is not None and source.size == ti.nbytes:
+                copied[name] = (Path(source.filename), source.offset)
+        if len(copied) > 0:
+            logger.info(f"Copying {len(copied)} tensors as is from the model files")
+
+        # look up the tensors in the cache before computing anything, computing them consumes their lazy graph
+        cache_keys: dict[str, str] = {}
+        if self.cache is not None:
+            for _, name, ti, _ in todo:
+                if name in copied:
+                    continue
+                if (key := self.cache.key(name, ti.tensor, ti.dtype, self.endianess)) is not None:
+                    cache_keys[name] = key
+                    if (path := self.cache.lookup(key, ti.nbytes)) is not None:
+                        copied[name] = (path, 0)
+
+        def write_copy(i: int, name: str, ti: gguf.TensorInfo, offset: int) -> str | None:
+            assert self.fout is not None
+            path, src_offset = copied[name]
+            fout = self.fout[i]
+            fout.flush()
+            with self.profile("copy", name, ti.nbytes), open(path, "rb") as f:
+                copy_file_range(f.fileno(), fout.fileno(), ti.nbytes, src_offset, offset)
+            if scheduler is not None:
+                scheduler.drop(path, src_offset, ti.nbytes)
+            if self.journal is None:
+                return None
+            with self.profile("digest", name):
+                return sha256(os.pread(fout.fileno(), ti.nbytes, offset)).hexdigest()
+
+        def tensor_written(i: int, name: str, ti: gguf.TensorInfo, offset: int, data: np.ndarray | None, digest: str | None):
+            assert self.fout is not None
+            if bar is not None:
+                bar.update(ti.nbytes)
+            if data is not None and self.cache is not None and (key := cache_keys.get(name)) is not None:
+                with self.profile("cache", name, ti.nbytes):
+                    self.cache.insert(key, data)
+            ti.tensor = None
+
+            if self.journal is not None:
+                # the data must be on disk before it's recorded as written
+                with self.profile("sync", name):
+                    if maps is not None:
+                        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                        maps[i].flush(start, offset + ti.nbytes - start)
+                    else:
+                        self.fout[i].flush()
+                    os.fsync(self.fout[i].fileno())
+                self.journal.add({"shard": i, "name": name, "offset": offset, "nbytes": ti.nbytes, "sha256": digest})
+
+        computed_todo = [t for t in todo if t[1] not in copied]
+        copied_todo = [t for t in todo if t[1] in copied]
+        scheduler = None
+        if self.sequential_read:
+            scheduler = ReadScheduler({name: ReadScheduler.sources(ti.tensor) for _, name, ti, _ in computed_todo})
+            rank = {name: r for r, name in enumerate(scheduler.order)}
+            computed_todo.sort(key=lambda t: rank[t[1]])
+            copied_todo.sort(key=lambda t: (str(copied[t[1]][0]), copied[t[1]][1]))
+        maps = self.map_output_files(data_ends) if self.mmap_output else None
+        # the shards are written concurrently, each tensor at its offset as soon as it's ready
+        concurrent_shards = maps is None and (len(self.fout) > 1 or scheduler is not None)
+        # feed all the writers at the same time, instead of one shard after the other
+        per_shard = concurrent_shards and len(self.fout) > 1 and scheduler is None
+        if per_shard:
+            computed_todo = ConversionWriter.interleave_shards(computed_todo)
+            copied_todo = ConversionWriter.interleave_shards(copied_todo)
+        try:
+            with contextlib.closing(self.compute_tensors(computed_todo, maps, ordered=maps is None and not concurrent_shards, scheduler=scheduler,
+                                                         per_shard=per_shard)) as computed:
+                if concurrent_shards:
+                    copies = ((i, name, ti, offset, None, None) for i, name, ti, offset in copied_todo)
+                    results = ((i, name, ti, offset, data, digest) for (i, name, ti, offset), (data, digest) in computed)
+                    self.write_shards(chain(copies, results), write_copy, tensor_written)
+                    for fout, end in zip(self.fout, data_ends):
+                        # the padding after the last tensor
+                        os.ftruncate(fout.fileno(), end)
+                elif maps is not None:
+                    # the padding is already zeroed in the preallocated files, and the order doesn't matter
+                    for i, name, ti, offset in copied_todo:
+                        tensor_written(i, name, ti, offset, None, write_copy(i, name, ti, offset))
+                    for (i, name, ti, offset), (data, digest) in computed:
+                        if data is None and self.cache is not None and name in cache_keys:
+                            data = np.frombuffer(maps[i], dtype=np.uint8, count=ti.nbytes, offset=offset)
+                        tensor_written(i, name, ti, offset, data, digest)
+                        del data
+                else:
+                    for i, name, ti, offset in todo:
+                        fout = self.fout[i]
+                        if name in copied:
+                            data, digest = None, write_copy(i, name, ti, offset)
+                            fout.seek(offset + ti.nbytes)
+                        else:
+                            _, (data, digest) = next(computed)
+                            assert data is not None and data.nbytes == ti.nbytes
+
+                            with self.profile("write", name, ti.nbytes):
+                                if fout.tell() != offset:
+                                    fout.seek(offset)
+                                data.tofile(fout)
+                        self.write_padding(fout, ti.nbytes)
+                        tensor_written(i, name, ti, offset, data, digest)
+                        del data
+        finally:
+            for mm in maps or ():
+                mm.close()
+            if scheduler is not None:
+                scheduler.close()
+
+        if self.cache is not None:
+            logger.info(f"Tensor cache: {self.cache.hits} hits, {self.cache.misses} misses, {self.format_n_bytes_to_str(self.cache.size)} in {self.cache.path}")
+
+        if self.journal is not None:
+            for fout, end in zip(self.fout, data_ends):
+                # drop anything left over from a previous attempt
+                fout.truncate(end)
+            self.flush()
+            self.journal.remove()
+
+        self.state = gguf.WriterState.WEIGHTS
+        self.log_peak_memory()
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Convert a huggingface model to a GGML compatible file")
@@ -10458,6 +12339,38 @@ def parse_args() -> argparse.Namespace:
         "--split-max-size", type=str, default="0",
         help="max size per split N(M|G)",
     )
+    parser.add_argument(
+        "--threads", type=int, default=1,
+        help="number of threads used to compute and quantize the tensors while writing them. With more than 1 thread, reading, computing and writing the tensors overlap (default: 1)",
+    )
+    parser.add_argument(
+        "--max-memory", type=str, default="0",
+        help="approximate memory budget N(K|M|G) for the tensors being converted at the same time. Tensors are scheduled to stay under it, and the peak usage is reported (default: no limit)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="record the written tensors in a journal next to the output file(s), and if a previous run of the same conversion was interrupted, only write the tensors which are missing",
+    )
+    parser.add_argument(
+        "--mmap-output", action="store_true",
+        help="preallocate the output file(s) and memory-map them, so that each tensor is written at its final offset by the thread which computed it, as soon as it's ready",
+    )
+    parser.add_argument(
+        "--sequential-read", action="store_true",
+        help="convert the tensors in the order of their data in the model files instead of the order of the output, reading ahead the next ones and dropping the pages of the model files once used, which helps on hard drives and keeps the page cache from growing to the size of the model",
+    )
+    parser.add_argument(
+        "--cache-dir", type=Path, default=None,
+        help="directory of a cache of the converted tensors, shared between conversions. Tensors converted the same way from the same files are copied from it instead of being computed again, and the vocab is reused without loading the tokenizer",
+    )
+    parser.add_argument(
+        "--cache-max-size", type=str, default="0",
+        help="max size N(K|M|G) of the tensor cache, the least recently used tensors are evicted when it's over (default: no limit)",
+    )
+    parser.add_argument(
+        "--split-count", type=int, default=0,
+        help="number of shards of about the same size to split the output in, keeping the tensors of each block in the same shard. Can't be used with --split-max-tensors or --split-max-size",
+    )
     parser.add_argument(
         "--dry-run", action="store_true",
         help="only print out a split plan and exit, without writing any new files",
@@ -10478,6 +12391,19 @@ def parse_args() -> argparse.Namespace:
         "--remote", action="store_true",
         help="(Experimental) Read safetensors file remotely without downloading to disk. Config and tokenizer files will still be downloaded. To use this feature, you need to specify Hugging Face model repo name instead of a local directory. For example: 'HuggingFaceTB/SmolLM2-1.7B-Instruct'. Note: To access gated repo, set HF_TOKEN environment variable to your Hugging Face token.",
     )
+    parser.add_argument(
+        "--remote-connections", type=int, default=8,
+        help="with --remote, number of concurrent HTTP range requests fetching the tensor data",
+    )
+    parser.add_argument(
+        "--remote-cache-dir", type=Path, default=None,
+        help="with --remote, directory where the fetched tensor data is kept, so that it's not fetched again by later conversions of the same files. By default, it's spilled to a temporary directory removed at the end",
+    )
+    parser.add_argument(
+        "--profile", type=Path, default=None, metavar="TRACE_JSON",
+        help="time the reading, computing and writing of every tensor: log a summary at the end, with the bytes read and written and the peak memory, "
+             "and write a trace of the conversion to TRACE_JSON, in the Chrome trace event format (e.g. for chrome://tracing or Perfetto)",
+    )
     parser.add_argument(
         "--mmproj", action="store_true",
         help="(Experimental) Export multimodal projector (mmproj) for vision models. This will only work on some vision models. A prefix 'mmproj-' will be added to the output file name.",
@@ -10560,8 +12486,13 @@ def main() -> None:
     else:
         logging.basicConfig(level=logging.INFO)
 
+    remote_fetcher = None
     if args.remote:
         hf_repo_id = args.model
+        if (endpoint := os.environ.get("HF_ENDPOINT")):
+            # e.g. a mirror of the Hub; snapshot_download also uses it
+            gguf.utility.SafetensorRemote.BASE_DOMAIN = endpoint.rstrip("/")
+        remote_fetcher = RemoteFetcher(n_connections=args.remote_connections, cache_dir=args.remote_cache_dir)
         from huggingface_hub import snapshot_download
         allowed_patterns = ["LICENSE", "*.json", "*.md", "*.txt", "tokenizer.model"]
         if args.sentence_transformers_dense_modules:
@@ -10590,11 +12521,32 @@ def main() -> None:
         "auto": gguf.LlamaFileType.GUESSED,
     }
 
-    is_split = args.split_max_tensors > 0 or args.split_max_size != "0"
+    is_split = args.split_max_tensors > 0 or args.split_max_size != "0" or args.split_count > 1
+    if args.split_count > 0 and (args.split_max_tensors > 0 or args.split_max_size != "0"):
+        logger.error("Error: Cannot use --split-count with --split-max-tensors or --split-max-size")
+        sys.exit(1)
+
     if args.use_temp_file and is_split:
         logger.error("Error: Cannot use temp file when splitting")
         sys.exit(1)
 
+    if args.use_temp_file and args.resume:
+        logger.error("Error: Cannot use temp file when resuming")
+        sys.exit(1)
+
+    if args.use_temp_file and args.mmap_output:
+        logger.error("Error: Cannot use temp file with a memory-mapped output")
+        sys.exit(1)
+
+    if args.no_lazy and args.max_memory != "0":
+        logger.warning("--max-memory can't be enforced with --no-lazy, all the tensors are computed before writing")
+
+    tensor_cache = None
+    if args.cache_dir is not None:
+        if args.no_lazy:
+            logger.warning("tensors are not cached with --no-lazy, they are computed before writing")
+        tensor_cache = TensorCache(args.cache_dir, max_size=split_str_to_n_bytes(args.cache_max_size))
+
     if args.outfile is not None:
         fname_out = args.outfile
     elif hf_repo_id:
@@ -10610,7 +12562,9 @@ def main() -> None:
         raise ImportError(_mistral_import_error_msg)
     disable_mistral_community_chat_template = args.disable_mistral_community_chat_template
 
-    with torch.inference_mode():
+    profiler = ConversionProfiler() if args.profile is not None else None
+
+    with torch.inference_mode(), remote_fetcher or contextlib.nullcontext():
         output_type = ftype_map[args.outtype]
         model_type = ModelType.MMPROJ if args.mmproj else ModelType.TEXT
         hparams = ModelBase.load_hparams(dir_model, is_mistral_format)
@@ -10638,7 +12592,10 @@ def main() -> None:
                                      split_max_size=split_str_to_n_bytes(args.split_max_size), dry_run=args.dry_run,
                                      small_first_shard=args.no_tensor_first_split,
                                      remote_hf_model_id=hf_repo_id, disable_mistral_community_chat_template=disable_mistral_community_chat_template,
-                                     sentence_transformers_dense_modules=args.sentence_transformers_dense_modules
+                                     sentence_transformers_dense_modules=args.sentence_transformers_dense_modules,
+                                     n_threads=args.threads, max_memory=split_str_to_n_bytes(args.max_memory),
+                                     resume=args.resume, tensor_cache=tensor_cache, mmap_output=args.mmap_output, split_count=args.split_count,
+                                     sequential_read=args.sequential_read, remote_fetcher=remote_fetcher, profiler=profiler,
                                      )
 
         if args.vocab_only:
@@ -10651,6 +12608,11 @@ def main() -> None:
             out_path = f"{model_instance.fname_out.parent}{os.sep}" if is_split else model_instance.fname_out
             logger.info(f"Model successfully exported to {out_path}")
 
+    if profiler is not None:
+        profiler.end = time.perf_counter()
+        profiler.log_summary()
+        profiler.write_trace(args.profile)
+
 
 if __name__ == '__main__':
     main()